@@ -0,0 +1,128 @@
+import os
+import random
+import datetime
+import tempfile
+
+from tickets.storage import open_storage
+
+"""
+Scratch database management for the benchmarks.
+
+The schema and seed data are loaded from the `data/` sql scripts into a dedicated database,
+which is dropped and recreated before each benchmark case.
+"""
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+PROTECTED_DATABASES = ("TicketRegistry", )
+
+
+def _statements(script, database):
+    with open(os.path.join(DATA_DIR, script)) as f:
+        sql = f.read().replace("USE TicketRegistry;", "USE {};".format(database))
+    for statement in sql.split(';\n'):
+        if statement.strip():
+            yield statement
+
+
+class MySQLScratch(object):
+    """
+    A local MySQL database used as the benchmark backend.
+
+    Parameters
+    ----------
+    dbopts: dict
+        Connection options, in the same form as the bot's `dbopts`.
+        The `database` option names the scratch database, which will be dropped.
+    """
+    name = "mysql"
+
+    def __init__(self, dbopts):
+        if dbopts['database'] in PROTECTED_DATABASES:
+            raise ValueError("Refusing to use `{}` as a scratch database.".format(dbopts['database']))
+        self.dbopts = dbopts
+
+    def reset(self):
+        """
+        Drop and recreate the scratch database with a fresh schema and seed data.
+        """
+        import mysql.connector
+
+        opts = dict(self.dbopts)
+        database = opts.pop('database')
+        conn = mysql.connector.connect(**opts)
+        with conn.cursor() as cursor:
+            cursor.execute("DROP DATABASE IF EXISTS {}".format(database))
+            cursor.execute("CREATE DATABASE {}".format(database))
+            for script in ('createdb.sql', 'seeddata.sql'):
+                for statement in _statements(script, database):
+                    cursor.execute(statement)
+        conn.commit()
+        conn.close()
+
+    def storage(self):
+        return open_storage('mysql', **self.dbopts)
+
+    def seed_tickets(self, guild_id, moderator_ids, victim_ids, count, resolved_ratio=0.5, start_id=1):
+        """
+        Bulk insert `count` tickets directly into the scratch database.
+        Returns the number of the last ticket inserted.
+        """
+        storage = self.storage()
+        _seed_tickets(storage, guild_id, moderator_ids, victim_ids, count, resolved_ratio, start_id)
+        storage.close()
+        return start_id + count - 1
+
+
+class SQLiteScratch(object):
+    """
+    A temporary SQLite database used as the benchmark backend.
+    """
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.mkdtemp(prefix="ticketbot-bench-"), 'tickets.db')
+
+    def reset(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        # Opening the database creates the schema
+        self.storage().close()
+
+    def storage(self):
+        return open_storage('sqlite', path=self.path)
+
+    def seed_tickets(self, guild_id, moderator_ids, victim_ids, count, resolved_ratio=0.5, start_id=1):
+        storage = self.storage()
+        _seed_tickets(storage, guild_id, moderator_ids, victim_ids, count, resolved_ratio, start_id)
+        storage.close()
+        return start_id + count - 1
+
+
+def _seed_tickets(storage, guild_id, moderator_ids, victim_ids, count, resolved_ratio, start_id):
+    rng = random.Random(count)
+    created = datetime.datetime(2020, 1, 1)
+    rows = []
+    for ticketid in range(start_id, start_id + count):
+        resolved = rng.random() < resolved_ratio
+        rows.append((
+            guild_id,
+            ticketid,
+            rng.choice((0, 1, 2)),
+            rng.choice(moderator_ids),
+            rng.choice(victim_ids),
+            ticketid,
+            resolved,
+            "Seeded reason {}".format(ticketid) if resolved else None,
+            storage.dt_to_timestamp(created + datetime.timedelta(seconds=ticketid))
+        ))
+    storage.execute(
+        "seed_tickets",
+        "INSERT INTO Tickets "
+        "(guild_id, guild_ticket_id, action_id, moderator_id, victim_id, "
+        "modlog_msg_id, resolved, reason, created_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+        rows,
+        many=True
+    )
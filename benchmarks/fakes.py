@@ -0,0 +1,342 @@
+import asyncio
+import datetime
+
+import discord
+
+"""
+Minimal stand-ins for the parts of the discord.py client used by the `TicketInterface`.
+
+These do no network I/O. Sends and edits complete immediately,
+with an optional simulated REST latency,
+so that the benchmarks measure the bot's own overhead.
+"""
+
+
+_last_snowflake = 0
+
+
+def next_snowflake():
+    """
+    Generate increasing snowflakes which track the current time,
+    so that they compare correctly with the audit log reader's watermarks.
+    """
+    global _last_snowflake
+    _last_snowflake = max(_last_snowflake + 1, discord.utils.time_snowflake(datetime.datetime.utcnow()))
+    return _last_snowflake
+
+
+class FakeUser(object):
+    def __init__(self, userid, name=None, bot=False, client=None):
+        self.id = userid
+        self.name = name or "user{}".format(userid)
+        self.discriminator = "0001"
+        self.bot = bot
+        self.client = client
+
+    @property
+    def mention(self):
+        return "<@{}>".format(self.id)
+
+    def __str__(self):
+        return "{}#{}".format(self.name, self.discriminator)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def send(self, content=None, embed=None):
+        await self.client.rest_call()
+        return FakeMessage(self.client, None, content=content, embed=embed)
+
+
+class FakeMember(FakeUser):
+    def __init__(self, user, guild, roles=(), nick=None):
+        super().__init__(user.id, name=user.name, bot=user.bot, client=user.client)
+        self.guild = guild
+        self._roles = [role.id for role in roles]
+        self.nick = nick
+
+    @property
+    def roles(self):
+        # Rebuilt on every access, like `discord.Member.roles`
+        return sorted(
+            (self.guild.get_role(roleid) for roleid in self._roles if self.guild.get_role(roleid) is not None),
+            key=lambda role: role.id
+        )
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.client.rest_call()
+        self.guild.add_entry(FakeAuditLogEntry(
+            discord.AuditLogAction.member_role_update, self.client.user, self, reason=reason, roles_removed=roles
+        ))
+
+
+class FakeRole(object):
+    def __init__(self, roleid, name=None):
+        self.id = roleid
+        self.name = name or "role{}".format(roleid)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeMessage(object):
+    def __init__(self, client, channel, content=None, embed=None, author=None):
+        self.id = next_snowflake()
+        self.client = client
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.author = author or client.user
+
+    @property
+    def embeds(self):
+        return [self.embed] if self.embed is not None else []
+
+    async def edit(self, content=None, embed=None):
+        await self.client.rest_call()
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+
+    async def delete(self):
+        await self.client.rest_call()
+
+
+class FakeChannel(object):
+    type = discord.ChannelType.text
+
+    def __init__(self, client, channelid):
+        self.id = channelid
+        self.client = client
+        self.messages = {}
+
+    async def send(self, content=None, embed=None):
+        await self.client.rest_call()
+        message = FakeMessage(self.client, self, content=content, embed=embed)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, msgid):
+        await self.client.rest_call()
+        message = self.messages.get(msgid, None)
+        if message is None:
+            # Messages posted before the benchmark started, e.g. seeded tickets
+            message = self.messages[msgid] = FakeMessage(self.client, self)
+            message.id = msgid
+        return message
+
+    async def history(self, limit=100, after=None):
+        """
+        Messages posted by the fake client, oldest first, ignoring `after`.
+        """
+        await self.client.rest_call()
+        for message in list(self.messages.values())[:limit]:
+            yield message
+
+
+class FakeDMChannel(FakeChannel):
+    type = discord.ChannelType.private
+
+
+class FakeContext(object):
+    """
+    Stand-in for a command `Context`, as used by the interactive utilities.
+    """
+    def __init__(self, client, author, channel):
+        self.client = client
+        self.author = author
+        self.ch = channel
+
+    async def reply(self, content=None, embed=None):
+        return await self.ch.send(content=content, embed=embed)
+
+
+class _RoleDiff(object):
+    def __init__(self, roles):
+        self.roles = roles
+
+
+class FakeAuditLogEntry(object):
+    def __init__(self, action, user, target, reason=None, created_at=None, roles_added=(), roles_removed=()):
+        self.id = next_snowflake()
+        self.created_at = created_at or discord.utils.snowflake_time(self.id)
+        self.action = action
+        self.user = user
+        self.target = target
+        self.reason = reason
+        # For member_role_update entries, `before` holds the removed roles and `after` the added ones
+        self.before = _RoleDiff(list(roles_removed))
+        self.after = _RoleDiff(list(roles_added))
+
+
+class FakeGuild(object):
+    def __init__(self, client, guildid, modlog, roles=()):
+        self.id = guildid
+        self.name = "guild{}".format(guildid)
+        self.client = client
+        self.modlog = modlog
+        self.roles = []
+        self._roles_by_id = {}
+        for role in roles:
+            self.add_role(role)
+        self.entries = []  # Audit log entries, oldest first
+
+    def __str__(self):
+        return self.name
+
+    def add_entry(self, entry):
+        self.entries.append(entry)
+        return entry
+
+    def add_role(self, role):
+        self.roles.append(role)
+        self._roles_by_id[role.id] = role
+        return role
+
+    def get_role(self, roleid):
+        return self._roles_by_id.get(roleid, None)
+
+    def get_member(self, userid):
+        return None
+
+    async def fetch_member(self, userid):
+        user = await self.client.fetch_user(userid)
+        return FakeMember(user, self)
+
+    async def unban(self, user, reason=None):
+        await self.client.rest_call()
+        self.add_entry(FakeAuditLogEntry(discord.AuditLogAction.unban, self.client.user, user, reason=reason))
+
+    async def audit_logs(self, limit=100, before=None, after=None, oldest_first=None, user=None, action=None):
+        """
+        Iterate over the audit log, applying the same filters as `discord.Guild.audit_logs`.
+        Simulates one REST call per page of 100 entries.
+        """
+        if isinstance(after, datetime.datetime):
+            after = discord.utils.time_snowflake(after, high=True)
+        if isinstance(before, datetime.datetime):
+            before = discord.utils.time_snowflake(before, high=False)
+        after = getattr(after, 'id', after)
+        before = getattr(before, 'id', before)
+
+        entries = [
+            entry for entry in self.entries
+            if (not after or entry.id > after)
+            and (not before or entry.id < before)
+            and (user is None or entry.user.id == user.id)
+            and (action is None or entry.action == action)
+        ]
+        if not (oldest_first or (oldest_first is None and after)):
+            entries.reverse()
+        if limit is not None:
+            entries = entries[:limit]
+
+        for i, entry in enumerate(entries):
+            if i % 100 == 0:
+                await self.client.rest_call()
+            yield entry
+
+
+class FakeClient(object):
+    """
+    Stand-in for the `cmdClient`, providing the cache lookups,
+    event registration and `wait_for` used by the `TicketInterface`.
+
+    Parameters
+    ----------
+    rest_latency: float
+        Simulated latency, in seconds, of each Discord REST call.
+    cache_users: bool
+        Whether `get_user` finds the added users, as with a full member cache.
+        Otherwise users may only be fetched.
+    """
+    def __init__(self, rest_latency=0, cache_users=True):
+        self.rest_latency = rest_latency
+        self.cache_users = cache_users
+        self.rest_calls = 0
+
+        self.user = FakeUser(next_snowflake(), name="TicketBot", bot=True, client=self)
+        self.users = {}
+        self.guilds = {}
+        self.channels = {}
+        self.after_events = {}
+        self.waiters = []
+
+    async def rest_call(self):
+        self.rest_calls += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+        else:
+            await asyncio.sleep(0)
+
+    def add_after_event(self, event, func):
+        self.after_events.setdefault(event, []).append(func)
+
+    async def dispatch_after(self, event, *args):
+        for func in self.after_events.get(event, []):
+            await func(self, *args)
+
+    def add_user(self, userid=None, bot=False):
+        user = FakeUser(userid or next_snowflake(), bot=bot, client=self)
+        self.users[user.id] = user
+        return user
+
+    def add_guild(self, guildid=None, roles=()):
+        modlog = FakeChannel(self, next_snowflake())
+        self.channels[modlog.id] = modlog
+        guild = FakeGuild(self, guildid or next_snowflake(), modlog, roles=roles)
+        self.guilds[guild.id] = guild
+        return guild
+
+    def get_user(self, userid):
+        return self.users.get(userid, None) if self.cache_users else None
+
+    def get_guild(self, guildid):
+        return self.guilds.get(guildid, None)
+
+    def get_channel(self, channelid):
+        return self.channels.get(channelid, None)
+
+    async def fetch_user(self, userid):
+        await self.rest_call()
+        user = self.users.get(userid, None)
+        if user is None:
+            raise discord.NotFound(_FakeResponse(404), "Unknown User")
+        return user
+
+    async def wait_for(self, event, check=None, timeout=None):
+        # Wait until a matching event is dispatched, or until cancelled if nobody answers
+        # Keep a reference to the waiter, so the waiting task isn't garbage collected
+        waiter = (event, check, asyncio.get_event_loop().create_future())
+        self.waiters.append(waiter)
+        try:
+            return await waiter[2]
+        finally:
+            self.waiters.remove(waiter)
+
+    def dispatch(self, event, *args):
+        """
+        Deliver an event to the matching `wait_for` waiters, as a gateway event would.
+        Returns: The number of waiters resolved.
+        """
+        resolved = 0
+        for waiter_event, check, future in list(self.waiters):
+            if waiter_event != event or future.done():
+                continue
+            if check is None or check(*args):
+                future.set_result(args[0] if len(args) == 1 else args)
+                resolved += 1
+        return resolved
+
+
+class _FakeResponse(object):
+    def __init__(self, status):
+        self.status = status
+        self.reason = ""
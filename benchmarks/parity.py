@@ -0,0 +1,181 @@
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+from run import (
+    Bench, BENCHMARKS,
+    prepare_environment, add_database_arguments, make_database
+)
+
+"""
+Parity checks between the storage backends.
+
+Runs the same scripted sequence of ticket operations against the MySQL and SQLite backends,
+compares the resulting tickets, history and guild data,
+then runs the benchmark suite on both and reports the timings side by side.
+Exits with a non-zero status if the backends disagree.
+
+Usage:
+    python benchmarks/parity.py --db-user bench --db-password bench
+"""
+
+# Columns which legitimately differ between runs
+VOLATILE_FIELDS = ('created_at', 'modified_at', 'utc_created_at', 'last_ticket_created', 'modlog_msg_id')
+# Results of undoing the first ticket of each timed action sequence in the scenario:
+# a re-ban and a re-added role after a manual reversal, then a lone ban and a lone role
+EXPECTED_TIMED_ACTIONS = ['superseded', 'superseded', 'undone', 'undone']
+
+
+async def scenario(db):
+    """
+    Drive a fresh interface through a fixed sequence of operations,
+    and return a snapshot of the resulting state, with run specific ids replaced by labels.
+    """
+    import discord
+    from fakes import FakeAuditLogEntry
+
+    bench = Bench(db, mods=5, victims=20)
+    await bench.launch()
+    interface = bench.interface
+    rng = random.Random(0)
+
+    labels = {
+        bench.guild.id: 'guild', bench.guild.modlog.id: 'modlog', bench.role.id: 'role', bench.staff.id: 'staff'
+    }
+    labels.update({mod.id: 'mod{}'.format(i) for i, mod in enumerate(bench.mods)})
+    labels.update({victim.id: 'victim{}'.format(i) for i, victim in enumerate(bench.victims)})
+
+    # Direct ticket creation and updates
+    tickets = []
+    for i in range(30):
+        tickets.append(await interface.create_ticket(
+            bench.guild.id,
+            rng.choice((interface.ActionTypes.BAN, interface.ActionTypes.KICK, interface.ActionTypes.NOTE)),
+            rng.choice(bench.mods).id,
+            rng.choice(bench.victims).id,
+            resolved=i % 2 == 0,
+            reason="Reason {}".format(i) if i % 2 == 0 else None
+        ))
+    for ticket in tickets[1::4]:
+        await ticket.update_reason(bench.staff.id, "Updated reason {}".format(ticket.guild_ticket_id))
+    for ticket in tickets[3::4]:
+        await ticket.update_moderator(bench.staff.id, rng.choice(bench.mods).id)
+
+    # Audit log replay, including role updates and irrelevant entries
+    for i in range(40):
+        mod = rng.choice(bench.mods)
+        victim = rng.choice(bench.victims)
+        action = rng.choice((
+            discord.AuditLogAction.ban,
+            discord.AuditLogAction.kick,
+            discord.AuditLogAction.member_role_update,
+            discord.AuditLogAction.message_delete
+        ))
+        if action == discord.AuditLogAction.member_role_update:
+            entry = FakeAuditLogEntry(action, mod, victim, roles_added=[bench.role])
+        else:
+            entry = FakeAuditLogEntry(action, mod, victim, reason="Audit {}".format(i) if i % 2 else None)
+        labels[entry.id] = 'entry{}'.format(i)
+        bench.guild.add_entry(entry)
+    await interface.check_audit_log(bench.guild)
+
+    # Role configuration changes
+    await interface.deactivate_role(bench.guild.id, bench.role.id)
+    await interface.create_active_role(bench.guild.id, bench.role.id, "MUTED", "UNMUTED")
+
+    # Timed actions, which must not be undone once a later ticket has reversed or repeated them
+    later = int(time.time()) + 3600
+    action_types = interface.ActionTypes
+    timed = []
+    for victim, sequence in (
+            (bench.victims[0], (action_types.BAN, action_types.UNBAN, action_types.BAN)),
+            (bench.victims[1], (action_types.ROLE_ADD, action_types.ROLE_RM, action_types.ROLE_ADD)),
+            (bench.victims[2], (action_types.BAN, )),
+            (bench.victims[3], (action_types.ROLE_ADD, ))):
+        created = []
+        for action in sequence:
+            role_id = bench.role.id if action in (action_types.ROLE_ADD, action_types.ROLE_RM) else None
+            created.append(await interface.create_ticket(
+                bench.guild.id, action, bench.mods[0].id, victim.id, resolved=True, role_id=role_id,
+                undo_at=later if action in (action_types.BAN, action_types.ROLE_ADD) else None
+            ))
+        timed.append(await interface.undo_ticket(created[0]))
+
+    def normalise(row):
+        return tuple(sorted(
+            (key, labels.get(value, value) if isinstance(value, int) else value)
+            for key, value in row.items() if key not in VOLATILE_FIELDS
+        ))
+
+    await interface.outbox.publish_pending()
+    storage = interface.storage
+    snapshot = {
+        'tickets': [
+            normalise(row) for row in
+            storage.fetchall("parity", "SELECT * FROM TicketView ORDER BY guild_ticket_id")
+        ],
+        'history': sorted(
+            (normalise(row) for row in storage.fetchall("parity", "SELECT * FROM TicketHistory")),
+            key=repr
+        ),
+        'guilds': sorted((normalise(row) for row in storage.load_guilds()), key=repr),
+        'member_tickets': [
+            sorted(ticket.guild_ticket_id for ticket in interface.get_member_tickets(bench.guild.id, victim.id))
+            for victim in bench.victims
+        ],
+        'timed_actions': timed,
+        'queues': sorted(
+            (labels[modid], [ticket.guild_ticket_id for ticket in tmod.ticket_queue])
+            for modid, tmod in interface.mods.items()
+        )
+    }
+    await bench.close()
+    return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check parity between the MySQL and SQLite backends.")
+    add_database_arguments(parser)
+    parser.add_argument('--scale', type=float, default=0.1,
+                        help="Multiplier applied to the size of every timing benchmark.")
+    args = parser.parse_args()
+
+    prepare_environment()
+    loop = asyncio.get_event_loop()
+
+    databases = {}
+    for backend in ('mysql', 'sqlite'):
+        args.backend = backend
+        databases[backend] = make_database(args)
+
+    # Behavioural parity
+    snapshots = {backend: loop.run_until_complete(scenario(db)) for backend, db in databases.items()}
+    mismatched = [key for key in snapshots['mysql'] if snapshots['mysql'][key] != snapshots['sqlite'][key]]
+    for key in mismatched:
+        print("MISMATCH in {}:".format(key))
+        for backend, snapshot in snapshots.items():
+            print("    {}: {}".format(backend, snapshot[key]))
+    if not mismatched:
+        print("Backends agree on {}.".format(", ".join(snapshots['mysql'].keys())))
+    for backend, snapshot in snapshots.items():
+        if snapshot['timed_actions'] != EXPECTED_TIMED_ACTIONS:
+            print("UNEXPECTED timed actions on {}: {}".format(backend, snapshot['timed_actions']))
+            mismatched.append('timed_actions')
+
+    # Timing comparison
+    print("\n{:<16}{:>16}{:>16}".format("benchmark", "mysql ops/s", "sqlite ops/s"))
+    for name, (bench, size) in BENCHMARKS.items():
+        size = max(1, int(size * args.scale))
+        rates = [
+            loop.run_until_complete(bench(databases[backend], size, 0))['ops_per_sec']
+            for backend in ('mysql', 'sqlite')
+        ]
+        print("{:<16}{:>16.2f}{:>16.2f}".format(name, *rates))
+
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,866 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+
+"""
+Benchmark suite for the `TicketInterface`.
+
+Drives the interface with the fake Discord client in `fakes.py`,
+against a scratch MySQL or SQLite database, and writes the results to a JSON file
+so that runs can be compared across commits.
+
+Usage:
+    python benchmarks/run.py --db-user bench --db-password bench --out results.json
+    python benchmarks/run.py --backend sqlite --out sqlite_results.json
+    python benchmarks/run.py ... --compare old_results.json
+    python benchmarks/run.py ... --loop uvloop --only event_stream --compare asyncio_results.json
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_DIR = os.path.join(ROOT, 'bot')
+
+
+def prepare_environment():
+    """
+    The bot modules read `config/bot.conf` relative to the working directory on import.
+    Run from a temporary directory with a quiet configuration,
+    so the benchmarks never touch a real configuration or log file.
+    """
+    workdir = tempfile.mkdtemp(prefix="ticketbot-bench-")
+    os.makedirs(os.path.join(workdir, 'config'))
+    with open(os.path.join(workdir, 'config', 'bot.conf'), 'w') as f:
+        f.write("[GENERAL]\nlog_level = WARNING\n")
+    os.chdir(workdir)
+    sys.path.insert(0, BOT_DIR)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def summarise(ops, seconds, samples=None, **extra):
+    result = {
+        'ops': ops,
+        'seconds': round(seconds, 6),
+        'ops_per_sec': round(ops / seconds, 2) if seconds else None
+    }
+    if samples:
+        result['p50_ms'] = round(percentile(samples, 0.5) * 1000, 4)
+        result['p95_ms'] = round(percentile(samples, 0.95) * 1000, 4)
+        result['p99_ms'] = round(percentile(samples, 0.99) * 1000, 4)
+    result.update(extra)
+    return result
+
+
+class Bench(object):
+    """
+    A fresh fake client, scratch database and `TicketInterface` for one benchmark case.
+    """
+    def __init__(self, db, rest_latency=0, mods=20, victims=200, cache_users=True):
+        from fakes import FakeClient, FakeRole
+        from tickets.interface import TicketInterface
+
+        db.reset()
+        self.db = db
+        self.client = FakeClient(rest_latency=rest_latency, cache_users=cache_users)
+        self.role = FakeRole(random.getrandbits(48))
+        self.guild = self.client.add_guild(roles=[self.role])
+        self.staff = self.client.add_user()
+        self.mods = [self.client.add_user() for _ in range(mods)]
+        self.victims = [self.client.add_user() for _ in range(victims)]
+
+        self.interface = TicketInterface(self.client, db.storage())
+        self.interface.load_types()
+        # Registered directly in storage, and loaded by `launch`
+        self.interface.storage.upsert_guild(self.guild.id, self.staff.id, self.guild.modlog.id)
+        self.interface.storage.upsert_active_role(self.guild.id, self.role.id, "MUTED", "UNMUTED")
+
+    async def launch(self):
+        """
+        Run the startup loaders without starting the catch-up or reminder loops.
+        """
+        self.interface.load_guilds()
+        await self.interface.load_mods()
+        self.interface.ready = True
+
+    async def close(self):
+        # Cancel any reminder prompts left waiting on the fake client
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.interface.storage.close()
+
+
+async def bench_create_ticket(db, count, rest_latency):
+    bench = Bench(db, rest_latency=rest_latency)
+    await bench.launch()
+    interface = bench.interface
+    rng = random.Random(count)
+
+    samples = []
+    start = time.perf_counter()
+    for i in range(count):
+        resolved = rng.random() < 0.5
+        op_start = time.perf_counter()
+        await interface.create_ticket(
+            bench.guild.id,
+            rng.choice((interface.ActionTypes.BAN, interface.ActionTypes.KICK, interface.ActionTypes.NOTE)),
+            rng.choice(bench.mods).id,
+            rng.choice(bench.victims).id,
+            resolved=resolved,
+            reason="Benchmark reason {}".format(i) if resolved else None
+        )
+        samples.append(time.perf_counter() - op_start)
+    inserted = time.perf_counter() - start
+    # Include the modlog posts, made in the background by the publisher
+    await interface.outbox.publish_pending()
+    total = time.perf_counter() - start
+
+    rest_calls = bench.client.rest_calls
+    await bench.close()
+    return summarise(count, total, samples, insert_seconds=round(inserted, 6), rest_calls=rest_calls)
+
+
+async def bench_audit_replay(db, count, rest_latency, noise=0.6):
+    import discord
+    from fakes import FakeAuditLogEntry
+
+    bench = Bench(db, rest_latency=rest_latency)
+    await bench.launch()
+    interface = bench.interface
+    tguild = interface.guilds[bench.guild.id]
+    rng = random.Random(count)
+
+    noise_actions = (
+        discord.AuditLogAction.message_delete,
+        discord.AuditLogAction.channel_update,
+        discord.AuditLogAction.member_update,
+        discord.AuditLogAction.invite_create
+    )
+    relevant = 0
+    for i in range(count):
+        mod = rng.choice(bench.mods)
+        victim = rng.choice(bench.victims)
+        if rng.random() < noise:
+            entry = FakeAuditLogEntry(rng.choice(noise_actions), mod, victim)
+        else:
+            relevant += 1
+            action = rng.choice((
+                discord.AuditLogAction.ban,
+                discord.AuditLogAction.unban,
+                discord.AuditLogAction.kick,
+                discord.AuditLogAction.member_role_update
+            ))
+            if action == discord.AuditLogAction.member_role_update:
+                if rng.random() < 0.5:
+                    entry = FakeAuditLogEntry(action, mod, victim, roles_added=[bench.role])
+                else:
+                    entry = FakeAuditLogEntry(action, mod, victim, roles_removed=[bench.role])
+            else:
+                entry = FakeAuditLogEntry(action, mod, victim, reason="Audit reason {}".format(i) if i % 3 else None)
+        bench.guild.add_entry(entry)
+
+    rest_before = bench.client.rest_calls
+    start = time.perf_counter()
+    await interface.check_audit_log(bench.guild)
+    await interface.outbox.publish_pending()
+    total = time.perf_counter() - start
+
+    created = tguild.ticket_count
+    rest_calls = bench.client.rest_calls - rest_before
+    await bench.close()
+    return summarise(count, total, entries_relevant=relevant, tickets_created=created, rest_calls=rest_calls)
+
+
+async def bench_member_update(db, count, rest_latency):
+    """
+    Dispatch a mix of member updates, mostly nickname and untracked role changes,
+    and measure the time spent deciding whether to read the audit log.
+    """
+    from fakes import FakeMember, FakeRole
+
+    bench = Bench(db, rest_latency=rest_latency)
+    await bench.launch()
+    interface = bench.interface
+    rng = random.Random(count)
+    other_roles = [bench.guild.add_role(FakeRole(random.getrandbits(48))) for _ in range(20)]
+
+    # Don't read the audit log, only measure the filtering
+    audit_reads = 0
+
+    async def live_audit_read(guild, actions=None):
+        nonlocal audit_reads
+        audit_reads += 1
+    interface.live_audit_read = live_audit_read
+
+    events = []
+    for i in range(count):
+        victim = rng.choice(bench.victims)
+        roles = rng.sample(other_roles, 10)
+        before = FakeMember(victim, bench.guild, roles=roles)
+        kind = rng.random()
+        if kind < 0.6:
+            after = FakeMember(victim, bench.guild, roles=roles, nick="nick{}".format(i))
+        elif kind < 0.9:
+            after = FakeMember(victim, bench.guild, roles=roles[1:] + [rng.choice(other_roles)])
+        else:
+            after = FakeMember(victim, bench.guild, roles=roles + [bench.role])
+        events.append((before, after))
+
+    samples = []
+    for before, after in events:
+        op_start = time.perf_counter()
+        await bench.client.dispatch_after("member_update", before, after)
+        samples.append(time.perf_counter() - op_start)
+
+    await bench.close()
+    return summarise(count, sum(samples), samples, audit_reads=audit_reads)
+
+
+async def bench_audit_catchup(db, count, rest_latency, entries_per_guild=10):
+    import discord
+    from fakes import FakeAuditLogEntry
+
+    bench = Bench(db, rest_latency=rest_latency)
+    interface = bench.interface
+    guilds = [bench.guild]
+    for _ in range(count - 1):
+        guild = bench.client.add_guild()
+        interface.storage.upsert_guild(guild.id, bench.staff.id, guild.modlog.id)
+        guilds.append(guild)
+    await bench.launch()
+
+    stale = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    for guild in guilds:
+        interface.guilds[guild.id].last_checked = stale
+        for i in range(entries_per_guild):
+            guild.add_entry(FakeAuditLogEntry(
+                discord.AuditLogAction.kick if i % 2 else discord.AuditLogAction.message_delete,
+                bench.mods[i % len(bench.mods)],
+                bench.victims[i % len(bench.victims)],
+                reason="Catch-up reason"
+            ))
+
+    start = time.perf_counter()
+    await interface.audit_catchup()
+    await interface.outbox.publish_pending()
+    total = time.perf_counter() - start
+
+    created = sum(tguild.ticket_count for tguild in interface.guilds.values())
+    await bench.close()
+    return summarise(count, total, tickets_created=created, concurrency=interface.catchup_concurrency)
+
+
+async def bench_load_mods(db, count, rest_latency, cache_users=True):
+    from fakes import next_snowflake
+
+    bench = Bench(db, rest_latency=rest_latency, mods=200, victims=2000, cache_users=cache_users)
+    # Include moderators which are bots or no longer exist, these should not get queues
+    bot_mod = bench.client.add_user(bot=True)
+    db.seed_tickets(
+        bench.guild.id,
+        [mod.id for mod in bench.mods] + [bot_mod.id, next_snowflake()],
+        [victim.id for victim in bench.victims],
+        count
+    )
+
+    start = time.perf_counter()
+    bench.interface.load_guilds()
+    guilds_done = time.perf_counter()
+    await bench.interface.load_mods()
+    total = time.perf_counter() - start
+
+    queued = sum(len(tmod.ticket_queue) for tmod in bench.interface.mods.values())
+    queues = len(bench.interface.mods)
+    await bench.close()
+    return summarise(
+        count, total,
+        load_guilds_seconds=round(guilds_done - start, 6),
+        load_mods_seconds=round(total - (guilds_done - start), 6),
+        tickets_queued=queued,
+        queues=queues,
+        rest_calls=bench.client.rest_calls
+    )
+
+
+async def bench_load_mods_cold(db, count, rest_latency):
+    """
+    Load the moderator queues with an empty user cache, as with member chunking disabled.
+    """
+    return await bench_load_mods(db, count, rest_latency, cache_users=False)
+
+
+async def bench_userlog(db, count, rest_latency, repeats=20):
+    import discord
+    from utils.lib import paginate_summaries
+
+    bench = Bench(db, rest_latency=rest_latency)
+    victim = bench.victims[0]
+    db.seed_tickets(bench.guild.id, [mod.id for mod in bench.mods], [victim.id], count, resolved_ratio=1)
+    await bench.launch()
+    interface = bench.interface
+
+    fetch_samples = []
+    render_samples = []
+    for _ in range(repeats):
+        op_start = time.perf_counter()
+        tickets = interface.get_member_tickets(bench.guild.id, victim.id)
+        tickets.sort(key=lambda ticket: ticket.guild_ticket_id)
+        fetched = time.perf_counter()
+
+        # Mirrors the rendering in the `userlog` command
+        pages = paginate_summaries([ticket.log_summary for ticket in tickets])
+        embeds = []
+        for i, page in enumerate(pages):
+            embed = discord.Embed(title="Log for user {}".format(victim), description=page)
+            embed.set_footer(text="Page {}/{}".format(i + 1, len(pages)))
+            embeds.append(embed)
+        rendered = time.perf_counter()
+
+        fetch_samples.append(fetched - op_start)
+        render_samples.append(rendered - fetched)
+
+    await bench.close()
+    total = sum(fetch_samples) + sum(render_samples)
+    return summarise(
+        repeats, total, [f + r for f, r in zip(fetch_samples, render_samples)],
+        tickets=count,
+        pages=len(embeds),
+        fetch_p50_ms=round(percentile(fetch_samples, 0.5) * 1000, 4),
+        render_p50_ms=round(percentile(render_samples, 0.5) * 1000, 4)
+    )
+
+
+async def bench_queries(db, count, rest_latency, repeats=20):
+    """
+    Read tickets one at a time, then a victim's whole log,
+    through dictionary rows as before, and through prepared statements with tuple rows,
+    and report the time per query of each.
+    """
+    from tickets.ticket import Ticket
+
+    bench = Bench(db, rest_latency=rest_latency)
+    victim = bench.victims[0]
+    db.seed_tickets(bench.guild.id, [mod.id for mod in bench.mods], [victim.id], count)
+    await bench.launch()
+    interface = bench.interface
+    storage = interface.storage
+    guildid = bench.guild.id
+
+    def dict_ticket(ticketid):
+        row = storage.fetchone(
+            "get_ticket_dict",
+            "SELECT * FROM TicketView WHERE guild_id = %s AND guild_ticket_id = %s",
+            (guildid, ticketid)
+        )
+        return Ticket(interface, **row)
+
+    def dict_member_tickets():
+        return [
+            Ticket(interface, **row) for row in storage.fetchall(
+                "get_member_tickets_dict",
+                "SELECT * FROM TicketView WHERE guild_id = %s AND victim_id = %s ORDER BY modified_at",
+                (guildid, victim.id)
+            )
+        ]
+
+    def timed(func, *args):
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+    ticketids = list(range(1, count + 1))
+    dict_samples = [timed(dict_ticket, ticketid) for ticketid in ticketids]
+    prepared_samples = [timed(interface.get_ticket, guildid, ticketid) for ticketid in ticketids]
+    dict_log = [timed(dict_member_tickets) for _ in range(repeats)]
+    prepared_log = [timed(interface.get_member_tickets, guildid, victim.id) for _ in range(repeats)]
+
+    await bench.close()
+
+    def micros(samples):
+        return round(percentile(samples, 0.5) * 1000000, 2)
+
+    return summarise(
+        count, sum(prepared_samples), prepared_samples,
+        get_ticket_dict_us=micros(dict_samples),
+        get_ticket_prepared_us=micros(prepared_samples),
+        member_log_dict_us=micros(dict_log),
+        member_log_prepared_us=micros(prepared_log),
+        member_log_tickets=count
+    )
+
+
+async def bench_search(db, count, rest_latency, repeats=20):
+    """
+    Search the ticket reasons for a rare and a common word, reading the first page and the result count,
+    through the full-text index and through a `LIKE` scan, and report the time per search of each.
+    """
+    bench = Bench(db, rest_latency=rest_latency)
+    db.seed_tickets(bench.guild.id, [mod.id for mod in bench.mods], [victim.id for victim in bench.victims], count)
+    await bench.launch()
+    interface = bench.interface
+    storage = interface.storage
+    guildid = bench.guild.id
+
+    def indexed(terms):
+        interface.search_tickets(guildid, terms, 5)
+        interface.count_search_results(guildid, terms)
+
+    def scan(terms):
+        pattern = "%{}%".format(terms)
+        storage.fetchrows(
+            "search_tickets_scan",
+            "SELECT * FROM TicketView WHERE guild_id = %s AND reason LIKE %s "
+            "ORDER BY guild_ticket_id DESC LIMIT 5",
+            (guildid, pattern)
+        )
+        storage.fetchone(
+            "count_search_tickets_scan",
+            "SELECT COUNT(*) FROM Tickets WHERE guild_id = %s AND reason LIKE %s",
+            (guildid, pattern),
+            dictionary=False
+        )
+
+    def timed(func, *args):
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+    # Each seeded reason contains its ticket number, which is only found once
+    rare = str(storage.fetchone(
+        "last_reason",
+        "SELECT MAX(guild_ticket_id) FROM Tickets WHERE guild_id = %s AND reason IS NOT NULL",
+        (guildid, ),
+        dictionary=False
+    )[0])
+    common = "seeded"
+    rare_samples = [timed(indexed, rare) for _ in range(repeats)]
+    common_samples = [timed(indexed, common) for _ in range(repeats)]
+    rare_scan = [timed(scan, rare) for _ in range(repeats)]
+    common_scan = [timed(scan, common) for _ in range(repeats)]
+    matches = interface.count_search_results(guildid, common)
+
+    await bench.close()
+
+    def millis(samples):
+        return round(percentile(samples, 0.5) * 1000, 3)
+
+    samples = rare_samples + common_samples
+    return summarise(
+        len(samples), sum(samples), samples,
+        rare_indexed_ms=millis(rare_samples),
+        rare_scan_ms=millis(rare_scan),
+        common_indexed_ms=millis(common_samples),
+        common_scan_ms=millis(common_scan),
+        common_matches=matches
+    )
+
+
+async def bench_bulk_update(db, count, rest_latency):
+    """
+    Reassign all the unresolved tickets of one moderator, then of another,
+    through a `Ticket.update` for each ticket as before, and through a single filtered update.
+    """
+    from tickets.filters import TicketFilter
+
+    bench = Bench(db, rest_latency=rest_latency, mods=3)
+    old_mod, bulk_mod, new_mod = bench.mods
+    db.seed_tickets(bench.guild.id, [old_mod.id, bulk_mod.id], [victim.id for victim in bench.victims], count, 0)
+    await bench.launch()
+    interface = bench.interface
+    guildid = bench.guild.id
+
+    start = time.perf_counter()
+    tickets = list(interface.mods[old_mod.id].ticket_queue)
+    for ticket in tickets:
+        await ticket.update_moderator(bench.staff.id, new_mod.id)
+    per_ticket = time.perf_counter() - start
+
+    start = time.perf_counter()
+    updated = await interface.update_tickets(
+        TicketFilter(guildid, moderator_id=bulk_mod.id, resolved=False),
+        modified_by_id=bench.staff.id,
+        moderator_id=new_mod.id
+    )
+    bulk = time.perf_counter() - start
+
+    await interface.outbox.publish_pending()
+    queued = interface.mods[new_mod.id].count(guildid)
+    await bench.close()
+    return summarise(
+        len(tickets) + updated, per_ticket + bulk,
+        per_ticket_seconds=round(per_ticket, 6),
+        per_ticket_updated=len(tickets),
+        bulk_seconds=round(bulk, 6),
+        bulk_updated=updated,
+        new_mod_queue=queued,
+        rest_calls=bench.client.rest_calls
+    )
+
+
+async def bench_render(db, count, rest_latency, repeats=20):
+    """
+    Render the summaries and embeds of a moderator queue repeatedly, as the `queue` selector does.
+    """
+    bench = Bench(db, rest_latency=rest_latency, mods=1)
+    db.seed_tickets(bench.guild.id, [bench.mods[0].id], [victim.id for victim in bench.victims], count, 0)
+    await bench.launch()
+    queue = bench.interface.mods[bench.mods[0].id].ticket_queue
+
+    samples = []
+    for _ in range(repeats):
+        op_start = time.perf_counter()
+        [ticket.summary for ticket in queue]
+        [ticket.embed for ticket in queue]
+        samples.append(time.perf_counter() - op_start)
+
+    await bench.close()
+    return summarise(
+        repeats, sum(samples), samples,
+        tickets=len(queue),
+        first_ms=round(samples[0] * 1000, 4),
+        repeat_p50_ms=round(percentile(samples[1:], 0.5) * 1000, 4)
+    )
+
+
+async def bench_undo(db, count, rest_latency):
+    """
+    Handle `count` overdue timed actions, as after a restart,
+    with as many later actions waiting in the registry.
+    Victims are spread out, so that few actions are superseded by a later ticket.
+    """
+    bench = Bench(db, rest_latency=rest_latency, victims=count * 2)
+    db.seed_tickets(
+        bench.guild.id,
+        [mod.id for mod in bench.mods],
+        [victim.id for victim in bench.victims],
+        count * 2
+    )
+    now = int(time.time())
+    storage = bench.interface.storage
+    storage.execute(
+        "seed_undo",
+        "UPDATE Tickets SET undo_at = %s - guild_ticket_id WHERE guild_ticket_id <= %s",
+        (now, count)
+    )
+    storage.execute(
+        "seed_undo",
+        "UPDATE Tickets SET undo_at = %s + guild_ticket_id * 60 WHERE guild_ticket_id > %s",
+        (now, count)
+    )
+    await bench.launch()
+    interface = bench.interface
+    scheduler = interface.scheduler
+
+    handled = 0
+    pages = 0
+    finished = asyncio.Event()
+    undo_ticket = interface.undo_ticket
+    get_scheduled_tickets = storage.get_scheduled_tickets
+
+    async def counted_undo(ticket):
+        nonlocal handled
+        result = await undo_ticket(ticket)
+        handled += 1
+        if handled == count:
+            finished.set()
+        return result
+
+    def counted_page(*args, **kwargs):
+        nonlocal pages
+        pages += 1
+        return get_scheduled_tickets(*args, **kwargs)
+
+    interface.undo_ticket = counted_undo
+    storage.get_scheduled_tickets = counted_page
+
+    start = time.perf_counter()
+    task = asyncio.ensure_future(scheduler.run())
+    await finished.wait()
+    total = time.perf_counter() - start
+    task.cancel()
+
+    pending = len(scheduler.scheduled)
+    await bench.close()
+    return summarise(
+        count, total,
+        pages_read=pages,
+        pending_in_window=pending,
+        rest_calls=bench.client.rest_calls
+    )
+
+
+async def bench_event_stream(db, count, rest_latency, concurrency=50):
+    """
+    Replay a stream of member updates, bans, moderator DM replies and interactive command sessions,
+    each handled in its own task as the client does, with up to `concurrency` events in flight.
+    Latencies run from the dispatch of each event to the end of its handling,
+    so they include the time spent waiting for the event loop.
+    Compare event loops by running with `--loop uvloop` and `--compare`.
+    """
+    import discord
+    from fakes import (
+        FakeAuditLogEntry, FakeChannel, FakeContext, FakeDMChannel, FakeMember, FakeMessage, FakeRole, next_snowflake
+    )
+    from utils import interactive
+
+    bench = Bench(db, rest_latency=rest_latency)
+    await bench.launch()
+    interface = bench.interface
+    client = bench.client
+    guild = bench.guild
+    rng = random.Random(count)
+    other_roles = [guild.add_role(FakeRole(random.getrandbits(48))) for _ in range(20)]
+    dm_channels = {mod.id: FakeDMChannel(client, next_snowflake()) for mod in bench.mods}
+    command_channel = FakeChannel(client, next_snowflake())
+
+    # Keep the task running each moderator prompt, to wait for their replies to be handled
+    prompt_mod = interface.prompt_mod
+    prompts = {}  # moderator id: task running their latest prompt
+
+    def tracked_prompt(tmod, ticket=None):
+        task = prompts[tmod.user.id] = asyncio.ensure_future(prompt_mod(tmod, ticket))
+        return task
+    interface.prompt_mod = tracked_prompt
+
+    replies = 0
+
+    async def member_update(before, after, entry):
+        if entry is not None:
+            guild.add_entry(entry)
+        await client.dispatch_after("member_update", before, after)
+
+    async def ban(entry):
+        guild.add_entry(entry)
+        await client.dispatch_after("member_ban", guild, entry.target)
+
+    async def dm_reply(mod, content):
+        nonlocal replies
+        task = prompts.get(mod.id, None)
+        message = FakeMessage(client, dm_channels[mod.id], content=content, author=mod)
+        if task is None or task.done() or not client.dispatch("message", message):
+            # No prompt is waiting, so the reply is ignored
+            return
+        replies += 1
+        await task
+        tmod = interface.mods[mod.id]
+        if tmod.ticket_queue:
+            # Prompt for the next ticket, as the reminder loop would
+            interface.prompt_mod(tmod)
+
+    async def command(user, content):
+        ctx = FakeContext(client, user, command_channel)
+        session = asyncio.ensure_future(interactive.input(ctx, "Please enter the new reason."))
+        message = FakeMessage(client, command_channel, content=content, author=user)
+        # The user answers once the prompt has been posted
+        while not session.done() and not client.dispatch("message", message):
+            await asyncio.sleep(0)
+        await session
+
+    events = []
+    for i in range(count):
+        mod = rng.choice(bench.mods)
+        victim = rng.choice(bench.victims)
+        kind = rng.random()
+        if kind < 0.55:
+            roles = rng.sample(other_roles, 10)
+            before = FakeMember(victim, guild, roles=roles)
+            if rng.random() < 0.9:
+                after = FakeMember(victim, guild, roles=roles, nick="nick{}".format(i))
+                entry = None
+            else:
+                after = FakeMember(victim, guild, roles=roles + [bench.role])
+                entry = FakeAuditLogEntry(
+                    discord.AuditLogAction.member_role_update, mod, victim, roles_added=[bench.role]
+                )
+            events.append((member_update, (before, after, entry)))
+        elif kind < 0.7:
+            entry = FakeAuditLogEntry(discord.AuditLogAction.ban, mod, victim, reason=None)
+            events.append((ban, (entry, )))
+        elif kind < 0.85:
+            events.append((dm_reply, (mod, "c" if rng.random() < 0.2 else "Event reason {}".format(i))))
+        else:
+            events.append((command, (victim, "Command reason {}".format(i))))
+
+    samples = []
+    kind_samples = {}
+    slots = asyncio.Semaphore(concurrency)
+
+    async def handle(handler, args, dispatched):
+        try:
+            await handler(*args)
+            elapsed = time.perf_counter() - dispatched
+            samples.append(elapsed)
+            kind_samples.setdefault(handler.__name__, []).append(elapsed)
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    tasks = []
+    for handler, args in events:
+        await slots.acquire()
+        tasks.append(asyncio.ensure_future(handle(handler, args, time.perf_counter())))
+    await asyncio.gather(*tasks)
+    await interface.outbox.publish_pending()
+    total = time.perf_counter() - start
+
+    created = interface.guilds[guild.id].ticket_count
+    rest_calls = client.rest_calls
+    await bench.close()
+    result = summarise(count, total, samples, tickets_created=created, replies_handled=replies, rest_calls=rest_calls)
+    for name, kind in sorted(kind_samples.items()):
+        result['{}_p99_ms'.format(name)] = round(percentile(kind, 0.99) * 1000, 4)
+    return result
+
+
+BENCHMARKS = {
+    'create_ticket': (bench_create_ticket, 500),
+    'audit_replay': (bench_audit_replay, 2000),
+    'audit_catchup': (bench_audit_catchup, 200),
+    'member_update': (bench_member_update, 20000),
+    'load_mods': (bench_load_mods, 20000),
+    'load_mods_cold': (bench_load_mods_cold, 20000),
+    'userlog': (bench_userlog, 2000),
+    'render': (bench_render, 2000),
+    'queries': (bench_queries, 2000),
+    'search': (bench_search, 20000),
+    'bulk_update': (bench_bulk_update, 2000),
+    'undo': (bench_undo, 2000),
+    'event_stream': (bench_event_stream, 5000),
+}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """
+    Print the change in throughput and in p99 latency of each benchmark against a previous run.
+    """
+    print("\nAgainst {} on the {} loop".format(previous.get('revision'), previous.get('loop', 'asyncio')))
+    print("{:<16}{:>14}{:>14}{:>10}{:>14}{:>14}{:>10}".format(
+        "benchmark", "previous", "current", "change", "p99 previous", "p99 current", "change"
+    ))
+    for name, result in results['results'].items():
+        old = previous.get('results', {}).get(name, None)
+        if not old or not old.get('ops_per_sec') or not result.get('ops_per_sec'):
+            continue
+        line = "{:<16}{:>14.2f}{:>14.2f}{:>9.1f}%".format(
+            name,
+            old['ops_per_sec'],
+            result['ops_per_sec'],
+            (result['ops_per_sec'] / old['ops_per_sec'] - 1) * 100
+        )
+        if old.get('p99_ms') and result.get('p99_ms'):
+            line += "{:>12.3f}ms{:>12.3f}ms{:>9.1f}%".format(
+                old['p99_ms'],
+                result['p99_ms'],
+                (result['p99_ms'] / old['p99_ms'] - 1) * 100
+            )
+        print(line)
+
+
+def make_loop(name):
+    """
+    Create the event loop to run the benchmarks on.
+    """
+    if name == 'uvloop':
+        import uvloop
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def make_database(args):
+    from database import MySQLScratch, SQLiteScratch
+    if args.backend == 'sqlite':
+        return SQLiteScratch()
+    return MySQLScratch({
+        'username': args.db_user,
+        'password': args.db_password,
+        'host': args.db_host,
+        'database': args.db_name
+    })
+
+
+def add_database_arguments(parser):
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'), default='mysql')
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-user', default='root')
+    parser.add_argument('--db-password', default='')
+    parser.add_argument('--db-name', default='TicketBenchmark',
+                        help="Scratch MySQL database, dropped and recreated for each benchmark.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the TicketBot benchmark suite.")
+    add_database_arguments(parser)
+    parser.add_argument('--scale', type=float, default=1,
+                        help="Multiplier applied to the size of every benchmark.")
+    parser.add_argument('--rest-latency', type=float, default=0,
+                        help="Simulated latency of each Discord REST call, in seconds.")
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS),
+                        help="Run only the given benchmark. May be repeated.")
+    parser.add_argument('--loop', choices=('asyncio', 'uvloop'), default='asyncio',
+                        help="Event loop to run the benchmarks on.")
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--compare', help="Previous results file to compare against.")
+    args = parser.parse_args()
+    try:
+        loop = make_loop(args.loop)
+    except ImportError:
+        parser.error("the uvloop package is not installed")
+    asyncio.set_event_loop(loop)
+
+    out_path = os.path.abspath(args.out)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    prepare_environment()
+    db = make_database(args)
+
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'backend': db.name,
+        'scale': args.scale,
+        'rest_latency': args.rest_latency,
+        'loop': args.loop,
+        'results': {}
+    }
+    for name, (bench, size) in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+        size = max(1, int(size * args.scale))
+        print("Running {} ({})...".format(name, size))
+        results['results'][name] = result = loop.run_until_complete(bench(db, size, args.rest_latency))
+        print("    " + ", ".join("{}={}".format(key, value) for key, value in result.items()))
+
+    with open(out_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results written to {}".format(out_path))
+
+    if compare_path:
+        with open(compare_path) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import os
+import ast
+import time
+import importlib.util
+
+from cmdClient import cmd
+
+from logger import log
+from profiling import startup
+
+
+def scan_commands(path):
+    """
+    Read the commands defined in a command module, without importing it.
+    Returns: List of `(name, kwargs)` for each `cmd` decorator, with its keyword arguments.
+    Raises ValueError if a decorator has arguments which aren't literals.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    commands = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            if isinstance(decorator, ast.Call) and getattr(decorator.func, 'id', None) == 'cmd':
+                name = ast.literal_eval(decorator.args[0])
+                kwargs = {keyword.arg: ast.literal_eval(keyword.value) for keyword in decorator.keywords}
+                commands.append((name, kwargs))
+    return commands
+
+
+class CommandLoader(object):
+    """
+    Loads the command modules of a directory, either all at once, or each on the first use of its commands.
+
+    When `lazy`, each command is registered from its `cmd` decorator, read without importing the module,
+    as a placeholder which imports the module and replaces itself with the real command when first run.
+    The names, groups, aliases and descriptions are then available to `help` without importing anything.
+    Modules whose decorators can't be read are imported immediately.
+    The loader is available as `client.command_loader`.
+
+    Parameters
+    ----------
+    client: cmdClient
+        The client to register the commands with.
+    dirpath: str
+        Directory of the command modules.
+    lazy: bool
+        Whether to import the modules when their commands are first used.
+    """
+    def __init__(self, client, dirpath, lazy=False):
+        self.client = client
+        self.dirpath = dirpath
+        self.lazy = lazy
+
+        self.pending = {}  # module path: placeholder commands
+
+        client.command_loader = self
+
+    def load(self):
+        """
+        Load or register every command module in the directory.
+        """
+        if not self.lazy:
+            self.client.load_dir(self.dirpath)
+            return
+
+        for filename in sorted(os.listdir(self.dirpath)):
+            if not filename.endswith('.py') or filename.startswith('_'):
+                continue
+            path = os.path.join(self.dirpath, filename)
+            try:
+                commands = scan_commands(path)
+            except (ValueError, SyntaxError):
+                commands = None
+            if not commands:
+                self.load_module(path)
+            else:
+                self.pending[path] = [self._placeholder(path, name, kwargs) for name, kwargs in commands]
+
+    def _placeholder(self, path, name, kwargs):
+        async def load_and_run(ctx):
+            await self.get(name).func(ctx)
+        load_and_run.__doc__ = ""
+        return cmd(name, **kwargs)(load_and_run)
+
+    def load_module(self, path):
+        """
+        Import a command module, registering its commands.
+        """
+        name = os.path.splitext(os.path.basename(path))[0]
+        start = time.perf_counter()
+        spec = importlib.util.spec_from_file_location("commands.{}".format(name), path)
+        module = importlib.util.module_from_spec(spec)
+        with startup.timed_import(spec.name):
+            spec.loader.exec_module(module)
+        elapsed = time.perf_counter() - start
+        log(
+            "Loaded command module `{}` in {:.3f}s.".format(name, elapsed),
+            context="COMMAND_LOADER"
+        )
+        return module
+
+    def get(self, name):
+        """
+        Retrieve a command by name or alias, importing its module if it hasn't been yet.
+        Returns: The command, or `None` if there is no such command.
+        """
+        command = self.client.cmd_cache.get(name, None)
+        if command is None:
+            return None
+        path = next((path for path, placeholders in self.pending.items() if command in placeholders), None)
+        if path is not None:
+            self.load_module(path)
+            placeholders = self.pending.pop(path)
+            # The real commands have replaced the placeholders in the command cache
+            for placeholder in placeholders:
+                if placeholder in self.client.cmds:
+                    self.client.cmds.remove(placeholder)
+            command = self.client.cmd_cache.get(name, None)
+        return command
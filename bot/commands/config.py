@@ -4,6 +4,7 @@ from cmdClient.lib import UserCancelled, ResponseTimedOut
 from utils.seekers import find_role, find_channel  # noqa
 from utils.interactive import input  # noqa
 from utils.ctx_addons import embedreply  # noqa
+from utils.lib import parse_duration, format_duration
 
 from wards import has_manage_guild, registered_guild
 
@@ -73,7 +74,7 @@ async def cmd_setup(ctx):
         )
 
     # Register the guild
-    ctx.client.tickets.register_guild(ctx.guild.id, staffrole.id, modlog.id)
+    await ctx.client.tickets.register_guild(ctx.guild.id, staffrole.id, modlog.id)
     await ctx.embedreply(
         "The guild has been successfully set up for use with TicketBot.\n"
         "I will now create tickets when tracked moderation events are detected, "
@@ -95,11 +96,16 @@ async def cmd_addrole(ctx):
     Usage``:
         addrole
         addrole <role>, <add_action_name>, <rm_action_name>
+        addrole <role>, <add_action_name>, <rm_action_name>, <duration>
     Description:
         Mark a guild role as "tracked", so that adding or removing
         this role is counted as a moderation action,
         and will generate a ticket and prompt for a reason.
 
+        If a duration is given, the role is automatically removed
+        once this time has passed after it was added.
+        The duration of individual tickets may be changed with `duration`.
+
         This command may be used without arguments, in which case
         it will prompt for the required information.
 
@@ -109,30 +115,43 @@ async def cmd_addrole(ctx):
         role: The role to be tracked. May be a rolename, roleid, or mention.
         add_action_name: The action name to be used when the role is added, e.g. `MUTED`.
         rm_action_name: The action name to be used when the role is removed, e.g. `UNMUTED`.
+        duration: Optional default duration of the role, e.g. `12h`, `1d 12h` or `2w`.
     Related:
-        setup, rmrole
+        setup, rmrole, duration
     Examples``:
         addrole muted, MUTED, UNMUTED
+        addrole muted, MUTED, UNMUTED, 1d
         addrole staff, PROMOTED, DEMOTED
         addrole warned, WARNED, UNWARNED
     """
     role = None
     add_action_name = None
     rm_action_name = None
+    duration = None
 
     # Obtain the role information
     try:
         if ctx.arg_str:
             # Extract the role information from the arguments
             splits = ctx.arg_str.split(",")
-            if len(splits) != 3:
+            if len(splits) not in (3, 4):
                 return await ctx.error_reply(
                     "**USAGE:**\n"
                     "`addrole`\n"
-                    "`addrole <role>, <add_action_name>, <rm_action_name>`\n\n"
+                    "`addrole <role>, <add_action_name>, <rm_action_name>`\n"
+                    "`addrole <role>, <add_action_name>, <rm_action_name>, <duration>`\n\n"
                     "See the command help for more information."
                 )
-            rolestr, add_action_name, rm_action_name = [s.strip() for s in splits]
+            rolestr, add_action_name, rm_action_name = [s.strip() for s in splits[:3]]
+            if len(splits) == 4:
+                try:
+                    duration = parse_duration(splits[3])
+                except ValueError:
+                    return await ctx.error_reply(
+                        "Couldn't understand the duration `{}`, please use e.g. `12h` or `1d 12h`.".format(
+                            splits[3].strip()
+                        )
+                    )
             role = await ctx.find_role(rolestr, interactive=True)
             if role is None:
                 return
@@ -157,6 +176,18 @@ async def cmd_addrole(ctx):
                 "In the case of a mute role, this might be `UNMUTED`, "
                 "and for a staff role this could be `DEMOTED`."
             )
+            while True:
+                response = await ctx.input(
+                    "Please enter how long the role should last before it is automatically removed, "
+                    "e.g. `12h` or `1d 12h`, or `none` if it should not be removed."
+                )
+                if response.strip().lower() == 'none':
+                    break
+                try:
+                    duration = parse_duration(response)
+                    break
+                except ValueError:
+                    await ctx.error_reply("Couldn't understand this duration, please try again.")
     except UserCancelled:
         return await ctx.error_reply(
             "User cancelled.\n"
@@ -169,15 +200,19 @@ async def cmd_addrole(ctx):
         )
 
     # Add the tracked role
-    ctx.client.tickets.create_active_role(
+    await ctx.client.tickets.create_active_role(
         ctx.guild.id,
         role.id,
         add_action_name,
-        rm_action_name
+        rm_action_name,
+        default_duration=duration
     )
 
     await ctx.embedreply(
-        "The role {} was successfully registered as a tracked role!".format(role.mention)
+        "The role {} was successfully registered as a tracked role!{}".format(
+            role.mention,
+            " It will be removed `{}` after being added.".format(format_duration(duration)) if duration else ""
+        )
     )
 
 
@@ -224,7 +259,7 @@ async def cmd_rmrole(ctx):
             "This role is not being tracked!"
         )
 
-    ctx.client.tickets.deactivate_role(ctx.guild.id, role_id)
+    await ctx.client.tickets.deactivate_role(ctx.guild.id, role_id)
 
     await ctx.embedreply(
         "The role {} is no longer being tracked.".format(
@@ -1,6 +1,10 @@
+import re
 import sys
-from io import StringIO
+import time
+import ctypes
+import threading
 import traceback
+import tracemalloc
 import asyncio
 
 from cmdClient import cmd, checks
@@ -13,8 +17,15 @@ Commands provided:
         Executes provided code in an async executor
     eval:
         Executes code and awaits it if required
+    exec:
+        Executes blocking code in a worker thread, streaming its output
 """
 
+# Maximum number of characters of output kept from a worker thread snippet
+MAX_OUTPUT = 1000000
+# Maximum number of characters of output in each page
+PAGE_LEN = 1800
+
 
 @cmd("async",
      group="Bot Admin",
@@ -70,6 +81,266 @@ async def cmd_eval(ctx):
     )
 
 
+@cmd("exec",
+     group="Bot Admin",
+     desc="Run blocking python code in a worker thread, streaming its output.")
+@checks.is_owner()
+async def cmd_exec(ctx):
+    """
+    Usage``:
+        exec [-t <seconds>] <code>
+    Description:
+        Runs <code> in a worker thread, so that slow code doesn't block the bot.
+        Printed output is shown as it is produced, then paged once the code finishes,
+        along with the value returned by the code, the wall time,
+        and the peak memory allocated while it ran, unless other code was being run at the same time.
+        The code is interrupted if it runs for longer than the timeout, 60 seconds by default.
+        Coroutines, e.g. to use the client, may be run from the code with `run(coro)`.
+    Related:
+        eval, async
+    """
+    match = re.match(r"\s*-t\s*(\d+)\s+", ctx.arg_str)
+    timeout = int(match.group(1)) if match else 60
+    code = ctx.arg_str[match.end():] if match else ctx.arg_str
+    if not code.strip():
+        await ctx.error_reply("You must give me something to run!")
+        return
+
+    loop = asyncio.get_event_loop()
+    job = _ThreadJob(code, {
+        'ctx': ctx,
+        'client': ctx.client,
+        'message': ctx.msg,
+        'run': lambda coro: asyncio.run_coroutine_threadsafe(coro, loop).result()
+    })
+    job.start(loop)
+
+    # Show the latest output while the code runs
+    out_msg = await ctx.reply("Running...")
+    shown = None
+    while True:
+        try:
+            await asyncio.wait_for(asyncio.shield(job.done), timeout=1)
+            break
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - job.started_at
+        if elapsed > timeout:
+            job.interrupt()
+            try:
+                await asyncio.wait_for(asyncio.shield(job.done), timeout=5)
+            except asyncio.TimeoutError:
+                # Blocked outside of python code, leave the thread to finish on its own
+                break
+            break
+        pages = _output_pages(job.output.getvalue())
+        latest = "{}\nRunning for `{:.0f}s`...".format(pages[-1], elapsed)
+        if latest != shown:
+            await out_msg.edit(content=latest)
+            shown = latest
+
+    # Page through the complete output
+    status = "Finished" if job.done.done() else "Still running, no longer watched"
+    if job.timed_out:
+        status = "Interrupted after `{}s` timeout".format(timeout)
+    if job.error:
+        status = "Failed"
+    footer = "**{}** in `{:.3f}s`".format(status, job.wall_time or (time.perf_counter() - job.started_at))
+    if job.peak_memory is not None:
+        footer += ", peak memory `{:.1f} KiB`".format(job.peak_memory / 1024)
+    footer += "."
+    pages = ["{}\n{}".format(page, footer) for page in _output_pages(job.output.getvalue())]
+    if len(pages) > 1:
+        pages = ["{}\nPage {}/{}".format(page, i + 1, len(pages)) for i, page in enumerate(pages)]
+    if len(pages) > 1:
+        await out_msg.edit(content=footer)
+        await ctx.pager(pages, locked=False)
+    else:
+        await out_msg.edit(content=pages[0])
+
+
+class _ThreadOutput(object):
+    """
+    Collects the text written by a thread, as it is written, up to `MAX_OUTPUT` characters.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._length = 0
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            if self._length < MAX_OUTPUT:
+                text = text[:MAX_OUTPUT - self._length]
+                self._chunks.append(text)
+                self._length += len(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def __len__(self):
+        return self._length
+
+    def getvalue(self):
+        with self._lock:
+            return "".join(self._chunks)
+
+
+class _ThreadStdout(object):
+    """
+    Standard output which sends the writes of registered threads to their own output,
+    and every other write to the original standard output.
+    """
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.outputs = {}  # thread ident: _ThreadOutput
+
+    def write(self, text):
+        return self.outputs.get(threading.get_ident(), self.stdout).write(text)
+
+    def flush(self):
+        self.outputs.get(threading.get_ident(), self.stdout).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+
+def _thread_stdout():
+    """
+    Install the `_ThreadStdout` proxy as standard output, if it isn't already, and return it.
+    """
+    if not isinstance(sys.stdout, _ThreadStdout):
+        sys.stdout = _ThreadStdout(sys.stdout)
+    return sys.stdout
+
+
+class _MemoryTrace(object):
+    """
+    Traces memory allocations with `tracemalloc` while worker thread snippets run.
+    Tracing starts with the first snippet and stops after the last one, so that concurrent snippets share it.
+    `tracemalloc` keeps a single peak, counted from the start of tracing,
+    so the peak is only reported to a snippet which had the tracing to itself.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}  # _ThreadJob: whether it has had the tracing to itself so far
+
+    def begin(self, job):
+        with self._lock:
+            if not self._jobs:
+                if tracemalloc.is_tracing():
+                    # Traced by something else, which the peak would include
+                    return
+                tracemalloc.start()
+                self._jobs[job] = True
+            else:
+                self._jobs = dict.fromkeys(self._jobs, False)
+                self._jobs[job] = False
+
+    def end(self, job):
+        """
+        Returns: The peak traced memory in bytes, or `None` if it wasn't measured for this job alone.
+        """
+        with self._lock:
+            if job not in self._jobs:
+                return None
+            peak = tracemalloc.get_traced_memory()[1] if self._jobs.pop(job) else None
+            if not self._jobs:
+                tracemalloc.stop()
+            return peak
+
+
+_memory_trace = _MemoryTrace()
+
+
+class _ThreadJob(object):
+    """
+    Runs a code snippet in a daemon thread, capturing its printed output and measuring its peak memory.
+    """
+    def __init__(self, code, env):
+        self.code = code
+        self.env = dict(globals(), **env)
+
+        self.output = _ThreadOutput()
+        self.done = None
+        self.thread = None
+        self.started_at = None
+        self.wall_time = None
+        self.peak_memory = None
+        self.timed_out = False
+        self.error = False
+
+    def start(self, loop):
+        self.done = loop.create_future()
+
+        def finished():
+            if not self.done.done():
+                self.done.set_result(None)
+
+        stdout = _thread_stdout()
+        self.thread = threading.Thread(target=self._run, args=(loop, stdout, finished), daemon=True)
+        self.started_at = time.perf_counter()
+        self.thread.start()
+
+    def _run(self, loop, stdout, finished):
+        stdout.outputs[threading.get_ident()] = self.output
+        _memory_trace.begin(self)
+        try:
+            exec_string = "def _temp_exec():\n"
+            exec_string += '\n'.join(' ' * 4 + line for line in self.code.split('\n'))
+            exec(exec_string, self.env)
+            result = self.env['_temp_exec']()
+            if result is not None:
+                self.output.write("{}{}".format("\n" if len(self.output) else "", result))
+        except _Interrupted:
+            self.timed_out = True
+        except Exception:
+            self.error = True
+            self.output.write("\n" + traceback.format_exc())
+        finally:
+            self.wall_time = time.perf_counter() - self.started_at
+            self.peak_memory = _memory_trace.end(self)
+            stdout.outputs.pop(threading.get_ident(), None)
+            loop.call_soon_threadsafe(finished)
+
+    def interrupt(self):
+        """
+        Raise an exception in the thread, at the next python instruction it runs.
+        """
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(
+            ctypes.c_ulong(self.thread.ident), ctypes.py_object(_Interrupted)
+        )
+
+
+class _Interrupted(BaseException):
+    """
+    Raised in a worker thread snippet which ran past its timeout.
+    """
+
+
+def _output_pages(output):
+    """
+    Split output into code block pages of at most `PAGE_LEN` characters, on line boundaries where possible.
+    """
+    pages = []
+    current = ""
+    for line in (output or "No output.").splitlines(True):
+        while len(line) > PAGE_LEN:
+            if current:
+                pages.append(current)
+                current = ""
+            pages.append(line[:PAGE_LEN])
+            line = line[PAGE_LEN:]
+        if len(current) + len(line) > PAGE_LEN:
+            pages.append(current)
+            current = ""
+        current += line
+    if current:
+        pages.append(current)
+    return ["```py\n{}\n```".format(page.replace("```", "`\u200b``")) for page in pages]
+
+
 async def _eval(ctx):
     output = None
     try:
@@ -89,18 +360,21 @@ async def _async(ctx):
         'arg_str': ctx.arg_str
     }
     env.update(globals())
-    old_stdout = sys.stdout
-    redirected_output = sys.stdout = StringIO()
     result = None
     exec_string = "async def _temp_exec():\n"
     exec_string += '\n'.join(' ' * 4 + line for line in ctx.arg_str.split('\n'))
     try:
         exec(exec_string, env)
-        result = (redirected_output.getvalue(), 0)
     except Exception:
         result = (str(traceback.format_exc()), 1)
         return result
     _temp_exec = env['_temp_exec']
+
+    # Capture the output of the event loop thread, leaving any worker thread snippets' output alone
+    stdout = _thread_stdout()
+    ident = threading.get_ident()
+    previous = stdout.outputs.get(ident, None)
+    redirected_output = stdout.outputs[ident] = _ThreadOutput()
     try:
         returnval = await _temp_exec()
         value = redirected_output.getvalue()
@@ -111,5 +385,8 @@ async def _async(ctx):
     except Exception:
         result = (str(traceback.format_exc()), 1)
     finally:
-        sys.stdout = old_stdout
+        if previous is None:
+            stdout.outputs.pop(ident, None)
+        else:
+            stdout.outputs[ident] = previous
     return result
@@ -35,7 +35,7 @@ async def cmd_help(ctx):
     """
     if ctx.arg_str:
         # Attempt to fetch the command
-        command = ctx.client.cmd_cache.get(ctx.arg_str.strip(), None)
+        command = ctx.client.command_loader.get(ctx.arg_str.strip())
         if command is None:
             return await ctx.error_reply(
                 ("Command `{}` not found!\n"
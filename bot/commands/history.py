@@ -1,8 +1,16 @@
+import os
+import shutil
+import asyncio
+import tempfile
+from collections.abc import Sequence
+
 import discord
 from cmdClient import cmd
 from cmdClient.lib import UserCancelled, ResponseTimedOut
 
 from utils.seekers import find_member # noqa
+from utils.lib import paginate_summaries
+from tickets.export import export_guild, EXPORT_FORMATS
 
 from wards import is_moderator
 
@@ -12,6 +20,8 @@ Commands:
         Maybe have a syntax to pull up a version of a ticket.
     userlog - Show the tickets associated to a given user,
         as a paged summary.
+    export - Export the tickets of the guild as compressed attachments.
+    search - Search the ticket reasons, as a paged summary.
 """
 
 
@@ -49,48 +59,15 @@ async def cmd_userlog(ctx):
         return await ctx.error_reply("No members found matching `{}`".format(ctx.arg_str))
 
     # Obtain history
-    tickets = ctx.client.tickets.get_member_tickets(ctx.guild.id, user.id)
+    tickets = ctx.client.tickets.get_member_tickets(ctx.guild.id, user.id, replica=True)
     tickets.sort(key=lambda ticket: ticket.guild_ticket_id)
 
     if not tickets:
         return await ctx.reply("No past tickets associated with this user.")
 
-    tguild = ctx.client.tickets.guilds[ctx.guild.id]
-
-    ticket_summaries = []
-    for ticket in tickets:
-        summary = (
-            "{time} "
-            "[#{ticket_number}](https://discordapp.com/channels/{guildid}/{modlog}/{modlog_msg_id}): "
-            "{action} by {moderator}\n"
-            "```{reason}```"
-        ).format(
-            time=ticket.created_at,
-            guildid=ctx.guild.id,
-            modlog=tguild.modlog_id,
-            modlog_msg_id=ticket.modlog_msg_id,
-            ticket_number=ticket.guild_ticket_id,
-            action=ticket.action,
-            moderator="<@{}>".format(ticket.moderator_id),
-            reason=ticket.reason or "No reason."
-        )
-        ticket_summaries.append(summary)
-
-    pages = []
-    current_page = ""
-    for summary in ticket_summaries:
-        if len(current_page) > 2048:
-            pages.append(current_page[:2048])
-            current_page = current_page[2048:]
-
-        if current_page and len(current_page) + len(summary) > 2048:
-            pages.append(current_page)
-            current_page = summary
-        else:
-            current_page += "\n" + summary
+    ticket_summaries = [ticket.log_summary for ticket in tickets]
 
-    if current_page:
-        pages.append(current_page)
+    pages = paginate_summaries(ticket_summaries)
 
     embeds = []
     for i, page in enumerate(pages):
@@ -133,11 +110,15 @@ async def cmd_history(ctx):
         )
 
     # Retrieve the ticket
-    ticket = ctx.client.tickets.get_ticket(ctx.guild.id, ticket_num)
+    ticket = ctx.client.tickets.get_ticket(ctx.guild.id, ticket_num, replica=True)
 
     # Retrieve the ticket history
-    ticket_history = ctx.client.tickets.get_ticket_history(ctx.guild.id, ticket_num)
+    ticket_history = ctx.client.tickets.get_ticket_history(ctx.guild.id, ticket_num, replica=True)
     ticket_history.sort(key=lambda ticket: ticket.guild_ticket_id)
+    if not ticket_history:
+        return await ctx.error_reply(
+            "Ticket `{}` doesn't yet exist!".format(ticket_num)
+        )
 
     # Build the transaction summaries
     transactions = []
@@ -172,21 +153,7 @@ async def cmd_history(ctx):
                 )
             )
 
-    pages = []
-    current_page = ""
-    for summary in transactions:
-        if len(current_page) > 2048:
-            pages.append(current_page[:2048])
-            current_page = current_page[2048:]
-
-        if current_page and len(current_page) + len(summary) > 2048:
-            pages.append(current_page)
-            current_page = summary
-        else:
-            current_page += "\n" + summary
-
-    if current_page:
-        pages.append(current_page)
+    pages = paginate_summaries(transactions)
 
     embeds = []
     for i, page in enumerate(pages):
@@ -198,3 +165,140 @@ async def cmd_history(ctx):
         embeds.append(embed)
 
     await ctx.pager(embeds, locked=False)
+
+
+class SearchPages(Sequence):
+    """
+    Pages of ticket search results, each read from the registry when it is first shown.
+    """
+    def __init__(self, ctx, terms, count, per_page=5):
+        self.ctx = ctx
+        self.terms = terms
+        self.count = count
+        self.per_page = per_page
+
+        self._pages = {}
+
+    def __len__(self):
+        return (self.count + self.per_page - 1) // self.per_page
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index not in self._pages:
+            tickets = self.ctx.client.tickets.search_tickets(
+                self.ctx.guild.id, self.terms, self.per_page, offset=index * self.per_page, replica=True
+            )
+            description = "\n".join(ticket.log_summary for ticket in tickets)
+            if len(description) > 2048:
+                description = description[:2044] + "\n..."
+            embed = discord.Embed(
+                title="Tickets matching `{}`".format(self.terms),
+                description=description
+            )
+            embed.set_footer(text="Page {}/{} ({} tickets)".format(index + 1, len(self), self.count))
+            self._pages[index] = embed
+        return self._pages[index]
+
+
+@cmd("search",
+     group="History",
+     desc="Search the reasons of past tickets.")
+@is_moderator()
+async def cmd_search(ctx):
+    """
+    Usage``:
+        search <terms>
+    Description:
+        Search the reasons of the tickets in this guild for any of the given words.
+        Results are shown from the most relevant, then from the most recent.
+
+        This requires you to be a guild moderator (i.e. have the staff role or `manage_guild`).
+    Parameters::
+        terms: The words to search for.
+    Related:
+        userlog, show
+    """
+    terms = ctx.arg_str.strip()
+    if not terms:
+        return await ctx.error_reply("**USAGE:** `search <terms>`")
+
+    count = ctx.client.tickets.count_search_results(ctx.guild.id, terms, replica=True)
+    if not count:
+        return await ctx.reply("No tickets found matching `{}`.".format(terms))
+
+    await ctx.pager(SearchPages(ctx, terms, count), locked=False)
+
+
+@cmd("export",
+     group="History",
+     desc="Export the guild tickets as compressed CSV or JSON-lines files.")
+@is_moderator()
+async def cmd_export(ctx):
+    """
+    Usage``:
+        export [history] [csv | jsonl]
+    Description:
+        Export every ticket in this guild for auditing, as gzipped CSV (default) or JSON-lines attachments.
+        With `history`, every past version of each ticket is exported as well.
+        Large exports are split over several attachments.
+
+        This requires you to be a guild moderator (i.e. have the staff role or `manage_guild`).
+    Parameters::
+        history: Also export the ticket history.
+        csv | jsonl: The file format.
+    Related:
+        userlog, tickethistory
+    """
+    options = ctx.arg_str.lower().split()
+    unknown = [option for option in options if option != 'history' and option not in EXPORT_FORMATS]
+    if unknown:
+        return await ctx.error_reply("**USAGE:** `export [history] [csv | jsonl]`")
+    tables = ('tickets', 'history') if 'history' in options else ('tickets', )
+    fmt = next((option for option in options if option in EXPORT_FORMATS), 'csv')
+
+    # Files are split, and sent in batches, to fit the upload limit of the guild
+    max_size = getattr(ctx.guild, 'filesize_limit', 8 * 1024 * 1024) - 64 * 1024
+
+    exported = 0
+
+    def progress(rows):
+        nonlocal exported
+        exported = rows
+
+    status = await ctx.reply("Exporting tickets...")
+    directory = tempfile.mkdtemp(prefix="ticketbot-export-")
+    try:
+        storage = ctx.client.tickets.storage.reader(ctx.guild.id)
+        task = ctx.client.loop.run_in_executor(
+            None,
+            lambda: export_guild(storage, ctx.guild.id, directory, tables=tables, fmt=fmt, max_size=max_size,
+                                 progress=progress)
+        )
+        # Report the progress while the export runs in a worker thread
+        while True:
+            done, _ = await asyncio.wait((task, ), timeout=5)
+            if done:
+                break
+            await status.edit(content="Exporting tickets... `{}` rows written.".format(exported))
+        paths = task.result()
+
+        if not paths:
+            return await status.edit(content="There are no tickets to export!")
+        await status.edit(content="Exported `{}` rows in `{}` files.".format(exported, len(paths)))
+        # The upload limit applies to each message as a whole, and at most 10 attachments may be sent at once
+        batches = [[]]
+        batch_size = 0
+        for path in paths:
+            size = os.path.getsize(path)
+            if batches[-1] and (batch_size + size > max_size or len(batches[-1]) == 10):
+                batches.append([])
+                batch_size = 0
+            batches[-1].append(path)
+            batch_size += size
+        for batch in batches:
+            await ctx.ch.send(files=[discord.File(path, filename=os.path.basename(path)) for path in batch])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
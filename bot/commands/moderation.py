@@ -14,8 +14,6 @@ Commands:
 """
 
 
-# TODO: Handle user being in multiple guilds.
-# Put guildname in list when in DMS, and only show tickets from current guild otherwise.
 @cmd("queue",
      group="Moderation",
      desc="Display your personal ticket queue and resolve tickets.",
@@ -29,19 +27,29 @@ async def cmd_queue(ctx):
         When viewing the queue you may select a ticket to resolve,
         whereupon you will be prompted to enter a reason for the ticket.
 
-        This command works in direct messages,
+        When used in a guild, only the tickets from that guild are shown.
+        This command also works in direct messages, showing the tickets from every guild,
         which is expected to be the most convenient place to resolve tickets.
     """
-    tmod = ctx.client.tickets.mods.get(ctx.author.id, None)
-    if not tmod or not tmod.ticket_queue:
+    guildid = ctx.guild.id if ctx.guild else None
+    tmod = ctx.client.tickets.get_mod_queue(ctx.author)
+    if not tmod or not tmod.count(guildid):
         return await ctx.reply("Your ticket queue is empty, good job! ✨")
-    queue = tmod.ticket_queue.copy()
+    if not ctx.client.tickets.receives_dms:
+        # The reason prompts are answered in direct messages, which are handled by another process
+        return await ctx.reply(
+            "You have `{}` unresolved tickets here, please use `queue` in direct messages to resolve them.".format(
+                tmod.count(guildid)
+            )
+        )
+    queue = tmod.get_queue(guildid).copy()
 
     # TODO: Not really threadsafe, the ticket details might change
     while True:
         if not queue:
             return await ctx.reply("You have reached the end of your queue! ✨")
 
+        await ctx.client.tickets.users.fetch_many(ticket.victim_id for ticket in queue)
         summary_list = [ticket.summary for ticket in queue]
 
         try:
@@ -52,7 +60,7 @@ async def cmd_queue(ctx):
             return await ctx.reply("User closed queue.")
 
         await ctx.client.tickets.prompt_mod(tmod, queue[index])
-        queue = tmod.ticket_queue.copy()
+        queue = tmod.get_queue(guildid).copy()
 
 
 @cmd("note",
@@ -1,8 +1,13 @@
+import re
+import datetime
+
 from cmdClient import cmd
 from cmdClient.lib import UserCancelled, ResponseTimedOut
 
 from utils.seekers import find_member # noqa
 from utils.interactive import input  # noqa
+from utils.lib import parse_duration, format_duration
+from tickets.filters import TicketFilter
 
 from wards import is_moderator
 
@@ -13,8 +18,120 @@ Commands:
         setreason - Set the reason for a specified ticket
         setmod - set the mod for a specified ticket
         claim - claim as specified ticket as your own case
+        duration - set how long a ban or tracked role lasts
+
+Tickets may be selected by number or by filter, see `parse_ticket_filter`.
 """
 
+FILTER_HELP = (
+    "Tickets may be given as numbers and ranges, e.g. `1, 4-10`, and filtered with "
+    "`resolved`, `unresolved`, `mod:<user>`, `user:<user>`, `action:<action>` and `since:<duration>`. "
+    "Quote names with spaces, e.g. `user:\"John Smith\"`."
+)
+
+# A quoted `key:"value"`, a list of ticket numbers and ranges, or any other word
+FILTER_TERM = re.compile(
+    r'\s*(?:(?P<key>\w+):"(?P<quoted>[^"]*)"'
+    r'|(?P<ranges>#?\d+(?:\s*-\s*\d+)?(?:\s*,\s*#?\d+(?:\s*-\s*\d+)?)*(?:\s*,)?)(?=\s|$)'
+    r'|(?P<word>\S+))'
+)
+
+
+def split_filter_terms(filterstr):
+    """
+    Split a ticket selection into its terms, see `parse_ticket_filter`.
+    Spaces are allowed around the commas and hyphens of ticket ranges, and within quoted values.
+
+    Returns: List of `(key, value, term)` tuples, with the lowercased key before a colon and the value after it,
+        the `(None, ranges, term)` for ticket numbers, with `ranges` a list of `(first, last)` pairs,
+        or `(None, None, term)` for other words.
+
+    >>> split_filter_terms('1, 4 - 10 unresolved')
+    [(None, [(1, 1), (4, 10)], '1, 4 - 10'), (None, None, 'unresolved')]
+    >>> split_filter_terms('user:"John Smith" mod:"foo - bar" action:BAN')
+    [('user', 'John Smith', 'user:"John Smith"'), ('mod', 'foo - bar', 'mod:"foo - bar"'), ('action', 'BAN', 'action:BAN')]
+    >>> split_filter_terms('mod:foo - bar')
+    [('mod', 'foo', 'mod:foo'), (None, None, '-'), (None, None, 'bar')]
+    >>> split_filter_terms('user:Anne-Marie 12abc')
+    [('user', 'Anne-Marie', 'user:Anne-Marie'), (None, None, '12abc')]
+    """
+    terms = []
+    for match in FILTER_TERM.finditer(filterstr):
+        term = match.group(0).strip()
+        if match.group('quoted') is not None:
+            terms.append((match.group('key').lower(), match.group('quoted'), term))
+        elif match.group('ranges') is not None:
+            ranges = []
+            for part in re.sub(r"[\s#]", "", term).strip(',').split(','):
+                first, _, last = part.partition('-')
+                ranges.append((int(first), int(last or first)))
+            terms.append((None, ranges, term))
+        elif ':' in term:
+            key, _, value = term.partition(':')
+            terms.append((key.lower(), value, term))
+        else:
+            terms.append((None, None, term))
+    return terms
+
+
+async def parse_ticket_filter(ctx, filterstr):
+    """
+    Parse a selection of tickets from the current guild.
+
+    The selection is made of whitespace separated terms, every one of which the tickets must match:
+        `1, 2, 4-10`: Ticket numbers and ranges.
+        `resolved` or `unresolved`: Whether the tickets have a reason.
+        `mod:<user>` or `from:<user>`: The assigned moderator.
+        `user:<user>`: The user acted on.
+        `action:<action>`: The action type, e.g. `BAN`.
+        `since:<duration>`: Created within the given duration, e.g. `2h`.
+    Users may be given as a mention, an id, or a name to look up, quoted if it contains spaces.
+
+    Returns: `TicketFilter`
+    Raises ValueError with a message for the user if the selection is invalid.
+    """
+    kwargs = {}
+    for key, value, term in split_filter_terms(filterstr):
+        if key is None and value is not None:
+            kwargs.setdefault('ticket_ranges', []).extend(value)
+        elif key is None and term.lower() in ('resolved', 'unresolved'):
+            kwargs['resolved'] = term.lower() == 'resolved'
+        elif key in ('mod', 'from', 'user') and value:
+            userstr = value
+            match = re.fullmatch(r"<@!?(\d+)>|(\d+)", userstr)
+            if match:
+                userid = int(match.group(1) or match.group(2))
+            else:
+                try:
+                    member = await ctx.find_member(userstr, interactive=True)
+                except UserCancelled:
+                    raise ValueError("User cancelled member selection. Tickets were not updated.")
+                except ResponseTimedOut:
+                    raise ValueError("Member selection timed out. Tickets were not updated.")
+                if member is None:
+                    raise ValueError("Member `{}` could not be found.".format(userstr))
+                userid = member.id
+            kwargs['victim_id' if key == 'user' else 'moderator_id'] = userid
+        elif key == 'action' and value:
+            action = ctx.client.tickets.ActionTypes.__members__.get(value.upper(), None)
+            if action is None:
+                raise ValueError("Unknown action `{}`, expected one of `{}`.".format(
+                    value, "`, `".join(ctx.client.tickets.ActionTypes.__members__)
+                ))
+            kwargs['action_id'] = int(action)
+        elif key == 'since' and value:
+            kwargs['since'] = datetime.datetime.utcnow() - datetime.timedelta(seconds=parse_duration(value))
+        else:
+            raise ValueError("Could not understand `{}`. {}".format(term, FILTER_HELP))
+
+    tfilter = TicketFilter(ctx.guild.id, **kwargs)
+    if tfilter.empty:
+        raise ValueError("No tickets selected. {}".format(FILTER_HELP))
+    max_ticket = tfilter.max_ticket
+    if max_ticket is not None and max_ticket > ctx.client.tickets.guilds[ctx.guild.id].ticket_count:
+        raise ValueError("Ticket `{}` doesn't yet exist!".format(max_ticket))
+    return tfilter
+
 
 @cmd("show",
      group="Tickets",
@@ -48,9 +165,10 @@ async def cmd_show(ctx):
         )
 
     # Retrieve the ticket
-    ticket = ctx.client.tickets.get_ticket(ctx.guild.id, ticket_num)
+    ticket = ctx.client.tickets.get_ticket(ctx.guild.id, ticket_num, replica=True)
 
     # Display the ticket
+    await ctx.client.tickets.users.fetch(ticket.victim_id)
     await ctx.reply(embed=ticket.embed)
 
 
@@ -64,49 +182,51 @@ async def cmd_setreason(ctx):
     Usage``:
         setreason <ticket#>; <reason>
         setreason <ticket#>, <ticket#>, <ticket#>...; <reason>
+        setreason <filters>; <reason>
     Description:
-        Sets the given reason for all the specified tickets.
+        Sets the given reason for all the specified tickets, and marks them as resolved.
+        Tickets may be given by number, by range, or selected by filters.
+        All the selected tickets are updated at once.
 
         This requires you to be a guild moderator (i.e. have the staff role or `manage_guild`).
     Parameters::
         ticket#: The number of the ticket you wish to set the reason for.
+        filters: Any of `resolved`, `unresolved`, `mod:<user>`, `user:<user>`, `action:<action>`, `since:<duration>`.
         reason: A non-empty reason for the specified tickets.
     Related:
         show, changemod, tickethistory, userlog
     Examples``:
         setreason 1; Said naughty words.
         setreason 1,2,3,4; Raiding.
+        setreason unresolved mod:@bot action:BAN since:2h; Raid wave 3
     """
     usage_str = (
         "**USAGE:**\n"
         "`setreason <ticket#>; <reason>`\n"
-        "`setreason <ticket#>, <ticket#>, <ticket#>...; <reason>`"
+        "`setreason <ticket#>, <ticket#>, <ticket#>...; <reason>`\n"
+        "`setreason <filters>; <reason>`"
     )
     if ';' not in ctx.arg_str:
         return await ctx.error_reply(usage_str)
 
-    ticketstr, reason = ctx.arg_str.split(';')
+    filterstr, reason = ctx.arg_str.split(';', 1)
     reason = reason.strip()
-    tstrs = [tstr.strip() for tstr in ticketstr.split(',')]
-
-    if not ticketstr or not reason or not all(tstr.isdigit() for tstr in tstrs):
+    if not filterstr.strip() or not reason:
         return await ctx.error_reply(usage_str)
 
-    tickets = [int(tstr) for tstr in tstrs]
-    max_ticket = ctx.client.tickets.guilds[ctx.guild.id].ticket_count
-    dud_ticket = next((ticket for ticket in tickets if ticket > max_ticket), None)
-    if dud_ticket is not None:
-        return await ctx.error_reply(
-            "Ticket `{}` doesn't yet exist!".format(dud_ticket)
-        )
-
-    for ticket in tickets:
-        await ctx.client.tickets.get_ticket(ctx.guild.id, ticket).update_reason(
-            ctx.author.id,
-            reason
-        )
+    try:
+        tfilter = await parse_ticket_filter(ctx, filterstr)
+    except ValueError as e:
+        return await ctx.error_reply(str(e))
+
+    count = await ctx.client.tickets.update_tickets(
+        tfilter,
+        modified_by_id=ctx.author.id,
+        reason=reason,
+        resolved=True
+    )
 
-    await ctx.reply("`{}` tickets have been updated!".format(len(tickets)))
+    await ctx.reply("`{}` tickets have been updated!".format(count))
 
 
 @cmd("changemod",
@@ -119,40 +239,42 @@ async def cmd_changemod(ctx):
     Usage``:
         changemod <ticket#>; <newmod>
         changemod <ticket#>, <ticket#>, <ticket#>...; <newmod>
+        changemod <filters>; <newmod>
     Description:
         Changes the assigned moderator for all the specified tickets.
+        Tickets may be given by number, by range, or selected by filters.
+        All the selected tickets are updated at once.
 
         This requires you to be a guild moderator (i.e. have the staff role or `manage_guild`).
     Parameters::
         ticket#: The number of the ticket you wish to change the moderator for.
+        filters: Any of `resolved`, `unresolved`, `from:<user>`, `user:<user>`, `action:<action>`, `since:<duration>`.
         newmod: The new moderator. May be a mention, id or name.
     Related:
         show, claim, setreason, tickethistory, userlog
     Examples``:
         changemod 1; Bob
         changemod 1,2,3,4; Bob
+        changemod from:@oldmod; @newmod
     """
     usage_str = (
         "**USAGE:**\n"
         "`changemod <ticket#>; <newmod>`\n"
-        "`changemod <ticket#>, <ticket#>, <ticket#>...; <newmod>`"
+        "`changemod <ticket#>, <ticket#>, <ticket#>...; <newmod>`\n"
+        "`changemod <filters>; <newmod>`"
     )
     if ';' not in ctx.arg_str:
         return await ctx.error_reply(usage_str)
 
-    ticketstr, newmodstr = ctx.arg_str.split(';')
-    tstrs = [tstr.strip() for tstr in ticketstr.split(',')]
-
-    if not ticketstr or not newmodstr or not all(tstr.isdigit() for tstr in tstrs):
+    filterstr, newmodstr = ctx.arg_str.split(';', 1)
+    newmodstr = newmodstr.strip()
+    if not filterstr.strip() or not newmodstr:
         return await ctx.error_reply(usage_str)
 
-    tickets = [int(tstr) for tstr in tstrs]
-    max_ticket = ctx.client.tickets.guilds[ctx.guild.id].ticket_count
-    dud_ticket = next((ticket for ticket in tickets if ticket > max_ticket), None)
-    if dud_ticket is not None:
-        return await ctx.error_reply(
-            "Ticket `{}` doesn't yet exist!".format(dud_ticket)
-        )
+    try:
+        tfilter = await parse_ticket_filter(ctx, filterstr)
+    except ValueError as e:
+        return await ctx.error_reply(str(e))
     try:
         newmod = await ctx.find_member(newmodstr, interactive=True)
     except UserCancelled:
@@ -169,13 +291,13 @@ async def cmd_changemod(ctx):
             "Member `{}` could not be found.".format(newmodstr)
         )
 
-    for ticket in tickets:
-        await ctx.client.tickets.get_ticket(ctx.guild.id, ticket).update_moderator(
-            ctx.author.id,
-            newmod.id
-        )
+    count = await ctx.client.tickets.update_tickets(
+        tfilter,
+        modified_by_id=ctx.author.id,
+        moderator_id=newmod.id
+    )
 
-    await ctx.reply("`{}` tickets have been updated!".format(len(tickets)))
+    await ctx.reply("`{}` tickets have been updated!".format(count))
 
 
 @cmd("claim",
@@ -187,44 +309,125 @@ async def cmd_claim(ctx):
     Usage``:
         claim <ticket#>
         claim <ticket#>, <ticket#>, <ticket#>...
+        claim <filters>
     Description:
         Changes the assigned moderator for all the specified tickets to yourself.
         This may be useful if e.g. you have used a bot to perform a moderation action,
         in which case the bot will initially be credited as the moderator.
+        Tickets may be given by number, by range, or selected by filters.
 
         This requires you to be a guild moderator (i.e. have the staff role or `manage_guild`).
     Parameters::
         ticket#: The number of the ticket you wish to claim.
+        filters: Any of `resolved`, `unresolved`, `from:<user>`, `user:<user>`, `action:<action>`, `since:<duration>`.
     Related:
         show, changemod, setreason, tickethistory, userlog
     Examples``:
         claim 1
         claim 1, 2, 3, 4
+        claim unresolved from:@bot since:1h
     """
     usage_str = (
         "**USAGE:**\n"
         "`claim <ticket#>`\n"
-        "`claim <ticket#>, <ticket#>, <ticket#>...`"
+        "`claim <ticket#>, <ticket#>, <ticket#>...`\n"
+        "`claim <filters>`"
+    )
+    if not ctx.arg_str.strip():
+        return await ctx.error_reply(usage_str)
+
+    try:
+        tfilter = await parse_ticket_filter(ctx, ctx.arg_str)
+    except ValueError as e:
+        return await ctx.error_reply(str(e))
+
+    count = await ctx.client.tickets.update_tickets(
+        tfilter,
+        modified_by_id=ctx.author.id,
+        moderator_id=ctx.author.id
     )
 
-    tstrs = [tstr.strip() for tstr in ctx.arg_str.split(',')]
-    if not ctx.arg_str or not all(tstr.isdigit() for tstr in tstrs):
+    await ctx.reply("You have claimed `{}` tickets.".format(count))
+
+
+@cmd("duration",
+     group="Tickets",
+     desc="Set how long the specified ticket(s) last.",
+     aliases=["expire"])
+@is_moderator()
+async def cmd_duration(ctx):
+    """
+    Usage``:
+        duration <ticket#>; <duration>
+        duration <ticket#>, <ticket#>, <ticket#>...; <duration>
+    Description:
+        Sets the duration of the specified ban or tracked role tickets, counted from when each ticket was created.
+        Once the duration has passed, the ban is automatically lifted, or the role is removed.
+        A duration of `none` makes the tickets permanent again.
+
+        This requires you to be a guild moderator (i.e. have the staff role or `manage_guild`).
+    Parameters::
+        ticket#: The number of the ticket you wish to set the duration for.
+        duration: The new duration, e.g. `12h`, `1d 12h` or `2w`, or `none`.
+    Related:
+        show, setreason, addrole
+    Examples``:
+        duration 1; 7d
+        duration 1,2,3,4; 12h
+        duration 5; none
+    """
+    usage_str = (
+        "**USAGE:**\n"
+        "`duration <ticket#>; <duration>`\n"
+        "`duration <ticket#>, <ticket#>, <ticket#>...; <duration>`"
+    )
+    if ';' not in ctx.arg_str:
         return await ctx.error_reply(usage_str)
 
-    tickets = [int(tstr) for tstr in tstrs]
+    ticketstr, durationstr = ctx.arg_str.split(';', 1)
+    durationstr = durationstr.strip()
+    tstrs = [tstr.strip() for tstr in ticketstr.split(',')]
+
+    if not ticketstr or not durationstr or not all(tstr.isdigit() for tstr in tstrs):
+        return await ctx.error_reply(usage_str)
+
+    if durationstr.lower() == 'none':
+        duration = None
+    else:
+        try:
+            duration = parse_duration(durationstr)
+        except ValueError:
+            return await ctx.error_reply(
+                "Couldn't understand the duration `{}`, please use e.g. `12h` or `1d 12h`.".format(durationstr)
+            )
+
+    ticketids = [int(tstr) for tstr in tstrs]
     max_ticket = ctx.client.tickets.guilds[ctx.guild.id].ticket_count
-    dud_ticket = next((ticket for ticket in tickets if ticket > max_ticket), None)
+    dud_ticket = next((ticket for ticket in ticketids if ticket > max_ticket), None)
     if dud_ticket is not None:
         return await ctx.error_reply(
             "Ticket `{}` doesn't yet exist!".format(dud_ticket)
         )
 
-    for ticket in tickets:
-        await ctx.client.tickets.get_ticket(ctx.guild.id, ticket).update_moderator(
-            ctx.author.id,
-            ctx.author.id
+    tickets = [ctx.client.tickets.get_ticket(ctx.guild.id, ticketid) for ticketid in ticketids]
+    undoable = (ctx.client.tickets.ActionTypes.BAN, ctx.client.tickets.ActionTypes.ROLE_ADD)
+    dud_ticket = next((ticket for ticket in tickets if ticket.action_id not in undoable), None)
+    if dud_ticket is not None:
+        return await ctx.error_reply(
+            "Ticket `{}` is not a ban or tracked role ticket, so it can't have a duration!".format(
+                dud_ticket.guild_ticket_id
+            )
         )
 
-    await ctx.reply("You have claimed tickets `{}`.".format(
-        "`, `".join(tstrs)
+    for ticket in tickets:
+        if duration is None:
+            undo_at = None
+        else:
+            created_at = ticket.created_at.replace(tzinfo=datetime.timezone.utc)
+            undo_at = int(created_at.timestamp()) + duration
+        await ticket.update(modified_by_id=ctx.author.id, undo_at=undo_at)
+
+    await ctx.reply("`{}` tickets have been updated to {}!".format(
+        len(tickets),
+        "last `{}`".format(format_duration(duration)) if duration else "be permanent"
     ))
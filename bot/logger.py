@@ -1,22 +1,119 @@
 import sys
+import json
+import queue
+import atexit
 import logging
+import logging.handlers
 
 from config import conf
 
 
+class TextFormatter(logging.Formatter):
+    """
+    Human readable formatter.
+    Prefixes every line of a multi-line message with the record header,
+    and appends any structured fields to the message.
+    """
+    def format(self, record):
+        header = "[{}][{:^8}] [{}] ".format(
+            self.formatTime(record, self.datefmt),
+            record.levelname,
+            str(getattr(record, 'context', "Global")).center(18, '=')
+        )
+        message = record.getMessage()
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += " ({})".format(", ".join("{}={}".format(key, value) for key, value in fields.items()))
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return "\n".join(header + line for line in message.split('\n'))
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each record as a single JSON object, for JSON-lines log files.
+    Structured fields passed to `log` are included as top level keys.
+    """
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'context': str(getattr(record, 'context', "Global")),
+            'message': record.getMessage()
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler which defers all formatting to the listener thread.
+    """
+    def prepare(self, record):
+        # Merge the arguments now, since they may be mutated after the call returns
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _file_handler(logfile):
+    """
+    Build the log file handler, rotating by time or size if configured.
+    """
+    backups = conf.getint('log_backup_count', 5)
+    if conf.get('log_rotate_when'):
+        return logging.handlers.TimedRotatingFileHandler(
+            filename=logfile,
+            when=conf['log_rotate_when'],
+            backupCount=backups,
+            encoding='utf-8',
+            utc=True
+        )
+    elif conf.getint('log_max_bytes', 0):
+        return logging.handlers.RotatingFileHandler(
+            filename=logfile,
+            maxBytes=conf.getint('log_max_bytes'),
+            backupCount=backups,
+            encoding='utf-8'
+        )
+    else:
+        return logging.FileHandler(filename=logfile, encoding='utf-8', mode='a')
+
+
 # Setup the logger
-LOGFILE = conf['logfile']
-logger = logging.getLogger()
-log_fmt = logging.Formatter(fmt='[{asctime}][{levelname:^8}] {message}', datefmt='%d/%m | %H:%M:%S', style='{')
-file_handler = logging.FileHandler(filename=LOGFILE, encoding='utf-8', mode='a')
+# Records are handed to a queue on the calling thread,
+# and formatted and written by a background listener thread.
+LOGFILE = conf.get('logfile', None)
+datefmt = '%d/%m | %H:%M:%S'
+text_fmt = TextFormatter(datefmt=datefmt)
+file_fmt = JSONFormatter(datefmt='%Y-%m-%dT%H:%M:%S') if conf.get('log_format', 'text') == 'json' else text_fmt
+
+handlers = []
+if LOGFILE:
+    file_handler = _file_handler(LOGFILE)
+    file_handler.setFormatter(file_fmt)
+    handlers.append(file_handler)
 term_handler = logging.StreamHandler(sys.stdout)
-file_handler.setFormatter(log_fmt)
-term_handler.setFormatter(log_fmt)
-logger.addHandler(file_handler)
-logger.addHandler(term_handler)
-logger.setLevel(logging.INFO)
+term_handler.setFormatter(text_fmt)
+handlers.append(term_handler)
+
+log_queue = queue.SimpleQueue()
+listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+logger = logging.getLogger()
+logger.addHandler(LogQueueHandler(log_queue))
+logger.setLevel(conf.get('log_level', 'INFO').upper())
 
 
-def log(message, context="Global".center(18, '='), level=logging.INFO):
-    for line in message.split('\n'):
-        logger.log(level, '[{}] {}'.format(str(context).center(18, '='), line))
+def log(message, context="Global", level=logging.INFO, **fields):
+    """
+    Log a message with the given context.
+    Any extra keyword arguments, e.g. `guild_id` or `ticket`,
+    are attached to the record as structured fields.
+    """
+    logger.log(level, message, extra={'context': context, 'fields': fields})
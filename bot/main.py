@@ -1,10 +1,27 @@
 import os
+import logging
 
 from config import conf
-from logger import log
-from cmdClient.cmdClient import cmdClient
+from profiling import startup
 
-from tickets.interface import TicketInterface
+# Time every import from here on when profiling the startup
+if conf.getboolean('profile_startup', False):
+    startup.enable()
+
+with startup.phase("imports"):
+    import discord
+
+    from logger import log
+    from metrics import instrument_client, serve
+    from cmdClient.cmdClient import cmdClient
+    from sharding import parse_shard_ids
+    from permissions import PermissionCache
+    from command_loader import CommandLoader
+    from watchdog import LoopWatchdog
+
+    from tickets.interface import TicketInterface
+    from tickets.users import UserResolver
+    from tickets.storage import open_storage
 
 # Get the real location
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
@@ -13,22 +30,114 @@ __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file
 # Load required data from configs
 masters = [int(master.strip()) for master in conf['masters'].split(",")]
 
+
+class ShardedClient(cmdClient, discord.AutoShardedClient):
+    pass
+
+
+# Run on uvloop if requested, before the client creates its event loop
+if conf.getboolean('use_uvloop', False):
+    try:
+        import uvloop
+    except ImportError:
+        log("uvloop is not installed, using the default asyncio event loop.", context='SETUP', level=logging.WARNING)
+    else:
+        uvloop.install()
+        log("Using the uvloop event loop.", context='SETUP')
+
 # Initialise the client
-client = cmdClient(prefix=conf['prefix'], owners=masters)
+# Without `shard_count` the client is unsharded.
+# With only `shard_count`, this process runs every shard.
+# With `shard_ids` as well, this process runs the given shards, and only handles their guilds.
+shard_count = conf.getint('shard_count', 0) or None
+shard_ids = parse_shard_ids(conf.get('shard_ids', ''))
+if shard_ids is not None and shard_count is None:
+    raise ValueError("`shard_ids` requires `shard_count` to be set.")
+
+# Requesting every guild member at startup may be disabled, users are then fetched as needed
+client_opts = {
+    'chunk_guilds_at_startup': conf.getboolean('chunk_guilds', True)
+}
+
+if shard_count is None:
+    client = cmdClient(prefix=conf['prefix'], owners=masters, **client_opts)
+else:
+    client = ShardedClient(
+        prefix=conf['prefix'], owners=masters, shard_count=shard_count, shard_ids=shard_ids, **client_opts
+    )
+    log("Running {} of {} shards.".format(shard_ids or "all", shard_count), context='SETUP')
 client.log = log
+instrument_client(client)
+PermissionCache(client, maxsize=conf.getint('permission_cache_size', 10000))
+
+# Watch for synchronous code blocking the event loop
+if conf.getint('loop_watchdog_ms', 250):
+    LoopWatchdog(
+        client.loop,
+        threshold=conf.getint('loop_watchdog_ms', 250) / 1000,
+        report_interval=conf.getint('loop_watchdog_report_interval', 60)
+    ).start()
 
 # Initialise the TicketInterface
-dbopts = {
-    'username': conf['db_user'],
-    'password': conf['db_password'],
-    'host': conf['db_host'],
-    'database': conf['db_name']
-}
+db_backend = conf.get('db_backend', 'mysql')
+if db_backend == 'sqlite':
+    dbopts = {
+        'path': conf['db_path']
+    }
+else:
+    dbopts = {
+        'username': conf['db_user'],
+        'password': conf['db_password'],
+        'host': conf['db_host'],
+        'database': conf['db_name']
+    }
+replicas = [replica.strip() for replica in conf.get('db_replicas', '').split(',') if replica.strip()]
+if replicas and db_backend != 'mysql':
+    raise ValueError("`db_replicas` is only supported by the `mysql` backend, not `{}`.".format(db_backend))
+
+with startup.phase("open_storage"):
+    storage = open_storage(db_backend, **dbopts)
+    for replica in replicas:
+        host, _, port = replica.partition(':')
+        replica_opts = dict(dbopts, host=host)
+        if port:
+            replica_opts['port'] = int(port)
+        storage.add_replica(open_storage(db_backend, **replica_opts))
+storage.sticky = conf.getint('db_replica_sticky', 5)
+if conf.getint('db_group_commit_ms', 0):
+    storage.enable_group_commit(
+        window=conf.getint('db_group_commit_ms') / 1000,
+        max_batch=conf.getint('db_group_commit_size', 200)
+    )
+
+TicketInterface(
+    client,
+    storage,
+    catchup_concurrency=conf.getint('audit_catchup_concurrency', 4),
+    shard_count=shard_count,
+    shard_ids=shard_ids,
+    users=UserResolver(
+        client,
+        maxsize=conf.getint('user_cache_size', 10000),
+        ttl=conf.getint('user_cache_ttl', 3600),
+        concurrency=conf.getint('user_fetch_concurrency', 8)
+    )
+)
 
-TicketInterface(client, dbopts)
+# Load the commands, or only register them to be loaded when first used
+with startup.phase("load_commands"):
+    CommandLoader(
+        client,
+        os.path.join(__location__, 'commands'),
+        lazy=conf.getboolean('lazy_commands', False)
+    ).load()
 
-# Load the commands
-client.load_dir(os.path.join(__location__, 'commands'))
+# Expose the metrics endpoint, if configured
+if conf.get('metrics_port'):
+    metrics_host = conf.get('metrics_host', '127.0.0.1')
+    metrics_port = conf.getint('metrics_port')
+    client.loop.run_until_complete(serve(metrics_host, metrics_port))
+    log("Serving metrics on {}:{}".format(metrics_host, metrics_port), context='SETUP')
 
 # Log and execute!
 log("Initial setup complete, logging in", context='SETUP')
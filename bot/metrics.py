@@ -0,0 +1,328 @@
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+
+"""
+Lightweight in-process metrics registry.
+
+Provides counters, gauges and histograms, collected in a `Registry`
+and rendered in the Prometheus text exposition format.
+The registry may optionally be exposed over a local HTTP endpoint with `serve`.
+"""
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if value == float('-inf'):
+        return "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{{{}}}".format(",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs))
+
+
+class Metric(object):
+    """
+    Base class for a labelled metric family.
+    Each distinct combination of label values is stored as a separate sample.
+
+    Parameters
+    ----------
+    name: str
+        The metric name, as it will appear in the exposition.
+    doc: str
+        Short description of the metric, rendered as the `HELP` line.
+    labels: Tuple(str)
+        Names of the labels for this metric, passed as keyword arguments when updating.
+    registry: Union(Registry, None)
+        Registry to add the metric to. Uses the global `REGISTRY` if not provided.
+    """
+    type_name = None
+
+    def __init__(self, name, doc, labels=(), registry=None):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+
+        self._values = {}  # labelvalues: value
+        self._lock = threading.Lock()
+
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("Metric `{}` expects labels {}, got {}.".format(
+                self.name, self.labelnames, tuple(labels.keys())
+            ))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """
+        Remove the sample with the given labels, if it exists.
+        """
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def clear(self):
+        """
+        Remove every sample of this metric.
+        """
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """
+        Yield the `(suffix, labelvalues, extra_labels, value)` tuples to render.
+        """
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield ("", labelvalues, (), value)
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.doc.replace('\\', '\\\\').replace('\n', '\\n')),
+            "# TYPE {} {}".format(self.name, self.type_name)
+        ]
+        for suffix, labelvalues, extra, value in self.samples():
+            lines.append("{}{}{} {}".format(
+                self.name,
+                suffix,
+                _format_labels(self.labelnames, labelvalues, extra),
+                _format_value(value)
+            ))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value, e.g. the number of events handled.
+    """
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts.")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    Value which may go up and down, e.g. a queue depth.
+    """
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, e.g. latencies, in cumulative buckets.
+
+    Parameters
+    ----------
+    buckets: Tuple(float)
+        Upper bounds of the buckets, in increasing order.
+        A final `+Inf` bucket is added if not present.
+    """
+    type_name = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS, registry=None):
+        buckets = tuple(sorted(buckets))
+        if buckets[-1] != float('inf'):
+            buckets += (float('inf'), )
+        self.buckets = buckets
+        super().__init__(name, doc, labels=labels, registry=registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key, None)
+            if state is None:
+                # Per-bucket counts, followed by the sum and the count
+                state = self._values[key] = [0] * len(self.buckets) + [0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Context manager observing the wall time spent in the block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for labelvalues, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield ("_bucket", labelvalues, (("le", _format_value(bound)), ), cumulative)
+            yield ("_sum", labelvalues, (), state[-2])
+            yield ("_count", labelvalues, (), state[-1])
+
+
+class Registry(object):
+    """
+    Collection of metrics to be rendered together.
+
+    Collectors are functions taking no arguments, run before each render.
+    They allow expensive or derived values, such as queue depths,
+    to be computed at scrape time rather than on every update.
+    """
+    def __init__(self):
+        self.metrics = {}  # name: Metric
+        self.collectors = []
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric `{}` is already registered.".format(metric.name))
+        self.metrics[metric.name] = metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            collector()
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# Metrics not owned by any particular module
+discord_requests = Counter(
+    "ticketbot_discord_requests_total",
+    "Discord REST requests made, by method and route.",
+    labels=("method", "route")
+)
+discord_request_errors = Counter(
+    "ticketbot_discord_request_errors_total",
+    "Discord REST requests which raised an exception, by method and route.",
+    labels=("method", "route")
+)
+discord_request_latency = Histogram(
+    "ticketbot_discord_request_seconds",
+    "Discord REST request latency, by method and route.",
+    labels=("method", "route")
+)
+db_latency = Histogram(
+    "ticketbot_db_query_seconds",
+    "Database query latency, by query.",
+    labels=("query",)
+)
+
+
+def instrument_client(client):
+    """
+    Wrap the REST request method of the given `discord.Client`
+    to count and time the Discord API calls made by the bot, per route.
+    The route is the unformatted path, e.g. `/channels/{channel_id}/messages`,
+    to keep the label cardinality bounded.
+    """
+    http = client.http
+    request = http.request
+
+    async def instrumented_request(route, **kwargs):
+        labels = {
+            'method': getattr(route, 'method', "UNKNOWN"),
+            'route': getattr(route, 'path', str(route))
+        }
+        discord_requests.inc(**labels)
+        start = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        except Exception:
+            discord_request_errors.inc(**labels)
+            raise
+        finally:
+            discord_request_latency.observe(time.perf_counter() - start, **labels)
+
+    http.request = instrumented_request
+
+
+async def _handle_scrape(registry, reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Discard the request headers
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b'\r\n', b'\n'):
+                break
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split('?')[0] in ("/", "/metrics"):
+            status = "200 OK"
+            body = registry.render().encode('utf-8')
+        else:
+            status = "404 Not Found"
+            body = b"Not found.\n"
+
+        writer.write(
+            (
+                "HTTP/1.1 {}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: close\r\n\r\n"
+            ).format(status, len(body)).encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=9100, registry=None):
+    """
+    Start a minimal HTTP server exposing the registry at `/metrics` for scraping.
+    Returns the `asyncio.Server`.
+    """
+    registry = registry or REGISTRY
+    return await asyncio.start_server(
+        lambda reader, writer: _handle_scrape(registry, reader, writer),
+        host=host,
+        port=port
+    )
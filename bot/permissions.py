@@ -0,0 +1,119 @@
+from collections import OrderedDict
+
+from metrics import Counter
+
+
+# Metrics
+permission_misses = Counter(
+    "ticketbot_permission_cache_misses_total",
+    "Member permissions computed because they were not in the permission cache."
+)
+
+
+class MemberPermissions(object):
+    """
+    The guild permissions and role ids of a member, as used by the command checks.
+    `tracked` records whether they were computed from the member object kept current by the client cache.
+    """
+    __slots__ = ("permissions", "role_ids", "tracked")
+
+    def __init__(self, member, role_ids, tracked):
+        self.permissions = member.guild_permissions
+        self.role_ids = role_ids
+        self.tracked = tracked
+
+    def has_role(self, roleid):
+        return roleid in self.role_ids
+
+
+class PermissionCache(object):
+    """
+    Caches the permissions of guild members, so that checks run on every command are simple lookups.
+
+    Entries are computed when first used, and dropped by the events which may change them:
+    a member's roles changing or the member leaving,
+    a role's permissions changing or the role being deleted, and the guild owner changing.
+    Since member updates aren't received for uncached members,
+    an entry looked up with any other member object than the one in the client cache
+    is checked against the roles of that object, and recomputed if they differ.
+    The least recently used members are evicted first.
+    The cache is available to commands and checks as `client.permissions`.
+
+    Parameters
+    ----------
+    client: discord.Client
+        The client to receive the invalidating events from.
+    maxsize: int
+        Maximum number of members cached in each guild.
+    """
+    def __init__(self, client, maxsize=10000):
+        self.client = client
+        self.maxsize = maxsize
+
+        self._guilds = {}  # guildid: OrderedDict({memberid: MemberPermissions}), least recently used first
+
+        self.setup_client()
+
+    def setup_client(self):
+        self.client.permissions = self
+        self.client.add_after_event("member_update", self.member_update_hook)
+        self.client.add_after_event("member_remove", self.member_remove_hook)
+        self.client.add_after_event("guild_role_update", self.role_update_hook)
+        self.client.add_after_event("guild_role_delete", self.role_delete_hook)
+        self.client.add_after_event("guild_update", self.guild_update_hook)
+
+    def get(self, member):
+        """
+        Retrieve the cached permissions of a guild member, computing them if needed.
+        Returns: `MemberPermissions`
+        """
+        members = self._guilds.get(member.guild.id, None)
+        if members is None:
+            members = self._guilds[member.guild.id] = OrderedDict()
+        # The cached member is updated in place, and its role changes invalidate the entry
+        tracked = member.guild.get_member(member.id) is member
+        perms = members.get(member.id, None)
+        role_ids = None
+        if perms is not None:
+            if tracked:
+                current = perms.tracked
+            else:
+                role_ids = frozenset(role.id for role in member.roles)
+                current = perms.role_ids == role_ids
+            if current:
+                members.move_to_end(member.id)
+                return perms
+
+        permission_misses.inc()
+        if perms is None and len(members) >= self.maxsize:
+            members.popitem(last=False)
+        if role_ids is None:
+            role_ids = frozenset(role.id for role in member.roles)
+        perms = members[member.id] = MemberPermissions(member, role_ids, tracked)
+        members.move_to_end(member.id)
+        return perms
+
+    def invalidate_member(self, guildid, memberid):
+        members = self._guilds.get(guildid, None)
+        if members is not None:
+            members.pop(memberid, None)
+
+    def invalidate_guild(self, guildid):
+        self._guilds.pop(guildid, None)
+
+    async def member_update_hook(self, client, before, after):
+        self.invalidate_member(after.guild.id, after.id)
+
+    async def member_remove_hook(self, client, member):
+        self.invalidate_member(member.guild.id, member.id)
+
+    async def role_update_hook(self, client, before, after):
+        if before.permissions != after.permissions:
+            self.invalidate_guild(after.guild.id)
+
+    async def role_delete_hook(self, client, role):
+        self.invalidate_guild(role.guild.id)
+
+    async def guild_update_hook(self, client, before, after):
+        if before.owner_id != after.owner_id:
+            self.invalidate_guild(after.id)
@@ -0,0 +1,118 @@
+import sys
+import time
+import builtins
+import importlib.util
+from contextlib import contextmanager
+
+from logger import log
+from metrics import Gauge
+
+
+# Metrics
+startup_phase_seconds = Gauge(
+    "ticketbot_startup_phase_seconds",
+    "Time taken by each phase of the last startup.",
+    labels=("phase",)
+)
+
+
+class StartupProfile(object):
+    """
+    Records where the time goes during startup.
+
+    Phases, such as loading the commands or each step of `TicketInterface.launch`, are always timed,
+    and exported as a metric.
+    When enabled, the first import of every module is timed as well,
+    and a report of the slowest imports and of the phases is logged by `report`.
+    Import times exclude the nested imports of other modules, as with `python -X importtime`.
+    """
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.enabled = False
+        self.phases = []  # (phase, seconds), in order
+        self.imports = {}  # module name: seconds spent importing it, excluding nested imports
+
+        self._import = None
+        self._nested = []  # Time spent in nested imports, for each import in progress
+
+    def enable(self):
+        """
+        Start timing imports.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def disable(self):
+        if self.enabled:
+            builtins.__import__ = self._import
+            self.enabled = False
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level:
+            package = globals.get('__package__', None) if globals else None
+            try:
+                fullname = importlib.util.resolve_name('.' * level + name, package)
+            except (ImportError, ValueError):
+                fullname = name
+        else:
+            fullname = name
+        if fullname in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+        with self.timed_import(fullname):
+            return self._import(name, globals, locals, fromlist, level)
+
+    @contextmanager
+    def timed_import(self, name):
+        """
+        Time the import of a module, excluding the nested imports of other modules.
+        Also used for modules which aren't loaded through the import statement.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        self._nested.append(0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            self.imports[name] = self.imports.get(name, 0) + elapsed - nested
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase of the startup.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases.append((name, elapsed))
+            startup_phase_seconds.set(elapsed, phase=name)
+
+    def report(self, limit=25):
+        """
+        Log the startup phases, and the slowest imports if enabled.
+        Import timing stops once the report is made.
+        """
+        lines = ["Started in {:.3f}s.".format(time.perf_counter() - self.started_at), "Phases:"]
+        lines.extend("  {:<24} {:>9.3f}s".format(name, seconds) for name, seconds in self.phases)
+        if self.enabled:
+            slowest = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)[:limit]
+            lines.append("Slowest of {} imports, totalling {:.3f}s:".format(
+                len(self.imports), sum(self.imports.values())
+            ))
+            lines.extend("  {:<48} {:>9.3f}s".format(name, seconds) for name, seconds in slowest)
+            self.disable()
+        log("\n".join(lines), context="STARTUP_PROFILE")
+
+
+# Profile of this process
+startup = StartupProfile()
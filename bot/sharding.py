@@ -0,0 +1,34 @@
+"""
+Helpers for running the bot over several gateway shards.
+
+Discord assigns each guild to the shard `(guild_id >> 22) % shard_count`.
+A process may run every shard (auto-sharded), or only a range of them,
+in which case the `TicketInterface` only loads the guilds on its own shards.
+"""
+
+
+def shard_for_guild(guildid, shard_count):
+    """
+    Return the shard id that events for the given guild are received on.
+    """
+    return (guildid >> 22) % shard_count
+
+
+def parse_shard_ids(spec):
+    """
+    Parse a shard id specification such as `0-3, 8, 10-11` into a sorted list of shard ids.
+    Returns `None` if the specification is empty.
+    """
+    if not spec or not spec.strip():
+        return None
+    shard_ids = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = (int(bound) for bound in part.split('-', 1))
+            if end < start:
+                raise ValueError("Invalid shard range `{}`.".format(part))
+            shard_ids.update(range(start, end + 1))
+        else:
+            shard_ids.add(int(part))
+    return sorted(shard_ids)
@@ -0,0 +1,145 @@
+import io
+import os
+import csv
+import gzip
+import json
+
+
+# Tables which can be exported, with the query reading a guild's rows in order
+EXPORT_QUERIES = {
+    'tickets': "SELECT * FROM TicketView WHERE guild_id = %s ORDER BY guild_ticket_id",
+    'history': "SELECT * FROM TicketHistory WHERE guild_id = %s ORDER BY guild_ticket_id, modified_at",
+}
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+class _PartWriter(object):
+    """
+    Writes text lines through gzip into numbered files,
+    starting a new file whenever the compressed size approaches `max_size`.
+    The compressor is flushed after each chunk, so the file size is exact,
+    and the size of the next chunk is estimated from the compression ratio measured so far.
+    """
+    def __init__(self, directory, name, extension, max_size, header=None):
+        self.directory = directory
+        self.name = name
+        self.extension = extension
+        self.max_size = max_size
+        self.header = header
+
+        self.paths = []
+        self._raw = None
+        self._file = None
+        self._empty = True  # Whether the current part holds no chunks yet
+        self._text_bytes = 0  # Uncompressed size of the chunks written so far
+        self._gzip_bytes = 0  # Compressed size of the chunks written so far
+
+    def _open(self):
+        path = os.path.join(
+            self.directory,
+            "{}-{}.{}.gz".format(self.name, len(self.paths) + 1, self.extension)
+        )
+        self.paths.append(path)
+        self._raw = open(path, 'wb')
+        self._file = gzip.GzipFile(filename="", mode='wb', fileobj=self._raw)
+        self._empty = True
+        if self.header:
+            self._file.write(self.header.encode())
+
+    def write(self, text):
+        """
+        Write a chunk of lines, starting a new part first if the chunk would not fit in the current one.
+        """
+        data = text.encode()
+        if self._file is None:
+            self._open()
+        elif not self._empty:
+            # Until anything has been measured, assume the chunk doesn't compress
+            ratio = self._gzip_bytes / self._text_bytes if self._text_bytes else 1
+            if self._raw.tell() + len(data) * ratio > self.max_size:
+                self.close()
+                self._open()
+        start = self._raw.tell()
+        self._file.write(data)
+        # Flush the compressor, so that the file size is up to date
+        self._file.flush()
+        self._empty = False
+        self._text_bytes += len(data)
+        self._gzip_bytes += self._raw.tell() - start
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+
+def _csv_text(rows):
+    out = io.StringIO()
+    csv.writer(out).writerows(rows)
+    return out.getvalue()
+
+
+def export_guild(storage, guildid, directory, tables=('tickets', ), fmt='csv',
+                 max_size=8 * 1024 * 1024, chunk_size=1000, progress=None):
+    """
+    Export a guild's tickets into gzipped CSV or JSON-lines files.
+
+    The rows are streamed from a new connection to the database in chunks of `chunk_size`,
+    and written out as they are read, so memory use doesn't depend on the size of the guild.
+    Each table is split into parts of at most about `max_size` compressed bytes.
+    This blocks, and is meant to be run in a worker thread.
+
+    Parameters
+    ----------
+    storage: Storage
+        The storage to export from, cloned for use in the calling thread.
+    guildid: int
+        The guild to export.
+    directory: str
+        Directory to write the files to.
+    tables: Tuple(str)
+        Names of the tables to export, from `EXPORT_QUERIES`.
+    fmt: str
+        Either `csv` or `jsonl`.
+    max_size: int
+        Approximate maximum size of each file in bytes.
+    chunk_size: int
+        Number of rows read from the database at once.
+    progress: Callable(int) or None
+        Called with the total number of rows exported so far, after each chunk.
+
+    Returns: List of the paths of the written files, in order.
+    """
+    storage = storage.clone()
+    paths = []
+    exported = 0
+    try:
+        for table in tables:
+            writer = None
+            try:
+                for columns, rows in storage.stream(
+                        "export_{}".format(table), EXPORT_QUERIES[table], (guildid, ), chunk_size=chunk_size):
+                    if writer is None:
+                        writer = _PartWriter(
+                            directory, "{}-{}".format(table, guildid), fmt, max_size,
+                            header=_csv_text([columns]) if fmt == 'csv' else None
+                        )
+                    if fmt == 'csv':
+                        text = _csv_text(rows)
+                    else:
+                        text = "".join(
+                            json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+                        )
+                    writer.write(text)
+
+                    exported += len(rows)
+                    if progress is not None:
+                        progress(exported)
+            finally:
+                if writer is not None:
+                    writer.close()
+                    paths.extend(writer.paths)
+    finally:
+        storage.close()
+    return paths
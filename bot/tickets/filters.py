@@ -0,0 +1,92 @@
+class TicketFilter(object):
+    """
+    Selection of tickets from a guild, matching every given criterion.
+    Criteria left as `None` match every ticket.
+
+    Parameters
+    ----------
+    guild_id: int
+        The guild to select tickets from.
+    ticket_ranges: List(Tuple(int, int))
+        Ranges of ticket numbers, from first to last inclusive. Tickets in any of the ranges match.
+    moderator_id: int
+        Moderator the tickets are assigned to.
+    victim_id: int
+        User the tickets act on.
+    action_id: int
+        Action type of the tickets.
+    resolved: bool
+        Whether the tickets have been given a reason.
+    since: datetime.datetime
+        Earliest creation time of the tickets, as a naive UTC datetime.
+    """
+    __slots__ = (
+        "guild_id",
+        "ticket_ranges",
+        "moderator_id",
+        "victim_id",
+        "action_id",
+        "resolved",
+        "since"
+    )
+
+    def __init__(self, guild_id, ticket_ranges=None, moderator_id=None, victim_id=None,
+                 action_id=None, resolved=None, since=None):
+        self.guild_id = guild_id
+        self.ticket_ranges = ticket_ranges
+        self.moderator_id = moderator_id
+        self.victim_id = victim_id
+        self.action_id = action_id
+        self.resolved = resolved
+        self.since = since
+
+    @property
+    def empty(self):
+        """
+        Whether no criteria were given, so that every ticket in the guild matches.
+        """
+        return all(getattr(self, attr) is None for attr in self.__slots__ if attr != 'guild_id')
+
+    def matches(self, ticket):
+        """
+        Whether a loaded ticket satisfies the filter.
+        """
+        if ticket.guild_id != self.guild_id:
+            return False
+        if self.ticket_ranges is not None and not any(
+                first <= ticket.guild_ticket_id <= last for first, last in self.ticket_ranges):
+            return False
+        if self.moderator_id is not None and ticket.moderator_id != self.moderator_id:
+            return False
+        if self.victim_id is not None and ticket.victim_id != self.victim_id:
+            return False
+        if self.action_id is not None and ticket.action_id != self.action_id:
+            return False
+        if self.resolved is not None and bool(ticket.resolved) != self.resolved:
+            return False
+        if self.since is not None and ticket.created_at < self.since:
+            return False
+        return True
+
+    def updated(self, ticket_data):
+        """
+        The filter matching the selected tickets once they are updated with `ticket_data`.
+        It also matches any tickets which already had the new values.
+        """
+        tfilter = TicketFilter(*(getattr(self, attr) for attr in self.__slots__))
+        for attr in ('moderator_id', 'victim_id', 'action_id'):
+            if attr in ticket_data:
+                setattr(tfilter, attr, ticket_data[attr])
+        if 'resolved' in ticket_data:
+            tfilter.resolved = bool(ticket_data['resolved'])
+        return tfilter
+
+    @property
+    def max_ticket(self):
+        """
+        The largest ticket number explicitly selected, or `None` if tickets are not selected by number.
+        """
+        if not self.ticket_ranges:
+            return None
+        return max(last for _, last in self.ticket_ranges)
+
@@ -1,12 +1,71 @@
+import time
 import datetime
 import asyncio
 import bisect
+import heapq
+import logging
+import traceback
 from enum import IntEnum
 
-import mysql.connector
 import discord
 
+from logger import log
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from profiling import startup
+
 from .ticket import Ticket
+from .users import UserResolver
+from .scheduler import UndoScheduler
+from .outbox import ModlogPublisher
+
+
+# Metrics
+hook_latency = Histogram(
+    "ticketbot_event_hook_seconds",
+    "Time spent handling client events in the ticket interface, by event.",
+    labels=("event",)
+)
+audit_lag = Gauge(
+    "ticketbot_audit_lag_seconds",
+    "Largest delay between an audit log entry being created and being read, in the last read of each guild.",
+    labels=("guild",)
+)
+audit_entries = Counter(
+    "ticketbot_audit_entries_total",
+    "Audit log entries handled by the audit log reader, by action.",
+    labels=("action",)
+)
+catchup_remaining = Gauge(
+    "ticketbot_audit_catchup_remaining",
+    "Number of guilds still waiting for their startup audit log catch-up."
+)
+member_updates = Counter(
+    "ticketbot_member_updates_total",
+    "Member update events seen by the ticket interface, by how they were handled.",
+    labels=("result",)
+)
+mod_queue_depth = Gauge(
+    "ticketbot_mod_queue_depth",
+    "Number of unresolved tickets in each moderator queue.",
+    labels=("moderator",)
+)
+
+
+# Audit log actions which may create tickets
+AUDIT_ACTIONS = (
+    discord.AuditLogAction.ban,
+    discord.AuditLogAction.unban,
+    discord.AuditLogAction.kick,
+    discord.AuditLogAction.member_role_update
+)
+# Ticket action type name: audit log action which creates it
+TICKET_AUDIT_ACTIONS = {
+    'BAN': discord.AuditLogAction.ban,
+    'UNBAN': discord.AuditLogAction.unban,
+    'KICK': discord.AuditLogAction.kick,
+    'ROLE_ADD': discord.AuditLogAction.member_role_update,
+    'ROLE_RM': discord.AuditLogAction.member_role_update
+}
 
 
 class TicketGuild(object):
@@ -15,9 +74,11 @@ class TicketGuild(object):
         "staffrole_id",
         "modlog_id",
         "active_roles",
+        "role_durations",
         "ticket_count",
         "last_checked",
-        "last_audit_entry",
+        "audit_start",
+        "audit_watermarks",
         "auditevents_handled",
         "auditreader_lock"
     )
@@ -29,34 +90,87 @@ class TicketGuild(object):
         self.ticket_count = ticket_count
         self.last_checked = last_checked
 
-        self.active_roles = set()
+        self.active_roles = frozenset()  # Replaced rather than modified, so it may be shared safely
+        self.role_durations = {}  # roleid: default duration in seconds, for active roles with one
 
-        self.last_audit_entry = 0
+        self.audit_start = discord.utils.time_snowflake(last_checked)  # Entries before this are ignored
+        self.audit_watermarks = {}  # AuditLogAction: id of the last entry read with this action
         self.auditevents_handled = set()
         self.auditreader_lock = asyncio.Lock()
 
 
 class TicketMod(object):
+    """
+    Queue of unresolved tickets assigned to a moderator.
+    Tickets are kept in creation order, both in the merged `ticket_queue`,
+    and in a sub-queue for each guild in `guild_queues`.
+    """
     __slots__ = (
         "user",
         "ticket_queue",
+        "guild_queues",
         "last_reminder"
     )
 
     def __init__(self, user):
         self.user = user
         self.ticket_queue = []
+        self.guild_queues = {}  # guildid: ticket queue for that guild
         self.last_reminder = 0
 
+    @staticmethod
+    def _remove(queue, ticket):
+        """
+        Remove a ticket from an ordered queue, if present.
+        Returns whether the ticket was found.
+        """
+        i = bisect.bisect_left(queue, ticket)
+        while i < len(queue) and not ticket < queue[i]:
+            if queue[i] == ticket:
+                del queue[i]
+                return True
+            i += 1
+        return False
+
     def insert_ticket(self, ticket):
         bisect.insort(self.ticket_queue, ticket)
+        bisect.insort(self.guild_queues.setdefault(ticket.guild_id, []), ticket)
         return self  # For chaining
 
     def remove_ticket(self, ticket):
-        try:
-            self.ticket_queue.remove(ticket)
-        except ValueError:
-            pass
+        if self._remove(self.ticket_queue, ticket):
+            guild_queue = self.guild_queues[ticket.guild_id]
+            self._remove(guild_queue, ticket)
+            if not guild_queue:
+                del self.guild_queues[ticket.guild_id]
+
+    def has_ticket(self, ticket):
+        queue = self.guild_queues.get(ticket.guild_id, [])
+        i = bisect.bisect_left(queue, ticket)
+        while i < len(queue) and not ticket < queue[i]:
+            if queue[i] == ticket:
+                return True
+            i += 1
+        return False
+
+    def get_queue(self, guildid=None):
+        """
+        Returns: The queue of tickets from the given guild, or the merged queue if no guild is given.
+        The returned queue should not be modified.
+        """
+        if guildid is None:
+            return self.ticket_queue
+        return self.guild_queues.get(guildid, [])
+
+    def count(self, guildid=None):
+        return len(self.get_queue(guildid))
+
+    def newest(self, guildid=None):
+        """
+        Returns: The most recently created ticket in the queue, or `None` if the queue is empty.
+        """
+        queue = self.get_queue(guildid)
+        return queue[-1] if queue else None
 
     def touch(self):
         self.last_reminder = datetime.datetime.utcnow().timestamp()
@@ -72,27 +186,78 @@ class TicketMod(object):
 
 
 class TicketInterface(object):
-    def __init__(self, client, dbopts):
+    def __init__(self, client, storage, catchup_concurrency=4, shard_count=None, shard_ids=None, users=None):
         self.client = client
+        self.storage = storage  # Storage backend, see `tickets.storage`
+        self.users = users or UserResolver(client)  # Resolves moderators and victims, see `tickets.users`
+        self.catchup_concurrency = catchup_concurrency  # Maximum number of guilds read at once in catch-up
+
+        self.shard_count = shard_count  # Total number of gateway shards, or `None` if not sharded
+        self.shard_ids = shard_ids  # Shards handled by this process, or `None` for all of them
 
         self.ActionTypes = None  # Enum of moderator action types, set in `load_types`
         self.actionmap = {}  # action_id: action_name, set in `load_types`
 
         self.guilds = {}  # guildid: TicketGuild
         self.mods = {}  # modid: TicketMod
+        self.reload_mods = False  # Set when a moderator couldn't be fetched, so `modloop` reloads the queues
+        self.scheduler = UndoScheduler(self)  # Runs the timed actions of tickets with an `undo_at`
+        self.outbox = ModlogPublisher(self)  # Posts and edits the modlog messages of new and modified tickets
 
-        self.conn = mysql.connector.connect(**dbopts)
+        self.expected_role_changes = {}  # (guildid, userid): expiry time of a role change made by the bot
+        self.deferred_reads = set()  # guildids with a deferred read of role updates scheduled
+        self.catchup_pending = {}  # guildid: set of audit actions waiting for catch-up
+        self.live_reads = 0  # Number of audit log reads triggered by live events in progress
+        self.live_idle = asyncio.Event()  # Set when no live audit log reads are in progress
+        self.live_idle.set()
 
         self.ready = False
         self.setup_client()
 
+        REGISTRY.add_collector(self.collect_metrics)
+
     def setup_client(self):
         self.client.tickets = self
         self.client.add_after_event("ready", self.launch)
-        self.client.add_after_event("member_update", self.member_update_hook)
-        self.client.add_after_event("member_ban", self.ban_unban_hook)
-        self.client.add_after_event("member_unban", self.ban_unban_hook)
-        self.client.add_after_event("member_remove", self.kick_hook)
+        self.client.add_after_event("member_update", self._timed_hook("member_update", self.member_update_hook))
+        self.client.add_after_event("member_ban", self._timed_hook("member_ban", self.ban_hook))
+        self.client.add_after_event("member_unban", self._timed_hook("member_unban", self.unban_hook))
+        self.client.add_after_event("member_remove", self._timed_hook("member_remove", self.kick_hook))
+
+    @staticmethod
+    def _timed_hook(event, hook):
+        """
+        Wrap an event hook to record its latency.
+        """
+        async def timed_hook(*args, **kwargs):
+            with hook_latency.time(event=event):
+                await hook(*args, **kwargs)
+        return timed_hook
+
+    @property
+    def partial(self):
+        """
+        Whether this process only handles some of the shards,
+        so that guild state and moderator queues are shared with other processes.
+        """
+        return self.shard_ids is not None
+
+    @property
+    def receives_dms(self):
+        """
+        Whether this process receives direct messages, which Discord only delivers on shard 0.
+        Moderator queues are kept, and reason prompts sent, by this process only,
+        since the replies to the prompts are direct messages.
+        """
+        return not self.partial or 0 in self.shard_ids
+
+    def collect_metrics(self):
+        """
+        Update the metrics which are computed at scrape time.
+        """
+        mod_queue_depth.clear()
+        for modid, tmod in self.mods.items():
+            mod_queue_depth.set(len(tmod.ticket_queue), moderator=modid)
 
     async def launch(self, client):
         # Quit if we have already launched
@@ -100,84 +265,187 @@ class TicketInterface(object):
             return
 
         # Load guilds and active roles
-        self.load_types()
-        self.load_guilds()
-        self.load_mods()
+        with startup.phase("load_types"):
+            self.load_types()
+        with startup.phase("load_guilds"):
+            self.load_guilds()
+        with startup.phase("load_mods"):
+            await self.load_mods()
 
         self.ready = True
 
-        await self.audit_catchup()
-        asyncio.ensure_future(self.modloop())
+        asyncio.ensure_future(self.outbox.run())
+        asyncio.ensure_future(self.scheduler.run())
+        with startup.phase("audit_catchup"):
+            await self.audit_catchup()
+        if self.receives_dms:
+            asyncio.ensure_future(self.modloop())
+        startup.report()
 
     def load_types(self):
-        with self.conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT action_name, action_id from ActionTypes"
-            )
-            action_tuples = [tuple(action_pair) for action_pair in cursor.fetchall()]
-            self.ActionTypes = IntEnum("ActionTypes", action_tuples)
-            self.action_map = {action_pair[1]: action_pair[0] for action_pair in action_tuples}
+        action_tuples = self.storage.reader().load_action_types()
+        self.ActionTypes = IntEnum("ActionTypes", action_tuples)
+        self.action_map = {action_pair[1]: action_pair[0] for action_pair in action_tuples}
 
     def load_guilds(self):
         """
         Read and cache guild data from DB.
         """
-        with self.conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM GuildView")
-            for guilddata in cursor.fetchall():
-                guild_id, staffrole_id, modlog_id, role_id, ticket_count = guilddata[:5]
-                created_at, last_checked, last_audit_entry = guilddata[5:]
-                print(guild_id, staffrole_id, modlog_id, role_id, ticket_count or 0, last_checked, last_audit_entry)
-                if guild_id not in self.guilds:
-                    tguild = TicketGuild(
-                        guild_id,
-                        staffrole_id,
-                        modlog_id,
-                        ticket_count or 0,
-                        last_checked or created_at
-                    )
-                    tguild.last_audit_entry = last_audit_entry or 0
-                    self.guilds[guild_id] = tguild
-                if role_id:
-                    self.guilds[guild_id].active_roles.add(role_id)
-
-    def load_mods(self):
+        for guilddata in self.storage.load_guilds(self.shard_count, self.shard_ids):
+            guild_id = guilddata['guild_id']
+            role_id = guilddata['role_id']
+            last_checked = guilddata['last_ticket_created']
+            log(
+                "Loaded guild data.",
+                context="LOAD_GUILDS",
+                level=logging.DEBUG,
+                guild_id=guild_id,
+                role_id=role_id,
+                ticket_count=guilddata['ticket_count'] or 0,
+                last_checked=last_checked
+            )
+            if guild_id not in self.guilds:
+                tguild = TicketGuild(
+                    guild_id,
+                    guilddata['staffrole_id'],
+                    guilddata['modlog_id'],
+                    guilddata['ticket_count'] or 0,
+                    last_checked or guilddata['utc_created_at']
+                )
+                tguild.audit_start = discord.utils.time_snowflake(guilddata['utc_created_at'])
+                self.guilds[guild_id] = tguild
+            if role_id:
+                self.guilds[guild_id].active_roles |= {role_id}
+
+        for guild_id, role_id, duration in self.storage.load_role_durations(self.shard_count, self.shard_ids):
+            if guild_id in self.guilds:
+                self.guilds[guild_id].role_durations[role_id] = duration
+
+        # Each audit log action is read from the last entry which created a ticket with that action
+        for guild_id, action_id, auditlog_id in self.storage.load_audit_watermarks(self.shard_count, self.shard_ids):
+            action = TICKET_AUDIT_ACTIONS.get(self.action_map.get(action_id, None), None)
+            if guild_id in self.guilds and action is not None:
+                watermarks = self.guilds[guild_id].audit_watermarks
+                watermarks[action] = max(watermarks.get(action, 0), auditlog_id)
+
+    async def load_mods(self):
         """
         Read and cache unresolved tickets from DB.
+        The queues span every guild, including the ones handled by other processes, see `receives_dms`.
+        May be called again to resynchronise the queues with the tickets created or resolved by other processes.
+        Moderators who can't be fetched for now keep their current queue, or are retried at the next reload.
         """
+        if not self.receives_dms:
+            return
+        self.reload_mods = False
+        tickets = Ticket.from_rows(self, *self.storage.load_unresolved_tickets())
+        users = await self.users.fetch_many((ticket.moderator_id for ticket in tickets), return_errors=True)
+        for modid, user in users.items():
+            if isinstance(user, discord.HTTPException):
+                if modid in self.mods:
+                    users[modid] = self.mods[modid].user
+                else:
+                    users[modid] = None
+                    self.reload_mods = True
+
         mods = {}
-        dud_moderators = set()
-        with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(
-                "SELECT * FROM TicketView WHERE resolved = FALSE ORDER BY created_at"
-            )
-            for ticketdata in cursor.fetchall():
-                ticket = Ticket(self, **ticketdata)
-                if ticket.moderator_id in mods:
-                    mods[ticket.moderator_id].insert_ticket(ticket)
-                elif ticket.moderator_id in dud_moderators:
+        for ticket in tickets:
+            if ticket.moderator_id in mods:
+                mods[ticket.moderator_id].insert_ticket(ticket)
+            else:
+                user = users[ticket.moderator_id]
+                if user is None or user.bot:
+                    # The user doesn't exist, no point making a queue for them, or
+                    # The user is a bot, they can't handle queues anyway.
                     continue
                 else:
-                    user = self.client.get_user(ticket.moderator_id)
-                    if user is None or user.bot:
-                        # The client can't see this user, no point making a queue for them, or
-                        # The user is a bot, they can't handle queues anyway.
-                        dud_moderators.add(ticket.moderator_id)
-                        continue
-                    else:
-                        mods[ticket.moderator_id] = TicketMod(user).insert_ticket(ticket)
+                    mods[ticket.moderator_id] = TicketMod(user).insert_ticket(ticket)
+        # Keep the reminder times of existing queues
+        for modid, tmod in mods.items():
+            if modid in self.mods:
+                tmod.last_reminder = self.mods[modid].last_reminder
         self.mods = mods
 
+    def get_mod_queue(self, user):
+        """
+        Retrieve the queue of unresolved tickets for the given moderator.
+        When this process only handles some of the shards, the queue is read from the registry,
+        so that it includes the tickets from guilds handled by other processes.
+        Returns: TicketMod or `None` if the moderator has no queue.
+        """
+        if not self.partial:
+            return self.mods.get(user.id, None)
+
+        tmod = TicketMod(user)
+        for ticket in Ticket.from_rows(self, *self.storage.get_moderator_tickets(user.id)):
+            tmod.insert_ticket(ticket)
+        return tmod
+
+    def get_modlog_id(self, guildid):
+        """
+        Retrieve the modlog channel id for the given guild,
+        reading it from the registry if the guild is handled by another process.
+        """
+        if guildid in self.guilds:
+            return self.guilds[guildid].modlog_id
+        guilddata = self.storage.get_guild(guildid)
+        return guilddata['modlog_id'] if guilddata else None
+
     async def audit_catchup(self):
-        guilds = []
-        for guildid in self.guilds:
-            guild = self.client.get_guild(guildid)
-            if guild is not None:
-                guilds.append(guild)
-        await asyncio.gather(*(self.check_audit_log(guild) for guild in guilds))
+        """
+        Read the audit log entries missed while offline.
+        Guilds are processed stalest first, by a pool of `catchup_concurrency` workers.
+        Live audit log reads take priority, the workers wait for them to finish before starting another guild.
+        Actions already read live are not read again.
+        """
+        backlog = sorted(
+            ((tguild.last_checked, guildid) for guildid, tguild in self.guilds.items()
+             if self.client.get_guild(guildid) is not None),
+            reverse=True
+        )  # Stalest guild last, to be popped first
+        self.catchup_pending = {guildid: set(AUDIT_ACTIONS) for _, guildid in backlog}
+        total = len(backlog)
+        done = 0
+        report_every = max(1, total // 10)
+        catchup_remaining.set(total)
+        log("Starting audit log catch-up for {} guilds.".format(total), context="AUDIT_CATCHUP")
+
+        async def worker():
+            nonlocal done
+            while backlog:
+                await self.live_idle.wait()
+                if not backlog:
+                    break
+                _, guildid = backlog.pop()
+                pending = self.catchup_pending.get(guildid, None)
+                if pending:
+                    # Otherwise live events have already read every action of this guild
+                    guild = self.client.get_guild(guildid)
+                    if guild is not None:
+                        try:
+                            await self.check_audit_log(guild, tuple(a for a in AUDIT_ACTIONS if a in pending))
+                        except Exception:
+                            log(
+                                "Audit log catch-up failed.\n{}".format(traceback.format_exc()),
+                                context="AUDIT_CATCHUP",
+                                level=logging.ERROR,
+                                guild_id=guildid
+                            )
+                # The guild stays pending until it has been read, see `undo_ticket`
+                self.catchup_pending.pop(guildid, None)
+                done += 1
+                catchup_remaining.set(total - done)
+                if done % report_every == 0 or done == total:
+                    log("Audit log catch-up progress: {}/{} guilds.".format(done, total), context="AUDIT_CATCHUP")
+
+        await asyncio.gather(*(worker() for _ in range(min(self.catchup_concurrency, total))))
 
     async def modloop(self):
         while True:
+            if self.partial or self.reload_mods:
+                # Pick up tickets created, resolved or reassigned through other processes,
+                # or the queues of moderators who couldn't be fetched
+                await self.load_mods()
             now = datetime.datetime.utcnow().timestamp()
             for mod in self.mods.values():
                 if now - mod.last_reminder > 60 * 1 and len(mod.ticket_queue) > 0:
@@ -188,10 +456,15 @@ class TicketInterface(object):
     async def prompt_mod(self, tmod, ticket=None):
         """
         Message the moderator and request they submit a reason for an unresolved ticket in their queue.
+        Only used in the process receiving direct messages, see `receives_dms`.
         """
         tmod.touch()
         if not ticket:
-            ticket = tmod.ticket_queue[-1]
+            ticket = tmod.newest()
+            if ticket is None:
+                # The queue was emptied in the meantime
+                return
+        await self.users.fetch(ticket.victim_id)
 
         # Send the message to the user
         try:
@@ -213,6 +486,7 @@ class TicketInterface(object):
             )
         except asyncio.TimeoutError:
             await out_msg.edit(content="Timed out waiting for a reason.")
+            return
         content = reply.content
         if content.lower() == 'c':
             # User cancelled
@@ -227,11 +501,26 @@ class TicketInterface(object):
     async def queue_ticket(self, ticket):
         """
         Adds the ticket to the appropriate moderator queue.
+        Processes which don't receive direct messages keep no queues,
+        their tickets are picked up when the process receiving them next reloads its queues.
+        """
+        if not self.receives_dms:
+            return
+        await self.queue_tickets(ticket.moderator_id, (ticket, ))
+
+    async def queue_tickets(self, moderator_id, tickets):
+        """
+        Adds several tickets to the queue of a moderator, notifying them once.
+        Tickets already in the queue are skipped.
         """
-        if ticket.moderator_id in self.mods:
-            mod = self.mods[ticket.moderator_id]
-            mod.insert_ticket(ticket)
-            if len(mod.ticket_queue) == 1:
+        if moderator_id in self.mods:
+            mod = self.mods[moderator_id]
+            tickets = [ticket for ticket in tickets if not mod.has_ticket(ticket)]
+            if not tickets:
+                return
+            for ticket in tickets:
+                mod.insert_ticket(ticket)
+            if len(mod.ticket_queue) == len(tickets):
                 asyncio.ensure_future(self.prompt_mod(mod))
             elif mod.last_reminder + 60 * 5 < datetime.datetime.utcnow().timestamp():
                 mod.touch()
@@ -239,26 +528,130 @@ class TicketInterface(object):
                     mod.user.send("{}, you have a new ticket in your queue!".format(mod.user.mention))
                 )
         else:
-            user = self.client.get_user(ticket.moderator_id)
-            if user is not None and not user.bot:
-                self.mods[ticket.moderator_id] = TicketMod(user).insert_ticket(ticket)
-                asyncio.ensure_future(self.prompt_mod(self.mods[ticket.moderator_id]))
+            try:
+                user = await self.users.fetch(moderator_id, raise_errors=True)
+            except discord.HTTPException:
+                # The tickets stay unresolved in the registry, and are queued at the next reload
+                self.reload_mods = True
+                return
+            if moderator_id in self.mods:
+                # The queue was created while fetching the moderator
+                await self.queue_tickets(moderator_id, tickets)
+            elif user is not None and not user.bot:
+                mod = self.mods[moderator_id] = TicketMod(user)
+                for ticket in tickets:
+                    mod.insert_ticket(ticket)
+                asyncio.ensure_future(self.prompt_mod(mod))
+
+    def expect_role_change(self, guildid, userid, timeout=60):
+        """
+        Note that the bot is about to change the roles of a member,
+        so that the resulting member update doesn't trigger an immediate audit log read.
+        Expectations are kept in insertion order, and the expired ones at the front are dropped.
+        """
+        now = time.time()
+        key = (guildid, userid)
+        self.expected_role_changes.pop(key, None)
+        self.expected_role_changes[key] = now + timeout
+        while self.expected_role_changes:
+            oldkey = next(iter(self.expected_role_changes))
+            if self.expected_role_changes[oldkey] > now:
+                break
+            del self.expected_role_changes[oldkey]
+
+    async def deferred_audit_read(self, guild, when):
+        """
+        Read the role updates of a guild at the time `when`,
+        picking up the audit entries of the role changes made by the bot until then.
+        Only one read is scheduled per guild at a time.
+        """
+        if guild.id in self.deferred_reads:
+            return
+        self.deferred_reads.add(guild.id)
+        try:
+            await asyncio.sleep(max(0, when - time.time()))
+        finally:
+            self.deferred_reads.discard(guild.id)
+        try:
+            await self.live_audit_read(guild, (discord.AuditLogAction.member_role_update, ))
+        except Exception:
+            log(
+                "Deferred audit log read failed.\n{}".format(traceback.format_exc()),
+                context="MEMBER_UPDATE",
+                level=logging.ERROR,
+                guild_id=guild.id
+            )
 
     async def member_update_hook(self, client, before, after):
-        if before.guild.id in self.guilds and before.roles != after.roles:
-            roles_changed = [role for role in after.roles if role not in before.roles]
-            roles_changed.extend([role for role in before.roles if role not in after.roles])
+        tguild = self.guilds.get(after.guild.id, None)
+        if tguild is None:
+            member_updates.inc(result="unregistered")
+            return
+
+        before_roles = {role.id for role in before.roles}
+        after_roles = {role.id for role in after.roles}
+        if before_roles == after_roles:
+            # Nickname, status or other non-role update
+            member_updates.inc(result="no_role_change")
+            return
+        if (before_roles ^ after_roles).isdisjoint(tguild.active_roles):
+            member_updates.inc(result="untracked_role")
+            return
+
+        expiry = self.expected_role_changes.pop((after.guild.id, after.id), None)
+        if expiry is not None and expiry > time.time():
+            # The bot made this change, its audit entry is read once the expectation window has passed
+            member_updates.inc(result="own_change")
+            asyncio.ensure_future(self.deferred_audit_read(after.guild, expiry))
+            return
+
+        member_updates.inc(result="audit_read")
+        await self.live_audit_read(after.guild, (discord.AuditLogAction.member_role_update, ))
 
-            if any(role.id in self.guilds[after.guild.id].active_roles for role in roles_changed):
-                await self.check_audit_log(after.guild)
+    async def ban_hook(self, client, guild, user):
+        await self.live_audit_read(guild, (discord.AuditLogAction.ban, ))
 
-    async def ban_unban_hook(self, client, guild, user):
-        await self.check_audit_log(guild)
+    async def unban_hook(self, client, guild, user):
+        await self.live_audit_read(guild, (discord.AuditLogAction.unban, ))
 
     async def kick_hook(self, client, member):
-        await self.check_audit_log(member.guild)
+        await self.live_audit_read(member.guild, (discord.AuditLogAction.kick, ))
 
-    async def check_audit_log(self, guild):
+    async def live_audit_read(self, guild, actions=AUDIT_ACTIONS):
+        """
+        Read the audit log in response to a live event, for the given actions.
+        Pauses the catch-up workers while running.
+        The actions read are caught up, so they are removed from the guild's pending catch-up.
+        """
+        pending = self.catchup_pending.get(guild.id, None)
+        if pending is not None:
+            pending.difference_update(actions)
+            if not pending:
+                del self.catchup_pending[guild.id]
+        self.live_reads += 1
+        self.live_idle.clear()
+        try:
+            await self.check_audit_log(guild, actions)
+        finally:
+            self.live_reads -= 1
+            if not self.live_reads:
+                self.live_idle.set()
+
+    async def fetch_audit_entries(self, guild, tguild, action):
+        """
+        Fetch the audit log entries with the given action after its watermark, oldest first.
+        """
+        watermark = tguild.audit_watermarks.get(action, tguild.audit_start)
+        return [
+            entry async for entry in guild.audit_logs(limit=None, after=discord.Object(id=watermark), action=action)
+            if entry.id > watermark
+        ]
+
+    async def check_audit_log(self, guild, actions=AUDIT_ACTIONS):
+        """
+        Read the new audit log entries with the given actions, and create the corresponding tickets.
+        Each action is fetched separately after its own watermark, and the entries are handled in order.
+        """
         # Wait until we are ready
         while not self.ready:
             await asyncio.sleep(1)
@@ -268,29 +661,29 @@ class TicketInterface(object):
             return
         tguild = self.guilds[guild.id]
 
+        if not tguild.active_roles:
+            # Role updates can't create tickets
+            actions = tuple(action for action in actions if action != discord.AuditLogAction.member_role_update)
+
         async with tguild.auditreader_lock:
-            # Set the new last_checked time to avoid concurrency issues
-            last_checked = tguild.last_checked
-            now = datetime.datetime.utcnow()
-            tguild.last_checked = now
-            # print("Last checked: {}".format(last_checked))
+            tguild.last_checked = datetime.datetime.utcnow()
+            max_lag = 0
+            drafts = []
 
-            async for entry in guild.audit_logs(limit=None, after=tguild.last_audit_entry or last_checked):
+            fetched = await asyncio.gather(*(self.fetch_audit_entries(guild, tguild, action) for action in actions))
+            for entry in heapq.merge(*fetched, key=lambda entry: entry.id):
                 # Check if the event has already been handled
                 if entry.id in tguild.auditevents_handled:
                     continue
-                # Check if we already checked this entry
-                if entry.created_at <= last_checked or entry.id <= tguild.last_audit_entry:
-                    print("Skipping {} entry at: {}".format(entry.action, entry.created_at))
-                    continue
-                # print("Reading {} entry at: {}".format(entry.action, entry.created_at))
 
-                tguild.last_audit_entry = entry.id
+                tguild.audit_watermarks[entry.action] = max(tguild.audit_watermarks.get(entry.action, 0), entry.id)
+                max_lag = max(max_lag, (datetime.datetime.utcnow() - entry.created_at).total_seconds())
+                audit_entries.inc(action=entry.action.name)
 
                 if entry.action == discord.AuditLogAction.ban:
                     tguild.auditevents_handled.add(entry.id)
-                    # Create ban ticket
-                    await self.create_ticket(
+                    # Draft ban ticket
+                    drafts.append(self.draft_ticket(
                         guild.id,
                         self.ActionTypes.BAN,
                         entry.user.id,
@@ -299,11 +692,11 @@ class TicketInterface(object):
                         reason=entry.reason or None,
                         auditlog_id=entry.id,
                         created_at=entry.created_at,
-                    )
+                    ))
                 elif entry.action == discord.AuditLogAction.unban:
                     tguild.auditevents_handled.add(entry.id)
-                    # Create unban ticket
-                    await self.create_ticket(
+                    # Draft unban ticket
+                    drafts.append(self.draft_ticket(
                         guild.id,
                         self.ActionTypes.UNBAN,
                         entry.user.id,
@@ -312,11 +705,11 @@ class TicketInterface(object):
                         reason=entry.reason or None,
                         auditlog_id=entry.id,
                         created_at=entry.created_at,
-                    )
+                    ))
                 elif entry.action == discord.AuditLogAction.kick:
                     tguild.auditevents_handled.add(entry.id)
-                    # Create kick ticket
-                    await self.create_ticket(
+                    # Draft kick ticket
+                    drafts.append(self.draft_ticket(
                         guild.id,
                         self.ActionTypes.KICK,
                         entry.user.id,
@@ -325,17 +718,17 @@ class TicketInterface(object):
                         reason=entry.reason or None,
                         auditlog_id=entry.id,
                         created_at=entry.created_at,
-                    )
+                    ))
                 elif entry.action == discord.AuditLogAction.member_role_update:
                     tguild.auditevents_handled.add(entry.id)
                     # Check for active role changes
                     roles_added = [role for role in entry.after.roles if role not in entry.before.roles]
                     roles_removed = [role for role in entry.before.roles if role not in entry.after.roles]
 
-                    # If there are any, create a ROLE_ADD or ROLE_RM ticket
+                    # If there are any, draft a ROLE_ADD or ROLE_RM ticket
                     for role in roles_added:
                         if role.id in tguild.active_roles:
-                            await self.create_ticket(
+                            drafts.append(self.draft_ticket(
                                 guild.id,
                                 self.ActionTypes.ROLE_ADD,
                                 entry.user.id,
@@ -345,11 +738,11 @@ class TicketInterface(object):
                                 reason=entry.reason or None,
                                 auditlog_id=entry.id,
                                 created_at=entry.created_at,
-                            )
+                            ))
 
                     for role in roles_removed:
                         if role.id in tguild.active_roles:
-                            await self.create_ticket(
+                            drafts.append(self.draft_ticket(
                                 guild.id,
                                 self.ActionTypes.ROLE_RM,
                                 entry.user.id,
@@ -359,20 +752,22 @@ class TicketInterface(object):
                                 reason=entry.reason or None,
                                 auditlog_id=entry.id,
                                 created_at=entry.created_at,
-                            )
+                            ))
+
+            audit_lag.set(max_lag, guild=guild.id)
 
-    def register_guild(self, guild_id, staffrole_id, modlog_id):
+            # Number and register the whole batch while the lock is held, so the ticket order matches the audit log
+            tickets = await self.insert_tickets(guild.id, drafts)
+
+        # The tickets are queued after the lock is released
+        await self.publish_tickets(tickets)
+
+    async def register_guild(self, guild_id, staffrole_id, modlog_id):
         """
         Register a new guild or update the details for an existing one.
         """
         # Add guild to db
-        with self.conn.cursor() as cursor:
-            cursor.execute(
-                ("INSERT INTO Guilds (guild_id, staffrole_id, modlog_id) VALUES (%s, %s, %s) "
-                 "ON DUPLICATE KEY UPDATE staffrole_id = %s, modlog_id = %s"),
-                (guild_id, staffrole_id, modlog_id, staffrole_id, modlog_id)
-            )
-            self.conn.commit()
+        await self.storage.upsert_guild(guild_id, staffrole_id, modlog_id)
         if guild_id in self.guilds:
             tguild = self.guilds[guild_id]
             tguild.staffrole_id = staffrole_id
@@ -381,95 +776,134 @@ class TicketInterface(object):
             tguild = TicketGuild(guild_id, staffrole_id, modlog_id, 0, datetime.datetime.utcnow())
             self.guilds[guild_id] = tguild
 
-    def create_active_role(self, guildid, roleid, add_action, rm_action):
+    async def create_active_role(self, guildid, roleid, add_action, rm_action, default_duration=None):
         """
         Create an active role, the addition or removal of which
         is treated as a moderation action.
+        If a `default_duration` in seconds is given, the role is automatically removed after this time.
         """
-        with self.conn.cursor() as cursor:
-            cursor.execute(
-                ("INSERT INTO ActiveRoles (guild_id, role_id, add_action_name, rm_action_name, active) "
-                 "VALUES (%s, %s, %s, %s, %s) "
-                 "ON DUPLICATE KEY UPDATE add_action_name = %s, rm_action_name = %s"),
-                (guildid, roleid, add_action, rm_action, True, add_action, rm_action)
-            )
-            self.conn.commit()
-        self.guilds[guildid].active_roles.add(roleid)
+        await self.storage.upsert_active_role(guildid, roleid, add_action, rm_action, default_duration)
+        tguild = self.guilds[guildid]
+        tguild.active_roles |= {roleid}
+        if default_duration:
+            tguild.role_durations[roleid] = default_duration
+        else:
+            tguild.role_durations.pop(roleid, None)
 
-    def deactivate_role(self, guildid, roleid):
+    async def deactivate_role(self, guildid, roleid):
         """
         Deactivate an active role, if it is currently active.
         """
         if roleid in self.guilds[guildid].active_roles:
-            with self.conn.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE ActiveRoles SET active = FALSE WHERE role_id = %s",
-                    (roleid, )
-                )
-                self.conn.commit()
-            self.guilds[guildid].active_roles.remove(roleid)
+            await self.storage.deactivate_role(roleid)
+            self.guilds[guildid].active_roles -= {roleid}
+            self.guilds[guildid].role_durations.pop(roleid, None)
 
-    def get_ticket(self, guildid, ticketid):
+    def get_ticket(self, guildid, ticketid, replica=False):
         """
         Retrieve a ticket with the given parameters.
+        If `replica` is set, the ticket may be read from a read replica, for display only.
         Returns: Ticket
         """
-        with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(
-                "SELECT * FROM TicketView WHERE guild_id = %s AND guild_ticket_id = %s",
-                (guildid, ticketid)
-            )
-            ticketdata = cursor.fetchone()
-            return Ticket(self, **ticketdata) if ticketdata else None
+        storage = self.storage.reader(guildid) if replica else self.storage
+        tickets = Ticket.from_rows(self, *storage.get_ticket(guildid, ticketid))
+        if not tickets and storage is not self.storage:
+            # Not replicated yet
+            tickets = Ticket.from_rows(self, *self.storage.get_ticket(guildid, ticketid))
+        return tickets[0] if tickets else None
 
-    def get_ticket_history(self, guildid, ticketid):
+    def get_ticket_history(self, guildid, ticketid, replica=False):
         """
         Retrieve history of a given ticket.
+        If `replica` is set, the history may be read from a read replica, for display only.
         Returns: List of ticketdata tuples,
             in order of oldest to most recent.
         """
-        tickets = []
-        with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(
-                "SELECT * FROM TicketHistory WHERE guild_id = %s AND guild_ticket_id = %s",
-                (guildid, ticketid)
-            )
-            for ticketdata in cursor.fetchall():
-                tickets.append(Ticket(self, **ticketdata))
-        return tickets
+        storage = self.storage.reader(guildid) if replica else self.storage
+        history = Ticket.from_rows(self, *storage.get_ticket_history(guildid, ticketid))
+        if not history and storage is not self.storage:
+            # Not replicated yet, every existing ticket has at least its creation in the history
+            history = Ticket.from_rows(self, *self.storage.get_ticket_history(guildid, ticketid))
+        return history
 
-    def get_member_tickets(self, guildid, userid):
+    def get_member_tickets(self, guildid, userid, replica=False):
         """
         Retrieve the tickets associated to a given user.
         """
-        tickets = []
-        with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(
-                "SELECT * FROM TicketView WHERE guild_id = %s AND victim_id = %s ORDER BY modified_at",
-                (guildid, userid)
-            )
-            for ticketdata in cursor.fetchall():
-                tickets.append(Ticket(self, **ticketdata))
-        return tickets
+        storage = self.storage.reader(guildid) if replica else self.storage
+        return Ticket.from_rows(self, *storage.get_member_tickets(guildid, userid))
 
-    async def create_ticket(self, guild_id, action, mod_id, victim_id, resolved=False, **kwargs):
-        # Wait until we are ready
-        while not self.ready:
-            await asyncio.sleep(1)
+    def search_tickets(self, guildid, terms, limit, offset=0, replica=False):
+        """
+        Search the reasons of a guild's tickets for the given words.
+        Returns: List of at most `limit` tickets, from the most relevant, skipping the first `offset`.
+        """
+        storage = self.storage.reader(guildid) if replica else self.storage
+        return Ticket.from_rows(self, *storage.search_tickets(guildid, terms, limit, offset))
 
-        # Increment the relevant guild ticket counter
-        self.guilds[guild_id].ticket_count += 1
+    def count_search_results(self, guildid, terms, replica=False):
+        """
+        Returns: The number of tickets matching a `search_tickets` search.
+        """
+        storage = self.storage.reader(guildid) if replica else self.storage
+        return storage.count_search_tickets(guildid, terms)
 
-        # Build required ticket data
-        ticketid = self.guilds[guild_id].ticket_count
+    async def update_tickets(self, tfilter, **ticket_data):
+        """
+        Update every ticket matching a `TicketFilter` in a single registry write,
+        and apply the update to the queued tickets in one pass over the guild's moderator queues.
+        When the update assigns the tickets or marks them unresolved, the tickets it may have queued,
+        including those credited to moderators without a queue, are read back and queued.
+        Returns: The number of tickets updated.
+        """
+        publish = any(field in Ticket.embed_fields for field in ticket_data)
+        count = await self.storage.update_tickets(tfilter, ticket_data, publish=publish)
+        if not count:
+            return 0
+        if publish:
+            self.outbox.notify()
+
+        # Update the queued tickets, dropping those which were resolved or assigned to another moderator
+        for tmod in list(self.mods.values()):
+            for ticket in [ticket for ticket in tmod.get_queue(tfilter.guild_id) if tfilter.matches(ticket)]:
+                for attr, value in ticket_data.items():
+                    setattr(ticket, attr, value)
+                ticket.version += 1
+                if ticket.resolved or ticket.moderator_id != tmod.user.id:
+                    tmod.remove_ticket(ticket)
+
+        if ('moderator_id' in ticket_data or ticket_data.get('resolved', None) is False) \
+                and self.receives_dms:
+            unresolved = tfilter.updated(ticket_data)
+            unresolved.resolved = False
+            requeue = {}  # moderator_id: tickets to add to that moderator's queue
+            for ticket in Ticket.from_rows(self, *self.storage.filter_tickets(unresolved)):
+                tmod = self.mods.get(ticket.moderator_id, None)
+                if tmod is None or not tmod.has_ticket(ticket):
+                    requeue.setdefault(ticket.moderator_id, []).append(ticket)
+            for moderator_id, tickets in requeue.items():
+                await self.queue_tickets(moderator_id, tickets)
+        return count
+
+    def draft_ticket(self, guild_id, action, mod_id, victim_id, resolved=False, **kwargs):
+        """
+        Build the registry data for a new ticket, without numbering, posting or inserting it.
+        Every draft has the same fields, so a batch of drafts can be inserted in a single statement.
+        The interface must be ready, since the guild's role durations are read here.
+        Returns: Dictionary of ticket data, for `insert_tickets`.
+        """
         ticket_data = {
             'guild_id': guild_id,
-            'guild_ticket_id': ticketid,
             'action_id': int(action),
             'moderator_id': mod_id,
             'victim_id': victim_id,
             'modified_by_id': mod_id,
-            'resolved': resolved
+            'resolved': resolved,
+            'auditlog_id': None,
+            'undo_at': None,
+            'role_id': None,
+            'reason': None,
+            'created_at': None
         }
 
         # Add extra ticket data if provided
@@ -480,46 +914,146 @@ class TicketInterface(object):
             'reason',
             'created_at'
         )
-        if 'created_at' in kwargs:
-            kwargs['created_at'] = self.dt_to_timestamp(kwargs['created_at'])
         for field in kwargs:
             if field in optional_fields:
                 ticket_data[field] = kwargs[field]
             else:
                 raise ValueError("Unrecognised field `{}` passed to `create_ticket`".format(field))
+        if ticket_data['created_at'] is None:
+            ticket_data['created_at'] = datetime.datetime.utcnow()
 
-        # TODO: Make this more atomic so it rolls back changes and deletes the modlog message if something goes wrong
-        # Post a placeholder ticket in the modlog to get the modlog message id
-        channel = self.client.get_channel(self.guilds[guild_id].modlog_id)
-        if channel is None:
-            # TODO: Better exception
-            raise Exception("Modlog for guild (gid: {}) no longer exists.".format(guild_id))
-        message = await channel.send(embed=discord.Embed().set_author(name="Ticket #{}".format(ticketid)))
-        ticket_data['modlog_msg_id'] = message.id
-
-        # Insert ticket into registry
-        with self.conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO Tickets ({}) VALUES ({})".format(
-                    ", ".join(ticket_data.keys()),
-                    ", ".join("%s" for field in ticket_data)
-                ),
-                tuple(ticket_data.values())
+        # Schedule the removal of roles with a default duration
+        duration = self.guilds[guild_id].role_durations.get(ticket_data['role_id'], None)
+        if action == self.ActionTypes.ROLE_ADD and duration and ticket_data['undo_at'] is None:
+            start = ticket_data['created_at'].replace(tzinfo=datetime.timezone.utc).timestamp()
+            ticket_data['undo_at'] = int(start) + duration
+        return ticket_data
+
+    async def insert_tickets(self, guild_id, drafts):
+        """
+        Number a batch of ticket drafts in order, and insert them into the registry in a single transaction,
+        along with their modlog outbox entries.
+        The modlog messages are posted in the background by the `ModlogPublisher`.
+        Returns: List of the created tickets, to be passed to `publish_tickets`.
+        """
+        if not drafts:
+            return []
+
+        # Wait until we are ready
+        while not self.ready:
+            await asyncio.sleep(1)
+
+        # Reserve the ticket numbers for the whole batch
+        tguild = self.guilds[guild_id]
+        first = tguild.ticket_count + 1
+        tguild.ticket_count += len(drafts)
+        last = tguild.ticket_count
+
+        rows = [dict(draft, guild_ticket_id=ticketid) for ticketid, draft in enumerate(drafts, start=first)]
+        try:
+            await self.storage.insert_tickets(rows)
+        except Exception:
+            if tguild.ticket_count == last:
+                # Release the ticket numbers, unless more were reserved in the meantime
+                tguild.ticket_count = first - 1
+            raise
+
+        return Ticket.from_rows(self, *self.storage.get_tickets(guild_id, first, last))
+
+    async def publish_tickets(self, tickets):
+        """
+        Wake the modlog publisher for newly inserted tickets,
+        then schedule and queue the tickets in ticket order.
+        """
+        self.outbox.notify()
+
+        for ticket in tickets:
+            log(
+                "Created ticket #{} ({}).".format(ticket.guild_ticket_id, ticket.action),
+                context="CREATE_TICKET",
+                level=logging.DEBUG,
+                guild_id=ticket.guild_id,
+                ticket=ticket.guild_ticket_id
             )
-            self.conn.commit()
 
-        # Generate the ticket and properly post to modlog
-        ticket = self.get_ticket(guild_id, ticketid)
-        await ticket.refresh()
+            if ticket.undo_at is not None:
+                self.scheduler.schedule(ticket)
 
-        # Add the ticket to the appropriate queue here if it has not been resolved
-        if not ticket.resolved:
-            await self.queue_ticket(ticket)
-        return ticket
+            # Add the ticket to the appropriate queue here if it has not been resolved
+            if not ticket.resolved:
+                await self.queue_ticket(ticket)
 
-    @staticmethod
-    def dt_to_timestamp(dt):
-        if dt.tzinfo:
-            # Convert to UTC
-            dt = dt.astimezone(datetime.timezone.utc)
-        return dt.strftime('%Y-%m-%d %H:%M:%S+00:00')
+    async def create_ticket(self, guild_id, action, mod_id, victim_id, resolved=False, **kwargs):
+        # Wait until we are ready, since the draft reads the guild's role durations
+        while not self.ready:
+            await asyncio.sleep(1)
+
+        draft = self.draft_ticket(guild_id, action, mod_id, victim_id, resolved=resolved, **kwargs)
+        tickets = await self.insert_tickets(guild_id, [draft])
+        await self.publish_tickets(tickets)
+        return tickets[0]
+
+    async def undo_ticket(self, ticket):
+        """
+        Reverse the moderation action of a ticket whose `undo_at` time has passed,
+        by unbanning the victim or removing the role,
+        then clear the `undo_at` time to record that the action has been handled.
+        The action is left alone if a later ticket has already reversed or repeated it,
+        such as a manual unban, or a new ban which is then the one to undo, if ever.
+        The reversal itself is picked up from the audit log as a new ticket.
+        Returns: The result of the action,
+            or `None` if it failed temporarily, or the guild has yet to be caught up, and should be retried.
+        """
+        guild = self.client.get_guild(ticket.guild_id)
+        if guild is None:
+            return None
+        if ticket.guild_id in self.catchup_pending:
+            # A later ticket may still be waiting in the audit log
+            return None
+        reason = "Timed action from ticket #{} expired.".format(ticket.guild_ticket_id)
+
+        if ticket.action_id == self.ActionTypes.BAN:
+            superseding = (self.ActionTypes.BAN, self.ActionTypes.UNBAN)
+        else:
+            superseding = (self.ActionTypes.ROLE_ADD, self.ActionTypes.ROLE_RM)
+        later = self.storage.get_later_ticket(
+            ticket.guild_id, ticket.guild_ticket_id, ticket.victim_id,
+            [int(action) for action in superseding],
+            roleid=ticket.role_id if ticket.action_id == self.ActionTypes.ROLE_ADD else None
+        )
+
+        result = "skipped"
+        try:
+            if later is not None:
+                result = "superseded"
+            elif ticket.action_id == self.ActionTypes.BAN:
+                await guild.unban(discord.Object(id=ticket.victim_id), reason=reason)
+                result = "undone"
+            elif ticket.action_id == self.ActionTypes.ROLE_ADD and ticket.role_id:
+                member = guild.get_member(ticket.victim_id) or await guild.fetch_member(ticket.victim_id)
+                self.expect_role_change(guild.id, member.id)
+                await member.remove_roles(discord.Object(id=ticket.role_id), reason=reason)
+                result = "undone"
+        except discord.NotFound:
+            # Already unbanned, or the member left
+            result = "missing"
+        except discord.Forbidden:
+            result = "forbidden"
+            log(
+                "Missing permissions to undo a timed action.",
+                context="UNDO_SCHEDULER",
+                level=logging.WARNING,
+                guild_id=ticket.guild_id,
+                ticket=ticket.guild_ticket_id
+            )
+        except discord.HTTPException:
+            return None
+
+        await ticket.update(modified_by_id=self.client.user.id, undo_at=None)
+        log(
+            "Handled timed action of ticket #{} ({}).".format(ticket.guild_ticket_id, result),
+            context="UNDO_SCHEDULER",
+            guild_id=ticket.guild_id,
+            ticket=ticket.guild_ticket_id
+        )
+        return result
@@ -0,0 +1,191 @@
+import time
+import asyncio
+import logging
+import datetime
+import traceback
+from collections import OrderedDict
+
+import discord
+
+from logger import log
+from metrics import Counter
+
+
+# Metrics
+modlog_publishes = Counter(
+    "ticketbot_modlog_publishes_total",
+    "Modlog posts and edits made by the modlog publisher, by result.",
+    labels=("result",)
+)
+
+
+class ModlogPublisher(object):
+    """
+    Posts and edits the modlog messages of tickets queued in the registry outbox.
+
+    Tickets are queued in the same transaction which creates or modifies them,
+    so registry writes never wait on Discord, and no ticket is left unposted after a failure or a restart.
+    Each guild's queue is published in ticket order, one message at a time, so the modlog stays in order.
+    The message of a new ticket is recorded once it is posted.
+    If the ticket was already being posted when a previous attempt failed,
+    the modlog is searched for the message first, so that it isn't posted twice.
+    A guild whose publishing fails is skipped until its retry time,
+    which doubles with each consecutive failure up to `max_backoff` seconds,
+    so that one broken modlog doesn't hold up the other guilds.
+
+    Parameters
+    ----------
+    interface: TicketInterface
+        The interface to read tickets with.
+    page_size: int
+        Maximum number of queued tickets read from the registry at once.
+    concurrency: int
+        Maximum number of guilds published at once.
+    retry_interval: int
+        Number of seconds before retrying after a failure.
+    max_backoff: int
+        Maximum number of seconds before retrying a guild which keeps failing.
+    """
+    def __init__(self, interface, page_size=100, concurrency=5, retry_interval=60, max_backoff=3600):
+        self.interface = interface
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.retry_interval = retry_interval
+        self.max_backoff = max_backoff
+
+        self.wakeup = asyncio.Event()
+        self.backoff = {}  # guildid: (consecutive failures, monotonic time of the next attempt)
+
+    def notify(self):
+        """
+        Wake the publisher after queueing tickets.
+        """
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                done = await self.publish_pending()
+            except Exception:
+                done = False
+                log(
+                    "Failed to read the modlog outbox.\n{}".format(traceback.format_exc()),
+                    context="MODLOG_PUBLISHER",
+                    level=logging.ERROR
+                )
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=None if done else self.retry_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def publish_pending(self):
+        """
+        Publish every queued ticket.
+        Returns: Whether the outbox was emptied, or some guilds failed and need to be retried.
+        """
+        interface = self.interface
+        semaphore = asyncio.Semaphore(self.concurrency)
+        now = time.monotonic()
+        # Guilds which failed in this pass, or are waiting to be retried, are left out of the pages
+        skipped = {guildid for guildid, (_, retry_at) in self.backoff.items() if retry_at > now}
+
+        while True:
+            rows = interface.storage.get_outbox(
+                self.page_size, shard_count=interface.shard_count, shard_ids=interface.shard_ids,
+                exclude=tuple(skipped)
+            )
+            guilds = OrderedDict()
+            for row in rows:
+                guilds.setdefault(row['guild_id'], []).append(row)
+            if not guilds:
+                break
+
+            async def publish_guild(guildid, guild_rows):
+                async with semaphore:
+                    for row in guild_rows:
+                        if not await self.publish(row):
+                            self.failed(guildid)
+                            skipped.add(guildid)
+                            return
+                    self.backoff.pop(guildid, None)
+
+            await asyncio.gather(*(publish_guild(guildid, guild_rows) for guildid, guild_rows in guilds.items()))
+            if len(rows) < self.page_size:
+                break
+        return not skipped
+
+    def failed(self, guildid):
+        """
+        Record a failure to publish in a guild, and schedule its next attempt.
+        """
+        failures = self.backoff.get(guildid, (0, 0))[0] + 1
+        delay = min(self.retry_interval * 2 ** (failures - 1), self.max_backoff)
+        self.backoff[guildid] = (failures, time.monotonic() + delay)
+
+    async def publish(self, row):
+        """
+        Post or edit the modlog message of a queued ticket, and remove it from the outbox.
+        Returns: Whether the ticket was published.
+        """
+        interface = self.interface
+        guildid, ticketid = row['guild_id'], row['guild_ticket_id']
+        ticket = interface.get_ticket(guildid, ticketid)
+        modlog_id = interface.get_modlog_id(guildid)
+        if ticket is None or modlog_id is None:
+            # Ticket or guild no longer handled
+            await interface.storage.complete_outbox(guildid, ticketid, row['revision'])
+            modlog_publishes.inc(result="dropped")
+            return True
+
+        try:
+            channel = interface.client.get_channel(modlog_id) or await interface.client.fetch_channel(modlog_id)
+            await interface.users.fetch(ticket.victim_id)
+            if ticket.modlog_msg_id is None:
+                message = None
+                if row['attempts']:
+                    # A previous attempt may have posted the ticket without recording it
+                    message = await self.find_posted(channel, ticket)
+                if message is None:
+                    await interface.storage.mark_outbox_attempt(guildid, ticketid)
+                    message = await channel.send(embed=ticket.embed)
+                    result = "posted"
+                else:
+                    await message.edit(embed=ticket.embed)
+                    result = "recovered"
+                await interface.storage.complete_outbox(guildid, ticketid, row['revision'], modlog_msg_id=message.id)
+            else:
+                try:
+                    await ticket.refresh()
+                    result = "edited"
+                except discord.NotFound:
+                    # The modlog message was deleted, there is nothing to edit
+                    result = "missing"
+                await interface.storage.complete_outbox(guildid, ticketid, row['revision'])
+        except discord.HTTPException as e:
+            modlog_publishes.inc(result="error")
+            log(
+                "Failed to publish ticket #{} in the modlog: {}".format(ticketid, e),
+                context="MODLOG_PUBLISHER",
+                level=logging.WARNING,
+                guild_id=guildid,
+                ticket=ticketid
+            )
+            return False
+
+        modlog_publishes.inc(result=result)
+        return True
+
+    async def find_posted(self, channel, ticket):
+        """
+        Look for the modlog message of a ticket posted by a previous attempt.
+        Returns: `discord.Message` or `None` if the ticket wasn't posted.
+        """
+        name = "Ticket #{}".format(ticket.guild_ticket_id)
+        after = ticket.created_at - datetime.timedelta(minutes=1)
+        async for message in channel.history(limit=None, after=after):
+            if message.author == self.interface.client.user and message.embeds \
+                    and message.embeds[0].author.name == name:
+                return message
+        return None
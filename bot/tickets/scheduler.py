@@ -0,0 +1,156 @@
+import time
+import heapq
+import asyncio
+import logging
+import traceback
+
+from logger import log
+from metrics import Counter, Gauge
+
+
+# Metrics
+undo_actions = Counter(
+    "ticketbot_undo_actions_total",
+    "Timed actions handled by the undo scheduler, by result.",
+    labels=("result",)
+)
+undo_pending = Gauge(
+    "ticketbot_undo_pending",
+    "Number of timed actions currently held in the undo scheduler window."
+)
+
+
+class UndoScheduler(object):
+    """
+    Runs the timed actions of tickets with an `undo_at` time, such as unbanning or removing a role.
+
+    Only the actions due within the next `horizon` seconds are held in memory, in a heap.
+    Later actions are paged in from the registry in `undo_at` order, at most `page_size` at a time,
+    so the scheduler never reads every ticket.
+    Completed actions are recorded by clearing `undo_at` on the ticket,
+    so pending actions, including the ones missed while offline, are picked up again after a restart.
+    When a held action is brought forward, it is pushed again with its new time,
+    and the entry with the old time is discarded when it reaches the top of the heap.
+
+    Parameters
+    ----------
+    interface: TicketInterface
+        The interface to read and undo tickets with.
+    horizon: int
+        Number of seconds ahead that actions are loaded into memory.
+    page_size: int
+        Maximum number of actions read from the registry at once.
+    max_pending: int
+        Number of actions held in memory before paging stops until some are handled.
+    """
+    def __init__(self, interface, horizon=3600, page_size=100, max_pending=1000):
+        self.interface = interface
+        self.horizon = horizon
+        self.page_size = page_size
+        self.max_pending = max_pending
+
+        self.heap = []  # (undo_at, guildid, ticketid), including superseded entries
+        self.scheduled = {}  # (guildid, ticketid): earliest undo_at pushed for the ticket
+        self.cursor = None  # Key of the last ticket paged in, see `Storage.get_scheduled_tickets`
+        self.window_end = 0  # Every pending action with `undo_at` up to this time is in the heap
+        self.wakeup = asyncio.Event()
+
+    def _push(self, undo_at, guildid, ticketid):
+        key = (guildid, ticketid)
+        if key not in self.scheduled or undo_at < self.scheduled[key]:
+            self.scheduled[key] = undo_at
+            heapq.heappush(self.heap, (undo_at, guildid, ticketid))
+            undo_pending.set(len(self.scheduled))
+
+    def schedule(self, ticket):
+        """
+        Add a ticket whose `undo_at` time was just set.
+        Tickets beyond the current window are left to be paged in later.
+        """
+        if ticket.undo_at is not None and ticket.undo_at <= self.window_end:
+            self._push(ticket.undo_at, ticket.guild_id, ticket.guild_ticket_id)
+            if self.heap[0][0] == ticket.undo_at:
+                self.wakeup.set()
+
+    def refill(self):
+        """
+        Page the actions due within the horizon into the heap.
+        """
+        until = time.time() + self.horizon
+        while self.window_end < until and len(self.scheduled) < self.max_pending:
+            rows = self.interface.storage.get_scheduled_tickets(
+                self.cursor, until, self.page_size,
+                shard_count=self.interface.shard_count, shard_ids=self.interface.shard_ids
+            )
+            for row in rows:
+                self._push(row['undo_at'], row['guild_id'], row['guild_ticket_id'])
+            if len(rows) < self.page_size:
+                # Everything up to the horizon has been read
+                self.cursor = (until, None, None)
+                self.window_end = until
+            else:
+                last = rows[-1]
+                self.cursor = (last['undo_at'], last['guild_id'], last['guild_ticket_id'])
+                self.window_end = last['undo_at']
+
+    async def run(self):
+        while True:
+            try:
+                self.refill()
+            except Exception:
+                log(
+                    "Failed to read the upcoming timed actions.\n{}".format(traceback.format_exc()),
+                    context="UNDO_SCHEDULER",
+                    level=logging.ERROR
+                )
+                await asyncio.sleep(60)
+                continue
+
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                undo_at, guildid, ticketid = heapq.heappop(self.heap)
+                if self.scheduled.get((guildid, ticketid), None) != undo_at:
+                    # Superseded by an earlier time
+                    continue
+                del self.scheduled[(guildid, ticketid)]
+                undo_pending.set(len(self.scheduled))
+                try:
+                    await self.run_action(guildid, ticketid)
+                except Exception:
+                    undo_actions.inc(result="error")
+                    log(
+                        "Timed action failed.\n{}".format(traceback.format_exc()),
+                        context="UNDO_SCHEDULER",
+                        level=logging.ERROR,
+                        guild_id=guildid,
+                        ticket=ticketid
+                    )
+
+            # Sleep until the next action, a new earlier action, or the window needs extending
+            timeout = min(self.horizon / 2, self.window_end - time.time())
+            if self.heap:
+                timeout = min(timeout, self.heap[0][0] - time.time())
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_action(self, guildid, ticketid):
+        """
+        Undo the given ticket, if it is still due.
+        """
+        ticket = self.interface.get_ticket(guildid, ticketid)
+        if ticket is None or ticket.undo_at is None:
+            # Cancelled in the meantime
+            undo_actions.inc(result="cancelled")
+            return
+        if ticket.undo_at > time.time():
+            # Postponed in the meantime
+            self.schedule(ticket)
+            return
+        result = await self.interface.undo_ticket(ticket)
+        if result is None:
+            # Temporary failure, try again later
+            self._push(time.time() + 60, guildid, ticketid)
+        undo_actions.inc(result=result or "retry")
@@ -0,0 +1,23 @@
+def open_storage(backend, **opts):
+    """
+    Open the ticket registry storage backend with the given name.
+    Backend modules are imported lazily, so that the driver for an unused backend
+    does not need to be installed.
+
+    Parameters
+    ----------
+    backend: str
+        Either `mysql` or `sqlite`.
+    opts: ...
+        Backend connection options, passed to the backend constructor.
+
+    Returns: Storage
+    """
+    if backend == 'mysql':
+        from .mysql_storage import MySQLStorage
+        return MySQLStorage(**opts)
+    elif backend == 'sqlite':
+        from .sqlite_storage import SQLiteStorage
+        return SQLiteStorage(**opts)
+    else:
+        raise ValueError("Unknown storage backend `{}`.".format(backend))
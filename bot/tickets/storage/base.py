@@ -0,0 +1,581 @@
+import time
+import asyncio
+import datetime
+from functools import lru_cache
+
+from metrics import db_latency
+
+from .group_commit import GroupCommit
+
+
+@lru_cache(maxsize=None)
+def _insert_sql(table, fields):
+    return "INSERT INTO {} ({}) VALUES ({})".format(table, ", ".join(fields), ", ".join("%s" for field in fields))
+
+
+@lru_cache(maxsize=256)
+def _translate(sql, placeholder):
+    return sql.replace('%s', placeholder)
+
+
+@lru_cache(maxsize=None)
+def _update_ticket_sql(fields):
+    return "UPDATE Tickets SET {} WHERE guild_id = %s AND guild_ticket_id = %s".format(
+        ", ".join("{} = %s".format(field) for field in fields)
+    )
+
+
+def _update_tickets_sql(fields, condition):
+    return "UPDATE Tickets SET {} WHERE {}".format(
+        ", ".join("{} = %s".format(field) for field in fields),
+        condition
+    )
+
+
+class Storage(object):
+    """
+    Base class for the ticket registry storage backends.
+
+    Backends provide a DB-API connection in `conn`,
+    and implement the cursor creation and the dialect specific statements.
+    Queries are written with `%s` placeholders, translated to the backend `placeholder`.
+    Guild rows are returned as dictionaries, and ticket rows as `(columns, rows)` with tuple rows,
+    read through prepared statements where the backend supports them.
+    All timestamps are returned as naive UTC datetimes.
+    Writes return a future resolved once the write has been committed,
+    which is immediately unless group commit is enabled,
+    with the number of rows matched by the last statement of the write.
+
+    Read replicas, added with `add_replica`, serve the read-only queries obtained through `reader`.
+    A guild's reads stay on the primary for `sticky` seconds after each write to the guild,
+    so that a process always reads its own writes.
+    """
+    name = None
+    placeholder = '%s'
+    # Statement queueing a ticket for the modlog publisher, taking `(guild_id, guild_ticket_id)`
+    outbox_upsert = None
+    # Statement queueing the tickets matching a `Tickets` condition, formatted into it
+    outbox_upsert_select = None
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.group_commit = None
+        self._prepared = {}  # sql: prepared cursor, one for each of the few distinct read statements
+
+        self.replicas = []
+        self.sticky = 5
+        self._last_write = {}  # guildid: time of the last write to the guild
+        self._next_replica = 0
+
+    def cursor(self, dictionary=False):
+        """
+        Return a new cursor, usable as a context manager.
+        """
+        raise NotImplementedError
+
+    def clone(self):
+        """
+        Open a new, independent connection to the same database, e.g. for use in another thread.
+        """
+        raise NotImplementedError
+
+    def prepared_cursor(self):
+        """
+        Return a new cursor which prepares its statement on first use, and returns tuple rows.
+        """
+        return self.conn.cursor()
+
+    def close(self):
+        if self.group_commit is not None:
+            self.group_commit.flush()
+        for replica in self.replicas:
+            replica.close()
+        for cursor in self._prepared.values():
+            cursor.close()
+        self.conn.close()
+
+    def add_replica(self, replica):
+        """
+        Add a read replica of this database, opened with the same backend.
+        """
+        self.replicas.append(replica)
+
+    def reader(self, guildid=None):
+        """
+        Return the storage to run a read-only query for the given guild on.
+        This is the primary if there are no replicas, or if the guild was written to in the last `sticky` seconds,
+        and otherwise the next replica in turn.
+        """
+        if not self.replicas:
+            return self
+        if guildid is not None and time.monotonic() - self._last_write.get(guildid, -self.sticky) < self.sticky:
+            return self
+        self._next_replica = (self._next_replica + 1) % len(self.replicas)
+        return self.replicas[self._next_replica]
+
+    def _wrote(self, guildid):
+        if self.replicas:
+            self._last_write[guildid] = time.monotonic()
+
+    def enable_group_commit(self, window=0.01, max_batch=200):
+        """
+        Commit the writes made within each `window` seconds together, see `GroupCommit`.
+        """
+        self.group_commit = GroupCommit(self, window=window, max_batch=max_batch)
+
+    def _sql(self, sql):
+        return sql if self.placeholder == '%s' else _translate(sql, self.placeholder)
+
+    def _row(self, row):
+        """
+        Convert a fetched dictionary row into the common format.
+        """
+        return row
+
+    def _rows(self, columns, rows):
+        """
+        Convert fetched tuple rows with the given columns into the common format.
+        """
+        return rows
+
+    def fetchall(self, query, sql, params=(), dictionary=True):
+        """
+        Run a read query and return all of the resulting rows.
+        `query` names the query for the latency metrics.
+        """
+        with self.cursor(dictionary=dictionary) as cursor:
+            with db_latency.time(query=query):
+                cursor.execute(self._sql(sql), params)
+                rows = cursor.fetchall()
+        return [self._row(row) for row in rows] if dictionary else rows
+
+    def fetchrows(self, query, sql, params=()):
+        """
+        Run a read query through a statement prepared once per connection.
+        Returns: `(columns, rows)`, with the column names and a list of tuple rows.
+        """
+        sql = self._sql(sql)
+        cursor = self._prepared.get(sql, None)
+        if cursor is None:
+            cursor = self._prepared[sql] = self.prepared_cursor()
+        with db_latency.time(query=query):
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        columns = tuple(column[0] for column in cursor.description)
+        return columns, self._rows(columns, rows)
+
+    def stream(self, query, sql, params=(), chunk_size=1000):
+        """
+        Run a read query, and fetch the resulting rows in chunks rather than all at once.
+        Yields: `(columns, rows)` for each chunk of at most `chunk_size` tuple rows.
+        """
+        with self.cursor() as cursor:
+            with db_latency.time(query=query):
+                cursor.execute(self._sql(sql), params)
+            columns = tuple(column[0] for column in cursor.description)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield columns, self._rows(columns, rows)
+
+    def fetchone(self, query, sql, params=(), dictionary=True):
+        with self.cursor(dictionary=dictionary) as cursor:
+            with db_latency.time(query=query):
+                cursor.execute(self._sql(sql), params)
+                row = cursor.fetchone()
+        return self._row(row) if (row is not None and dictionary) else row
+
+    def execute(self, query, sql, params=(), many=False):
+        """
+        Run a write query and commit it.
+        Returns: `asyncio.Future` resolved once the write has been committed.
+        """
+        return self.transaction(query, ((sql, params, many), ))
+
+    def transaction(self, query, statements):
+        """
+        Run several write queries, given as `(sql, params, many)` tuples, and commit them together.
+        Returns: `asyncio.Future` resolved with the row count of the last query once the writes have been committed.
+        """
+        if self.group_commit is not None:
+            return self.group_commit.submit(query, statements)
+
+        try:
+            with self.cursor() as cursor:
+                with db_latency.time(query=query):
+                    rowcount = self._run(cursor, statements)
+                    self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(rowcount)
+        return future
+
+    def _run(self, cursor, statements):
+        """
+        Run write queries on a cursor, without committing them.
+        Returns: The row count of the last query.
+        """
+        for sql, params, many in statements:
+            if many:
+                cursor.executemany(self._sql(sql), params)
+            else:
+                cursor.execute(self._sql(sql), params)
+        return cursor.rowcount
+
+    @staticmethod
+    def dt_to_timestamp(dt):
+        """
+        Format a datetime as a timestamp accepted by the backend.
+        Naive datetimes are assumed to be in UTC.
+        """
+        if dt.tzinfo:
+            # Convert to UTC
+            dt = dt.astimezone(datetime.timezone.utc)
+        return dt.strftime('%Y-%m-%d %H:%M:%S+00:00')
+
+    @staticmethod
+    def _shard_condition(shard_count, shard_ids):
+        """
+        Build a condition restricting `guild_id` to the given shards.
+        Returns the condition and its parameters, or an always true condition if `shard_ids` is `None`.
+        """
+        if shard_ids is None:
+            return "TRUE", ()
+        return (
+            "(guild_id >> 22) % %s IN ({})".format(", ".join("%s" for _ in shard_ids)),
+            (shard_count, *shard_ids)
+        )
+
+    def _filter_condition(self, tfilter):
+        """
+        Build the condition selecting the `Tickets` rows matching a `TicketFilter`.
+        Returns the condition and its parameters.
+        """
+        conditions = ["guild_id = %s"]
+        params = [tfilter.guild_id]
+        if tfilter.ticket_ranges is not None:
+            conditions.append("({})".format(
+                " OR ".join("guild_ticket_id BETWEEN %s AND %s" for _ in tfilter.ticket_ranges) or "FALSE"
+            ))
+            for first, last in tfilter.ticket_ranges:
+                params.extend((first, last))
+        for field in ('moderator_id', 'victim_id', 'action_id', 'resolved'):
+            value = getattr(tfilter, field)
+            if value is not None:
+                conditions.append("{} = %s".format(field))
+                params.append(value)
+        if tfilter.since is not None:
+            conditions.append("created_at >= %s")
+            params.append(self.dt_to_timestamp(tfilter.since))
+        return " AND ".join(conditions), tuple(params)
+
+    # Loaders
+    def load_action_types(self):
+        """
+        Returns: List of `(action_name, action_id)` tuples.
+        """
+        return [
+            tuple(row) for row in
+            self.fetchall("load_types", "SELECT action_name, action_id FROM ActionTypes", dictionary=False)
+        ]
+
+    def load_guilds(self, shard_count=None, shard_ids=None):
+        """
+        Returns: List of `GuildView` rows, one for each registered guild and active role pair.
+        If `shard_ids` is given, only guilds on those shards are returned.
+        """
+        condition, params = self._shard_condition(shard_count, shard_ids)
+        return self.fetchall("load_guilds", "SELECT * FROM GuildView WHERE {}".format(condition), params)
+
+    def load_unresolved_tickets(self, shard_count=None, shard_ids=None):
+        condition, params = self._shard_condition(shard_count, shard_ids)
+        return self.fetchrows(
+            "load_mods",
+            "SELECT * FROM TicketView WHERE resolved = FALSE AND {} ORDER BY created_at".format(condition),
+            params
+        )
+
+    def load_role_durations(self, shard_count=None, shard_ids=None):
+        """
+        Returns: List of `(guild_id, role_id, default_duration)` tuples, for the active roles with a default duration.
+        """
+        condition, params = self._shard_condition(shard_count, shard_ids)
+        return [
+            tuple(row) for row in
+            self.fetchall(
+                "load_role_durations",
+                "SELECT guild_id, role_id, default_duration FROM ActiveRoles "
+                "WHERE active = TRUE AND default_duration IS NOT NULL AND {}".format(condition),
+                params,
+                dictionary=False
+            )
+        ]
+
+    def load_audit_watermarks(self, shard_count=None, shard_ids=None):
+        """
+        Returns: List of `(guild_id, action_id, auditlog_id)` tuples,
+            with the id of the last audit log entry which created a ticket of each action type in each guild.
+        """
+        condition, params = self._shard_condition(shard_count, shard_ids)
+        return [
+            tuple(row) for row in
+            self.fetchall(
+                "load_audit_watermarks",
+                "SELECT guild_id, action_id, MAX(auditlog_id) FROM Tickets "
+                "WHERE auditlog_id IS NOT NULL AND {} GROUP BY guild_id, action_id".format(condition),
+                params,
+                dictionary=False
+            )
+        ]
+
+    def get_guild(self, guildid):
+        return self.fetchone("get_guild", "SELECT * FROM Guilds WHERE guild_id = %s", (guildid, ))
+
+    # Ticket queries
+    def get_ticket(self, guildid, ticketid):
+        return self.fetchrows(
+            "get_ticket",
+            "SELECT * FROM TicketView WHERE guild_id = %s AND guild_ticket_id = %s",
+            (guildid, ticketid)
+        )
+
+    def get_ticket_history(self, guildid, ticketid):
+        return self.fetchrows(
+            "get_ticket_history",
+            "SELECT * FROM TicketHistory WHERE guild_id = %s AND guild_ticket_id = %s",
+            (guildid, ticketid)
+        )
+
+    def get_moderator_tickets(self, modid):
+        """
+        Retrieve the unresolved tickets assigned to a moderator, across all guilds.
+        """
+        return self.fetchrows(
+            "get_moderator_tickets",
+            "SELECT * FROM TicketView WHERE moderator_id = %s AND resolved = FALSE ORDER BY created_at",
+            (modid, )
+        )
+
+    def get_scheduled_tickets(self, after, until, limit, shard_count=None, shard_ids=None):
+        """
+        Retrieve the tickets with an `undo_at` time of at most `until`,
+        ordered by `undo_at`, then by ticket, using the `undo_at` index.
+
+        `after` is `None` to start from the earliest ticket,
+        or the `(undo_at, guild_id, guild_ticket_id)` key of the last ticket retrieved,
+        with `None` ids to continue after every ticket at that time.
+        """
+        if after is None:
+            after_condition, after_params = "undo_at IS NOT NULL", ()
+        elif after[1] is None:
+            after_condition, after_params = "undo_at > %s", (after[0], )
+        else:
+            after_condition = (
+                "(undo_at > %s OR (undo_at = %s AND (guild_id > %s OR (guild_id = %s AND guild_ticket_id > %s))))"
+            )
+            after_params = (after[0], after[0], after[1], after[1], after[2])
+        condition, params = self._shard_condition(shard_count, shard_ids)
+        return self.fetchall(
+            "get_scheduled_tickets",
+            "SELECT guild_id, guild_ticket_id, undo_at FROM Tickets "
+            "WHERE {} AND undo_at <= %s AND {} "
+            "ORDER BY undo_at, guild_id, guild_ticket_id LIMIT %s".format(after_condition, condition),
+            (*after_params, int(until), *params, limit)
+        )
+
+    def get_later_ticket(self, guildid, ticketid, victimid, action_ids, roleid=None):
+        """
+        Retrieve the number of the first ticket after `ticketid` against the same victim,
+        with one of the given actions, and with the given role if any.
+        Returns: The ticket number, or `None` if there is no such ticket.
+        """
+        sql = (
+            "SELECT guild_ticket_id FROM Tickets "
+            "WHERE guild_id = %s AND victim_id = %s AND guild_ticket_id > %s AND action_id IN ({})"
+        ).format(", ".join(["%s"] * len(action_ids)))
+        params = (guildid, victimid, ticketid, *action_ids)
+        if roleid is not None:
+            sql += " AND role_id = %s"
+            params += (roleid, )
+        row = self.fetchone("get_later_ticket", sql + " ORDER BY guild_ticket_id LIMIT 1", params, dictionary=False)
+        return row[0] if row is not None else None
+
+    def get_member_tickets(self, guildid, userid):
+        return self.fetchrows(
+            "get_member_tickets",
+            "SELECT * FROM TicketView WHERE guild_id = %s AND victim_id = %s ORDER BY modified_at",
+            (guildid, userid)
+        )
+
+    def get_tickets(self, guildid, first, last):
+        """
+        Retrieve the tickets numbered from `first` to `last` in a guild, in ticket order.
+        """
+        return self.fetchrows(
+            "get_tickets",
+            "SELECT * FROM TicketView WHERE guild_id = %s AND guild_ticket_id BETWEEN %s AND %s "
+            "ORDER BY guild_ticket_id",
+            (guildid, first, last)
+        )
+
+    def search_tickets(self, guildid, terms, limit, offset=0):
+        """
+        Search the reasons of a guild's tickets for any of the words in `terms`, using the full-text index.
+        Returns: The `(columns, rows)` of at most `limit` matching tickets, skipping the first `offset`,
+            from the most relevant, then from the most recent.
+        """
+        raise NotImplementedError
+
+    def count_search_tickets(self, guildid, terms):
+        """
+        Returns: The number of tickets in a guild matching a `search_tickets` search.
+        """
+        raise NotImplementedError
+
+    def insert_tickets(self, tickets):
+        """
+        Insert a batch of new tickets in a single transaction,
+        and queue them to be posted in the modlog.
+        Every ticket must have the same fields.
+        Datetime values are converted to backend timestamps.
+        """
+        for guildid in set(ticket_data['guild_id'] for ticket_data in tickets):
+            self._wrote(guildid)
+        fields = tuple(tickets[0].keys())
+        values = [
+            tuple(
+                self.dt_to_timestamp(value) if isinstance(value, datetime.datetime) else value
+                for value in (ticket_data[field] for field in fields)
+            )
+            for ticket_data in tickets
+        ]
+        return self.transaction("insert_tickets", (
+            (_insert_sql("Tickets", fields), values, True),
+            (
+                self.outbox_upsert,
+                [(ticket_data['guild_id'], ticket_data['guild_ticket_id']) for ticket_data in tickets],
+                True
+            )
+        ))
+
+    def update_ticket(self, guildid, ticketid, ticket_data, publish=True):
+        """
+        Update a ticket, and queue its modlog post to be edited if `publish` is set.
+        """
+        self._wrote(guildid)
+        statements = [(
+            _update_ticket_sql(tuple(ticket_data.keys())),
+            (*ticket_data.values(), guildid, ticketid),
+            False
+        )]
+        if publish:
+            statements.append((self.outbox_upsert, (guildid, ticketid), False))
+        return self.transaction("update_ticket", statements)
+
+    def filter_tickets(self, tfilter):
+        """
+        Retrieve the tickets matching a `TicketFilter`, in creation order.
+        """
+        condition, params = self._filter_condition(tfilter)
+        return self.fetchrows(
+            "filter_tickets",
+            "SELECT * FROM TicketView WHERE {} ORDER BY created_at".format(condition),
+            params
+        )
+
+    def update_tickets(self, tfilter, ticket_data, publish=True):
+        """
+        Update every ticket matching a `TicketFilter` with a single statement,
+        and queue their modlog posts to be edited if `publish` is set.
+        The tickets are queued first, since the update may change whether they match.
+        The returned future is resolved with the number of tickets updated.
+        """
+        self._wrote(tfilter.guild_id)
+        condition, params = self._filter_condition(tfilter)
+        statements = []
+        if publish:
+            statements.append((self.outbox_upsert_select.format(condition), params, False))
+        statements.append((
+            _update_tickets_sql(tuple(ticket_data.keys()), condition),
+            (*ticket_data.values(), *params),
+            False
+        ))
+        return self.transaction("update_tickets", statements)
+
+    # Modlog outbox
+    def get_outbox(self, limit, shard_count=None, shard_ids=None, exclude=()):
+        """
+        Retrieve the tickets waiting to be posted or edited in the modlog, in ticket order.
+        Tickets from the guilds in `exclude` are skipped.
+        """
+        condition, params = self._shard_condition(shard_count, shard_ids)
+        if exclude:
+            condition += " AND guild_id NOT IN ({})".format(", ".join("%s" for _ in exclude))
+            params = (*params, *exclude)
+        return self.fetchall(
+            "get_outbox",
+            "SELECT guild_id, guild_ticket_id, revision, attempts FROM ModlogOutbox "
+            "WHERE {} ORDER BY guild_id, guild_ticket_id LIMIT %s".format(condition),
+            (*params, limit)
+        )
+
+    def mark_outbox_attempt(self, guildid, ticketid):
+        """
+        Record that a ticket is about to be posted, so that a retry checks whether it was.
+        """
+        return self.execute(
+            "mark_outbox_attempt",
+            "UPDATE ModlogOutbox SET attempts = attempts + 1 WHERE guild_id = %s AND guild_ticket_id = %s",
+            (guildid, ticketid)
+        )
+
+    def complete_outbox(self, guildid, ticketid, revision, modlog_msg_id=None):
+        """
+        Remove a published ticket from the outbox, unless it was modified again since `revision`,
+        and record its modlog message id if it was just posted.
+        """
+        self._wrote(guildid)
+        statements = []
+        if modlog_msg_id is not None:
+            # Leave `modified_at` unchanged, this is not a modification of the ticket
+            statements.append((
+                "UPDATE Tickets SET modlog_msg_id = %s, modified_at = modified_at "
+                "WHERE guild_id = %s AND guild_ticket_id = %s",
+                (modlog_msg_id, guildid, ticketid),
+                False
+            ))
+            statements.append((
+                "UPDATE TicketHistory SET modlog_msg_id = %s "
+                "WHERE guild_id = %s AND guild_ticket_id = %s AND modlog_msg_id IS NULL",
+                (modlog_msg_id, guildid, ticketid),
+                False
+            ))
+        statements.append((
+            "DELETE FROM ModlogOutbox WHERE guild_id = %s AND guild_ticket_id = %s AND revision = %s",
+            (guildid, ticketid, revision),
+            False
+        ))
+        return self.transaction("complete_outbox", statements)
+
+    # Guild configuration
+    def upsert_guild(self, guild_id, staffrole_id, modlog_id):
+        """
+        Register a new guild or update the details for an existing one.
+        """
+        raise NotImplementedError
+
+    def upsert_active_role(self, guildid, roleid, add_action, rm_action, default_duration=None):
+        """
+        Create an active role, or update and reactivate an existing one.
+        """
+        raise NotImplementedError
+
+    def deactivate_role(self, roleid):
+        return self.execute(
+            "deactivate_role",
+            "UPDATE ActiveRoles SET active = FALSE WHERE role_id = %s",
+            (roleid, )
+        )
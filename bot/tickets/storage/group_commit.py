@@ -0,0 +1,98 @@
+import asyncio
+
+from metrics import Histogram, db_latency
+
+
+# Metrics
+group_commit_size = Histogram(
+    "ticketbot_group_commit_writes",
+    "Number of writes committed together in each group commit.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+
+
+class GroupCommit(object):
+    """
+    Collects the writes made within a short window and commits them in a single transaction,
+    so that a burst of writes costs one commit rather than one commit per write.
+
+    Each write returns a future, resolved once the transaction containing it has been committed,
+    with the row count of the last statement of the write.
+    Whether the commit has reached the disk by then depends on the backend:
+    the SQLite backend syncs each group commit, and MySQL does with its default `innodb_flush_log_at_trx_commit`.
+    If the transaction fails, it is rolled back and its writes are retried one at a time,
+    so that each future receives the result of its own write.
+
+    Parameters
+    ----------
+    storage: Storage
+        The storage backend to write to.
+    window: float
+        Number of seconds to collect writes for, starting from the first write of a group.
+    max_batch: int
+        Number of writes which triggers an immediate commit.
+    """
+    def __init__(self, storage, window=0.01, max_batch=200):
+        self.storage = storage
+        self.window = window
+        self.max_batch = max_batch
+
+        self.pending = []  # (query, statements, future)
+        self._timer = None
+
+    def submit(self, query, statements):
+        """
+        Add a write, made of the given `(sql, params, many)` statements, to the current group.
+        Returns: `asyncio.Future` resolved once the write has been committed.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.append((query, statements, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+        return future
+
+    def _run(self, batch):
+        with self.storage.cursor() as cursor:
+            rowcounts = [self.storage._run(cursor, statements) for _, statements, _ in batch]
+            self.storage.conn.commit()
+        return rowcounts
+
+    def flush(self):
+        """
+        Commit the current group, without waiting for the end of the window.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        group_commit_size.observe(len(batch))
+        try:
+            with db_latency.time(query="group_commit"):
+                rowcounts = self._run(batch)
+        except Exception:
+            self.storage.conn.rollback()
+        else:
+            for (_, _, future), rowcount in zip(batch, rowcounts):
+                if not future.done():
+                    future.set_result(rowcount)
+            return
+
+        # Isolate the failing writes
+        for write in batch:
+            query, _, future = write
+            try:
+                with db_latency.time(query=query):
+                    rowcount, = self._run((write, ))
+            except Exception as e:
+                self.storage.conn.rollback()
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(rowcount)
@@ -0,0 +1,83 @@
+import mysql.connector
+from mysql.connector.constants import ClientFlag
+
+from .base import Storage
+
+
+class MySQLStorage(Storage):
+    """
+    Ticket registry stored in a MySQL database, set up with `data/createdb.sql`.
+
+    The C extension of the connector is used when it is installed.
+    Cursors are unbuffered, so that `stream` reads the rows from the server as they are fetched.
+    Row counts are of the matched rows rather than the changed rows, as with SQLite.
+
+    Parameters
+    ----------
+    dbopts: ...
+        Connection options passed to `mysql.connector.connect`.
+    """
+    name = "mysql"
+    outbox_upsert = (
+        "INSERT INTO ModlogOutbox (guild_id, guild_ticket_id) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE revision = revision + 1"
+    )
+    outbox_upsert_select = (
+        "INSERT INTO ModlogOutbox (guild_id, guild_ticket_id) SELECT guild_id, guild_ticket_id FROM Tickets "
+        "WHERE {} ON DUPLICATE KEY UPDATE revision = revision + 1"
+    )
+
+    def __init__(self, **dbopts):
+        dbopts.setdefault('use_pure', not mysql.connector.HAVE_CEXT)
+        dbopts.setdefault('client_flags', [ClientFlag.FOUND_ROWS])
+        super().__init__(mysql.connector.connect(**dbopts))
+        self.dbopts = dbopts
+
+    def clone(self):
+        return MySQLStorage(**self.dbopts)
+
+    def cursor(self, dictionary=False):
+        return self.conn.cursor(dictionary=dictionary)
+
+    def prepared_cursor(self):
+        return self.conn.cursor(prepared=True)
+
+    def search_tickets(self, guildid, terms, limit, offset=0):
+        # Rank and page the matching ids before reading the tickets themselves
+        return self.fetchrows(
+            "search_tickets",
+            "SELECT TicketView.* FROM ("
+            "SELECT guild_id, guild_ticket_id, MATCH (reason) AGAINST (%s) AS score FROM Tickets "
+            "WHERE guild_id = %s AND MATCH (reason) AGAINST (%s) "
+            "ORDER BY score DESC, guild_ticket_id DESC LIMIT %s OFFSET %s"
+            ") AS hits INNER JOIN TicketView USING (guild_id, guild_ticket_id) "
+            "ORDER BY hits.score DESC, guild_ticket_id DESC",
+            (terms, guildid, terms, limit, offset)
+        )
+
+    def count_search_tickets(self, guildid, terms):
+        return self.fetchone(
+            "count_search_tickets",
+            "SELECT COUNT(*) FROM Tickets WHERE guild_id = %s AND MATCH (reason) AGAINST (%s)",
+            (guildid, terms),
+            dictionary=False
+        )[0]
+
+    def upsert_guild(self, guild_id, staffrole_id, modlog_id):
+        self._wrote(guild_id)
+        return self.execute(
+            "register_guild",
+            ("INSERT INTO Guilds (guild_id, staffrole_id, modlog_id) VALUES (%s, %s, %s) "
+             "ON DUPLICATE KEY UPDATE staffrole_id = %s, modlog_id = %s"),
+            (guild_id, staffrole_id, modlog_id, staffrole_id, modlog_id)
+        )
+
+    def upsert_active_role(self, guildid, roleid, add_action, rm_action, default_duration=None):
+        self._wrote(guildid)
+        return self.execute(
+            "create_active_role",
+            ("INSERT INTO ActiveRoles (guild_id, role_id, add_action_name, rm_action_name, default_duration, active) "
+             "VALUES (%s, %s, %s, %s, %s, %s) "
+             "ON DUPLICATE KEY UPDATE add_action_name = %s, rm_action_name = %s, default_duration = %s, active = TRUE"),
+            (guildid, roleid, add_action, rm_action, default_duration, True, add_action, rm_action, default_duration)
+        )
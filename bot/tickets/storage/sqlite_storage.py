@@ -0,0 +1,249 @@
+import os
+import re
+import sqlite3
+import datetime
+from contextlib import closing
+
+from logger import log
+
+from .base import Storage
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'data')
+SCHEMA_FILE = os.path.join(DATA_DIR, 'createdb_sqlite.sql')
+
+
+class SQLiteStorage(Storage):
+    """
+    Ticket registry stored in an embedded SQLite database in WAL mode,
+    for single-node deployments without a database server.
+    The schema, equivalent to the MySQL schema, is created on first use, and brought up to date on every start.
+
+    Parameters
+    ----------
+    path: str
+        Path to the database file.
+    timeout: float
+        Number of seconds to wait for a lock held by another connection.
+    """
+    name = "sqlite"
+    placeholder = '?'
+    outbox_upsert = (
+        "INSERT INTO ModlogOutbox (guild_id, guild_ticket_id) VALUES (%s, %s) "
+        "ON CONFLICT (guild_id, guild_ticket_id) DO UPDATE SET revision = revision + 1"
+    )
+    # The WHERE clause is required for the upsert to parse after a SELECT
+    outbox_upsert_select = (
+        "INSERT INTO ModlogOutbox (guild_id, guild_ticket_id) SELECT guild_id, guild_ticket_id FROM Tickets "
+        "WHERE {} ON CONFLICT (guild_id, guild_ticket_id) DO UPDATE SET revision = revision + 1"
+    )
+    timestamp_fields = ('created_at', 'modified_at', 'utc_created_at', 'last_ticket_created')
+
+    def __init__(self, path, timeout=30):
+        conn = sqlite3.connect(path, timeout=timeout)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        # The WAL is only synced at checkpoints, so a power loss may lose the last commits, but not corrupt the database
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        super().__init__(conn)
+        self.path = path
+        self.timeout = timeout
+
+        self.create_schema()
+
+    def enable_group_commit(self, window=0.01, max_batch=200):
+        """
+        Commit the writes made within each `window` seconds together, see `GroupCommit`.
+        Each group commit is synced to disk before its writes are acknowledged, which costs one sync per group.
+        """
+        self.conn.execute("PRAGMA synchronous = FULL")
+        super().enable_group_commit(window=window, max_batch=max_batch)
+
+    def create_schema(self):
+        """
+        Create the schema and action types if the database is empty, or bring an existing schema up to date.
+
+        The schema script is run in a scratch database, and each of its objects compared with this database's.
+        Missing objects are created, changed indexes, views and triggers are recreated,
+        and changed tables are rebuilt with the rows of their current columns.
+        Full-text indexes are rebuilt if their content table may have changed.
+        """
+        with open(SCHEMA_FILE) as f:
+            script = f.read()
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ActionTypes'"
+        ).fetchone()
+        if not exists:
+            self.conn.executescript(script)
+            self.conn.commit()
+            return
+
+        with closing(sqlite3.connect(':memory:')) as scratch:
+            scratch.executescript(script)
+            wanted = scratch.execute(
+                "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY rowid"
+            ).fetchall()
+            columns = {
+                name: [column[1] for column in scratch.execute("PRAGMA table_info({})".format(name))]
+                for type, name, sql in wanted if type == 'table'
+            }
+            action_types = scratch.execute("SELECT action_id, action_name FROM ActionTypes").fetchall()
+
+        # The tables backing a virtual table are managed by it
+        virtual = [name for type, name, sql in wanted if sql.startswith("CREATE VIRTUAL TABLE")]
+        wanted = [
+            (type, name, sql) for type, name, sql in wanted
+            if not any(name.startswith(table + '_') for table in virtual)
+        ]
+        current = {
+            name: (table, sql) for name, table, sql in self.conn.execute(
+                "SELECT name, tbl_name, sql FROM sqlite_master WHERE sql IS NOT NULL"
+            )
+        }
+        if all(current.get(name, (None, None))[1] == sql for type, name, sql in wanted):
+            self._add_action_types(action_types)
+            return
+
+        # Rebuilt tables are renamed away without rewriting the references to them
+        self.conn.execute("PRAGMA foreign_keys = OFF")
+        self.conn.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            self.conn.execute("BEGIN")
+            rebuilt = False
+            applied = []
+            for type, name, sql in wanted:
+                if name in current and current[name][1] == sql:
+                    continue
+                applied.append(name)
+                if name not in current:
+                    self.conn.execute(sql)
+                elif type == 'table' and name not in virtual:
+                    old_columns = [column[1] for column in self.conn.execute("PRAGMA table_info({})".format(name))]
+                    kept = ", ".join(column for column in columns[name] if column in old_columns)
+                    self.conn.execute("ALTER TABLE {0} RENAME TO {0}_old".format(name))
+                    self.conn.execute(sql)
+                    self.conn.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {0}_old".format(name, kept))
+                    # Also drops the indexes and triggers of the old table, which are then recreated
+                    self.conn.execute("DROP TABLE {}_old".format(name))
+                    current = {key: value for key, value in current.items() if value[0] != name}
+                    rebuilt = True
+                else:
+                    self.conn.execute("DROP {} {}".format(type.upper(), name))
+                    self.conn.execute(sql)
+                if type == 'table' and name in virtual:
+                    rebuilt = True
+            if rebuilt:
+                for name in virtual:
+                    self.conn.execute("INSERT INTO {0} ({0}) VALUES ('rebuild')".format(name))
+            if self.conn.execute("PRAGMA foreign_key_check").fetchone() is not None:
+                raise sqlite3.IntegrityError("The schema update would break a foreign key constraint.")
+            self._add_action_types(action_types)
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.execute("PRAGMA legacy_alter_table = OFF")
+            self.conn.execute("PRAGMA foreign_keys = ON")
+        log(
+            "Updated the database schema: {}.".format(", ".join(applied)),
+            context="SQLITE_STORAGE"
+        )
+
+    def _add_action_types(self, action_types):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO ActionTypes (action_id, action_name) VALUES (?, ?)", action_types
+        )
+        self.conn.commit()
+
+    def clone(self):
+        return SQLiteStorage(self.path, timeout=self.timeout)
+
+    def cursor(self, dictionary=False):
+        return closing(self.conn.cursor())
+
+    def _row(self, row):
+        row = dict(row)
+        for field in self.timestamp_fields:
+            value = row.get(field, None)
+            if isinstance(value, str):
+                row[field] = datetime.datetime.fromisoformat(value)
+        return row
+
+    def _rows(self, columns, rows):
+        positions = [i for i, column in enumerate(columns) if column in self.timestamp_fields]
+        if not positions:
+            return rows
+        converted = []
+        for row in rows:
+            row = list(row)
+            for i in positions:
+                if isinstance(row[i], str):
+                    row[i] = datetime.datetime.fromisoformat(row[i])
+            converted.append(row)
+        return converted
+
+    @staticmethod
+    def dt_to_timestamp(dt):
+        if dt.tzinfo:
+            dt = dt.astimezone(datetime.timezone.utc)
+        # Same format as CURRENT_TIMESTAMP, so that timestamps compare correctly
+        return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    @staticmethod
+    def _match_query(terms):
+        """
+        Build an FTS5 query matching any of the words in `terms`.
+        Each word is quoted, so that the query syntax is never interpreted.
+        """
+        return " OR ".join('"{}"'.format(word) for word in re.findall(r'\w+', terms))
+
+    def search_tickets(self, guildid, terms, limit, offset=0):
+        query = self._match_query(terms)
+        if not query:
+            return (), []
+        # CROSS JOIN keeps the full-text index as the outer loop, rather than scanning the guild's tickets
+        return self.fetchrows(
+            "search_tickets",
+            "SELECT TicketView.* FROM TicketSearch "
+            "CROSS JOIN Tickets ON Tickets.ticket_rowid = TicketSearch.rowid "
+            "INNER JOIN TicketView ON TicketView.guild_id = Tickets.guild_id "
+            "AND TicketView.guild_ticket_id = Tickets.guild_ticket_id "
+            "WHERE TicketSearch MATCH %s AND Tickets.guild_id = %s "
+            "ORDER BY TicketSearch.rank, Tickets.guild_ticket_id DESC LIMIT %s OFFSET %s",
+            (query, guildid, limit, offset)
+        )
+
+    def count_search_tickets(self, guildid, terms):
+        query = self._match_query(terms)
+        if not query:
+            return 0
+        return self.fetchone(
+            "count_search_tickets",
+            "SELECT COUNT(*) FROM TicketSearch "
+            "CROSS JOIN Tickets ON Tickets.ticket_rowid = TicketSearch.rowid "
+            "WHERE TicketSearch MATCH %s AND Tickets.guild_id = %s",
+            (query, guildid),
+            dictionary=False
+        )[0]
+
+    def upsert_guild(self, guild_id, staffrole_id, modlog_id):
+        self._wrote(guild_id)
+        return self.execute(
+            "register_guild",
+            ("INSERT INTO Guilds (guild_id, staffrole_id, modlog_id) VALUES (%s, %s, %s) "
+             "ON CONFLICT (guild_id) DO UPDATE SET staffrole_id = excluded.staffrole_id, modlog_id = excluded.modlog_id"),
+            (guild_id, staffrole_id, modlog_id)
+        )
+
+    def upsert_active_role(self, guildid, roleid, add_action, rm_action, default_duration=None):
+        self._wrote(guildid)
+        return self.execute(
+            "create_active_role",
+            ("INSERT INTO ActiveRoles (guild_id, role_id, add_action_name, rm_action_name, default_duration, active) "
+             "VALUES (%s, %s, %s, %s, %s, TRUE) "
+             "ON CONFLICT (role_id) DO UPDATE SET "
+             "add_action_name = excluded.add_action_name, rm_action_name = excluded.rm_action_name, "
+             "default_duration = excluded.default_duration, active = TRUE"),
+            (guildid, roleid, add_action, rm_action, default_duration)
+        )
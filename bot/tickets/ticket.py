@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import discord
 
@@ -20,14 +21,48 @@ class Ticket(object):
         'modified_by_id',
         'modified_at'
     )
+    # Fields shown in the modlog embed, which need the modlog message to be edited when modified
+    embed_fields = (
+        'action_id',
+        'moderator_id',
+        'victim_id',
+        'role_id',
+        'reason'
+    )
+
+    _positions = {}  # columns: ((field, column index or `None`), ...), see `from_rows`
 
     def __init__(self, interface, **ticket_data):
+        self._setup(interface)
+        for field in self.ticket_fields:
+            setattr(self, field, ticket_data.get(field, None))
+
+    def _setup(self, interface):
         self.interface = interface
         self.client = interface.client
         self.message = None
 
-        for field in self.ticket_fields:
-            setattr(self, field, ticket_data.get(field, None))
+        self.version = 0  # Incremented by `update`, invalidates the rendered embed and summary
+        self._rendered = {}  # name: (key, output)
+
+    @classmethod
+    def from_rows(cls, interface, columns, rows):
+        """
+        Build tickets from tuple rows with the given columns, as returned by `Storage.fetchrows`.
+        """
+        positions = cls._positions.get(columns, None)
+        if positions is None:
+            positions = cls._positions[columns] = tuple(
+                (field, columns.index(field) if field in columns else None) for field in cls.ticket_fields
+            )
+        tickets = []
+        for row in rows:
+            ticket = cls.__new__(cls)
+            ticket._setup(interface)
+            for field, i in positions:
+                setattr(ticket, field, row[i] if i is not None else None)
+            tickets.append(ticket)
+        return tickets
 
     def __lt__(self, other):
         return self.created_at < other.created_at
@@ -35,9 +70,31 @@ class Ticket(object):
     def __eq__(self, other):
         return self.guild_id == other.guild_id and self.guild_ticket_id == other.guild_ticket_id
 
+    def _memoised(self, name, key, render):
+        """
+        Return the cached output of `render`, rendering it again if `key` has changed since the last render.
+        The key should hold the rendered values, such as names, rather than the objects they come from,
+        since objects compare by id.
+        """
+        cached = self._rendered.get(name, None)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        output = render()
+        self._rendered[name] = (key, output)
+        return output
+
     @property
     def embed(self):
-        user = self.client.get_user(self.victim_id)
+        """
+        The ticket embed, cached until the ticket is updated or the victim is resolved or renamed.
+        The embed is shared between accesses, and should not be modified.
+        """
+        # The victim is only shown if already resolved, see `UserResolver.fetch`
+        user = self.interface.users.get(self.victim_id)
+        key = (self.version, str(user) if user else None)
+        return self._memoised('embed', key, lambda: self._render_embed(user))
+
+    def _render_embed(self, user):
         embed = discord.Embed(
             title="{} {} {}".format(
                 self.action,
@@ -57,9 +114,12 @@ class Ticket(object):
 
     @property
     def summary(self):
-        user = self.client.get_user(self.victim_id)
+        user = self.interface.users.get(self.victim_id)
         guild = self.client.get_guild(self.guild_id)
+        key = (self.version, str(user) if user else None, guild.name if guild else None)
+        return self._memoised('summary', key, lambda: self._render_summary(user, guild))
 
+    def _render_summary(self, user, guild):
         return "(#{}) {} {} {} {}".format(
                 self.guild_ticket_id,
                 self.action,
@@ -68,28 +128,56 @@ class Ticket(object):
                 "in {}".format(guild) if guild else ""
         )
 
+    @property
+    def log_summary(self):
+        """
+        Summary of the ticket for use in user logs, linking to the modlog message if it has been posted.
+        """
+        if self.modlog_msg_id is not None:
+            link = "[#{ticket_number}](https://discordapp.com/channels/{guildid}/{modlog}/{modlog_msg_id})".format(
+                ticket_number=self.guild_ticket_id,
+                guildid=self.guild_id,
+                modlog=self.interface.get_modlog_id(self.guild_id),
+                modlog_msg_id=self.modlog_msg_id
+            )
+        else:
+            link = "#{}".format(self.guild_ticket_id)
+        return (
+            "{time} "
+            "{link}: "
+            "{action} by {moderator}\n"
+            "```{reason}```"
+        ).format(
+            time=self.created_at,
+            link=link,
+            action=self.action,
+            moderator="<@{}>".format(self.moderator_id),
+            reason=self.reason or "No reason."
+        )
+
     async def refresh(self):
         """
         Updates the ticket embed in the mod log.
         Assumes `msgid` is set and the ticket has been posted.
         """
         if not self.message:
-            channel = self.client.get_channel(self.interface.guilds[self.guild_id].modlog_id)
+            modlog_id = self.interface.get_modlog_id(self.guild_id)
+            channel = self.client.get_channel(modlog_id) or await self.client.fetch_channel(modlog_id)
             self.message = await channel.fetch_message(self.modlog_msg_id)
             if self.message is None:
                 # TODO: Complain loudly, maybe repost?
                 raise Exception("Attempting to update a ticket, but couldn't find the ticket message!")
+        await self.interface.users.fetch(self.victim_id)
         await self.message.edit(embed=self.embed)
 
-    def update(self, **new_ticket_data):
-        # Update ticket in database
-        set_str = ", ".join("{} = %s".format(key) for key in new_ticket_data.keys())
-        with self.interface.conn.cursor() as cursor:
-            cursor.execute(
-                "UPDATE Tickets SET {} WHERE guild_id = %s AND guild_ticket_id = %s".format(set_str),
-                (*new_ticket_data.values(), self.guild_id, self.guild_ticket_id)
-            )
-            self.interface.conn.commit()
+    async def update(self, **new_ticket_data):
+        # Update ticket in database, queueing the modlog message to be edited if the embed changes
+        publish = any(field in self.embed_fields for field in new_ticket_data)
+        await self.interface.storage.update_ticket(
+            self.guild_id, self.guild_ticket_id, new_ticket_data, publish=publish
+        )
+        if publish:
+            self.interface.outbox.notify()
 
         # Store old attributes for mod queues
         old_moderator_id = self.moderator_id
@@ -98,6 +186,10 @@ class Ticket(object):
         # Update own attributes
         for attr, value in new_ticket_data.items():
             setattr(self, attr, value)
+        self.version += 1
+
+        if new_ticket_data.get('undo_at', None) is not None:
+            self.interface.scheduler.schedule(self)
 
         # Modify the mod queues appropriately
         if not old_resolved:
@@ -113,16 +205,14 @@ class Ticket(object):
                 asyncio.ensure_future(self.interface.queue_ticket(self))
 
     async def update_reason(self, modified_by_id, new_reason, resolved=True):
-        self.update(
+        await self.update(
             modified_by_id=modified_by_id,
             reason=new_reason,
             resolved=resolved
         )
-        await self.refresh()
 
     async def update_moderator(self, modified_by_id, new_mod_id):
-        self.update(
+        await self.update(
             modified_by_id=modified_by_id,
             moderator_id=new_mod_id
         )
-        await self.refresh()
@@ -0,0 +1,144 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+import discord
+
+from logger import log
+from metrics import Counter
+
+
+# Metrics
+user_lookups = Counter(
+    "ticketbot_user_lookups_total",
+    "User lookups made through the user resolver, by where the user was found.",
+    labels=("source",)
+)
+
+
+class UserResolver(object):
+    """
+    Resolves users from their ids, without relying on the client member cache.
+
+    Users are looked up in the client cache first, then in an LRU of previously fetched users.
+    Users in neither are fetched from the API, with at most `concurrency` requests in progress at once.
+    Users which don't exist are cached as `None`, so unknown users are only fetched once per `ttl`.
+
+    Parameters
+    ----------
+    client: discord.Client
+        The client to look up and fetch users with.
+    maxsize: int
+        Maximum number of fetched users to keep.
+    ttl: int
+        Number of seconds before a fetched user is fetched again.
+    concurrency: int
+        Maximum number of users fetched at once.
+    """
+    def __init__(self, client, maxsize=10000, ttl=3600, concurrency=8):
+        self.client = client
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._cache = OrderedDict()  # userid: (expires_at, user), least recently used first
+        self._pending = {}  # userid: fetch task in progress
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _lookup(self, userid):
+        """
+        Look up a user in the LRU.
+        Returns: `(found, user)`, where `user` is `None` for a user known not to exist.
+        """
+        entry = self._cache.get(userid, None)
+        if entry is None:
+            return (False, None)
+        if entry[0] < time.monotonic():
+            del self._cache[userid]
+            return (False, None)
+        self._cache.move_to_end(userid)
+        return (True, entry[1])
+
+    def _store(self, userid, user):
+        self._cache[userid] = (time.monotonic() + self.ttl, user)
+        self._cache.move_to_end(userid)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def get(self, userid):
+        """
+        Retrieve a user from the client cache or the LRU, without fetching.
+        Returns: `discord.User` or `None` if the user isn't cached.
+        """
+        user = self.client.get_user(userid)
+        if user is None:
+            _, user = self._lookup(userid)
+        return user
+
+    async def fetch(self, userid, raise_errors=False):
+        """
+        Retrieve a user, fetching them from the API if they aren't cached.
+        Concurrent fetches of the same user share a single request.
+        If `raise_errors` is set, a transient failure raises the `discord.HTTPException`,
+        so that it can be told apart from a user which doesn't exist.
+        Returns: `discord.User` or `None` if the user doesn't exist or couldn't be fetched.
+        """
+        user = self.client.get_user(userid)
+        if user is not None:
+            user_lookups.inc(source="client")
+            return user
+
+        found, user = self._lookup(userid)
+        if found:
+            user_lookups.inc(source="lru")
+            return user
+
+        task = self._pending.get(userid, None)
+        if task is None:
+            task = self._pending[userid] = asyncio.ensure_future(self._fetch(userid))
+            task.add_done_callback(lambda _: self._pending.pop(userid, None))
+        try:
+            return await asyncio.shield(task)
+        except discord.HTTPException:
+            if raise_errors:
+                raise
+            return None
+
+    async def _fetch(self, userid):
+        async with self._semaphore:
+            try:
+                user = await self.client.fetch_user(userid)
+            except discord.NotFound:
+                user = None
+            except discord.HTTPException as e:
+                # Transient failure, don't cache the result
+                user_lookups.inc(source="error")
+                log(
+                    "Failed to fetch user: {}".format(e),
+                    context="USER_RESOLVER",
+                    level=logging.WARNING,
+                    user_id=userid
+                )
+                raise
+        user_lookups.inc(source="fetch" if user is not None else "unknown")
+        self._store(userid, user)
+        return user
+
+    async def fetch_many(self, userids, return_errors=False):
+        """
+        Retrieve several users at once, fetching the uncached users concurrently.
+        If `return_errors` is set, users which failed to fetch map to their `discord.HTTPException`.
+        Returns: Dictionary of `userid: discord.User`, with `None` for users which couldn't be resolved.
+        """
+        userids = list(set(userids))
+
+        async def fetch(userid):
+            try:
+                return await self.fetch(userid, raise_errors=True)
+            except discord.HTTPException as e:
+                return e if return_errors else None
+        users = await asyncio.gather(*(fetch(userid) for userid in userids))
+        return dict(zip(userids, users))
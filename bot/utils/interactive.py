@@ -3,9 +3,24 @@ import discord
 from cmdClient import Context
 from cmdClient.lib import UserCancelled, ResponseTimedOut
 
+from metrics import Counter, Gauge
+
 from .lib import paginate_list
 
 
+# Metrics
+active_sessions = Gauge(
+    "ticketbot_interactive_sessions",
+    "Interactive sessions currently waiting on user input, by kind.",
+    labels=("kind",)
+)
+sessions_started = Counter(
+    "ticketbot_interactive_sessions_total",
+    "Interactive sessions started, by kind.",
+    labels=("kind",)
+)
+
+
 @Context.util
 async def listen_for(ctx, allowed_input=None, timeout=120, lower=True, check=None):
     """
@@ -103,10 +118,14 @@ async def selector(ctx, header, select_from, timeout=120, max_len=20):
 
     # Listen for valid input
     valid_input = [str(i+1) for i in range(0, len(select_from))] + ['c', 'C']
+    sessions_started.inc(kind="selector")
+    active_sessions.inc(kind="selector")
     try:
         result_msg = await ctx.listen_for(valid_input, timeout=timeout)
     except ResponseTimedOut:
         raise ResponseTimedOut("Selector timed out waiting for a response.")
+    finally:
+        active_sessions.dec(kind="selector")
 
     # Try and delete the selector message and the user response.
     try:
@@ -192,26 +211,31 @@ async def _pager(ctx, out_msg, pages, locked):
         return result
 
     # Begin loop
-    while True:
-        # Wait for a valid reaction, break if we time out
-        try:
-            reaction, user = await ctx.client.wait_for('reaction_add', check=check, timeout=300)
-        except asyncio.TimeoutError:
-            break
-
-        # Attempt to remove the user's reaction, silently ignore errors
-        asyncio.ensure_future(out_msg.remove_reaction(reaction.emoji, user))
-
-        # Change the page number
-        page += 1 if reaction.emoji == next_emoji else -1
-        page %= len(pages)
-
-        # Edit the message with the new page
-        active_page = pages[page]
-        if isinstance(active_page, discord.Embed):
-            await out_msg.edit(embed=active_page)
-        else:
-            await out_msg.edit(content=active_page)
+    sessions_started.inc(kind="pager")
+    active_sessions.inc(kind="pager")
+    try:
+        while True:
+            # Wait for a valid reaction, break if we time out
+            try:
+                reaction, user = await ctx.client.wait_for('reaction_add', check=check, timeout=300)
+            except asyncio.TimeoutError:
+                break
+
+            # Attempt to remove the user's reaction, silently ignore errors
+            asyncio.ensure_future(out_msg.remove_reaction(reaction.emoji, user))
+
+            # Change the page number
+            page += 1 if reaction.emoji == next_emoji else -1
+            page %= len(pages)
+
+            # Edit the message with the new page
+            active_page = pages[page]
+            if isinstance(active_page, discord.Embed):
+                await out_msg.edit(embed=active_page)
+            else:
+                await out_msg.edit(content=active_page)
+    finally:
+        active_sessions.dec(kind="pager")
 
     # Clean up by removing the reactions
     try:
@@ -250,10 +274,14 @@ async def input(ctx, msg="", timeout=120):
         return m.author == ctx.author and m.channel == ctx.ch
 
     # Listen for the reply
+    sessions_started.inc(kind="input")
+    active_sessions.inc(kind="input")
     try:
         result_msg = await ctx.client.wait_for("message", check=checks, timeout=timeout)
-    except asnycio.TimeoutError:
+    except asyncio.TimeoutError:
         raise ResponseTimedOut("Session timed out waiting for user response.") from None
+    finally:
+        active_sessions.dec(kind="input")
 
     result = result_msg.content
 
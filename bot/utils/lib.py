@@ -1,3 +1,6 @@
+import re
+
+
 def prop_tabulate(prop_list, value_list):
     """
     Turns a list of properties and corresponding list of values into
@@ -54,6 +57,37 @@ def paginate_list(item_list, block_length=20, style="markdown", title=None):
     return pages
 
 
+def paginate_summaries(summaries, page_len=2048):
+    """
+    Join a list of summary strings into pages of at most `page_len` characters,
+    suitable for use as embed descriptions.
+    Summaries are separated by newlines, and are split across pages if they are too long.
+    Parameters
+    ----------
+    summaries: List(str)
+        List of summary strings to paginate.
+    page_len: int
+        Maximum number of characters in each page.
+    Returns: List[str]
+    """
+    pages = []
+    current_page = ""
+    for summary in summaries:
+        if len(current_page) > page_len:
+            pages.append(current_page[:page_len])
+            current_page = current_page[page_len:]
+
+        if current_page and len(current_page) + len(summary) > page_len:
+            pages.append(current_page)
+            current_page = summary
+        else:
+            current_page += "\n" + summary
+
+    if current_page:
+        pages.append(current_page)
+    return pages
+
+
 def progress_bar(current, total, prefix='Progress', suffix='Complete', fill='█', length=50):
     """
     Creates a progress bar from the current value and total value with ASCII blocks.
@@ -80,4 +114,42 @@ def progress_bar(current, total, prefix='Progress', suffix='Complete', fill='█
         current=current,
         total=total,
         suffix=suffix
-    )
\ No newline at end of file
+    )
+
+
+DURATION_UNITS = {
+    'w': 7 * 24 * 60 * 60,
+    'd': 24 * 60 * 60,
+    'h': 60 * 60,
+    'm': 60,
+    's': 1
+}
+
+
+def parse_duration(duration_str):
+    """
+    Parse a duration string such as `1d 12h` or `30m` into a number of seconds.
+    Parameters
+    ----------
+    duration_str: str
+        Duration made of numbers followed by one of the units `w`, `d`, `h`, `m` or `s`.
+    Returns: int
+    Raises ValueError if the string is not a valid duration.
+    """
+    lowered = duration_str.lower()
+    if not re.match(r"^(\s*\d+\s*[wdhms])+\s*$", lowered):
+        raise ValueError("Invalid duration `{}`.".format(duration_str))
+    parts = re.findall(r"(\d+)\s*([wdhms])", lowered)
+    return sum(int(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def format_duration(seconds):
+    """
+    Format a number of seconds as a duration string accepted by `parse_duration`, e.g. `1d 12h`.
+    """
+    parts = []
+    for unit, length in DURATION_UNITS.items():
+        if seconds >= length:
+            parts.append("{}{}".format(seconds // length, unit))
+            seconds %= length
+    return " ".join(parts) or "0s"
@@ -8,7 +8,7 @@ from cmdClient.checks import in_guild
     requires=[in_guild]
 )
 async def has_manage_guild(ctx, *args, **kwargs):
-    return ctx.ch.permissions_for(ctx.author).manage_guild
+    return ctx.client.permissions.get(ctx.author).permissions.manage_guild
 
 
 @check(
@@ -26,6 +26,5 @@ async def registered_guild(ctx, *args, **kwargs):
     requires=[registered_guild]
 )
 async def is_moderator(ctx, *args, **kwargs):
-    manage_guild = ctx.ch.permissions_for(ctx.author).manage_guild
-    staffrole_id = ctx.client.tickets.guilds[ctx.guild.id].staffrole_id
-    return manage_guild or staffrole_id in [r.id for r in ctx.author.roles]
+    perms = ctx.client.permissions.get(ctx.author)
+    return perms.permissions.manage_guild or perms.has_role(ctx.client.tickets.guilds[ctx.guild.id].staffrole_id)
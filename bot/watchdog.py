@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+from logger import log
+from metrics import Counter, Histogram
+
+
+# Metrics
+loop_lag = Histogram(
+    "ticketbot_loop_lag_seconds",
+    "Delay between when the event loop watchdog was scheduled to wake up and when it ran.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+loop_stalls = Counter(
+    "ticketbot_loop_stalls_total",
+    "Number of times the event loop was blocked for longer than the watchdog threshold."
+)
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopWatchdog(object):
+    """
+    Measures the scheduling lag of the event loop, and finds what blocks it.
+
+    A task on the loop wakes up every `interval` seconds, recording how late it ran.
+    A separate thread checks that the task keeps waking up.
+    When the loop has been blocked for longer than `threshold` seconds,
+    the thread captures the stack of the loop thread while it is still blocked, and logs it,
+    naming the innermost bot frame as the blocking call site.
+    At most one stack is logged every `report_interval` seconds, the others are only counted.
+
+    Parameters
+    ----------
+    loop: asyncio.AbstractEventLoop
+        The loop to watch.
+    interval: float
+        Number of seconds between the wake ups of the watchdog task.
+    threshold: float
+        Number of seconds the loop may be blocked for before it is reported.
+    report_interval: float
+        Minimum number of seconds between two logged stacks.
+    """
+    def __init__(self, loop, interval=0.25, threshold=0.25, report_interval=60):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+
+        self.loop_thread = None
+        self._last_tick = None  # Monotonic time of the last wake up of the watchdog task
+        self._reported_tick = None  # Last wake up after which a stall was captured
+        self._last_report = None
+        self._suppressed = 0
+
+    def start(self):
+        asyncio.ensure_future(self.run(), loop=self.loop)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def run(self):
+        self.loop_thread = threading.get_ident()
+        while True:
+            self._last_tick = time.monotonic()
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            loop_lag.observe(max(0, self.loop.time() - start - self.interval))
+
+    def _watch(self):
+        while True:
+            time.sleep(self.threshold / 4)
+            last_tick = self._last_tick
+            if last_tick is None or last_tick == self._reported_tick:
+                continue
+            blocked = time.monotonic() - last_tick - self.interval
+            if blocked > self.threshold:
+                self._reported_tick = last_tick
+                self._stalled(blocked)
+
+    def _stalled(self, blocked):
+        """
+        Count a stall, and log the stack of the blocked loop thread unless one was logged recently.
+        """
+        loop_stalls.inc()
+        now = time.monotonic()
+        if self._last_report is not None and now - self._last_report < self.report_interval:
+            self._suppressed += 1
+            return
+        frame = sys._current_frames().get(self.loop_thread, None)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        site = next(
+            (entry for entry in reversed(stack)
+             if entry.filename.startswith(BOT_DIR) and entry.filename != os.path.abspath(__file__)),
+            stack[-1]
+        )
+        if site.filename.startswith(BOT_DIR):
+            location = "{}:{}".format(os.path.relpath(site.filename, BOT_DIR), site.lineno)
+        else:
+            location = "{}:{}".format(site.filename, site.lineno)
+        log(
+            "Event loop blocked for over {:.0f}ms at {} in {}.{}\n{}".format(
+                blocked * 1000,
+                location,
+                site.name,
+                " {} similar stalls were not logged.".format(self._suppressed) if self._suppressed else "",
+                "".join(traceback.format_list(stack)).rstrip()
+            ),
+            context="LOOP_WATCHDOG",
+            level=logging.WARNING,
+            blocked_ms=round(blocked * 1000),
+            site=location
+        )
+        self._last_report = now
+        self._suppressed = 0
@@ -1,6 +1,6 @@
 USE TicketRegistry;
 
-DROP TABLE IF EXISTS Guilds, ActionTypes, ActiveRoles, Tickets, TicketHistory;
+DROP TABLE IF EXISTS Guilds, ActionTypes, ActiveRoles, Tickets, TicketHistory, ModlogOutbox;
 DROP VIEW IF EXISTS TicketView, GuildView;
 DROP FUNCTION IF EXISTS TO_UTC;
 
@@ -39,7 +39,7 @@ CREATE TABLE Tickets (
   action_id TINYINT NOT NULL,
   moderator_id BIGINT NOT NULL,
   victim_id BIGINT NOT NULL,
-  modlog_msg_id BIGINT NOT NULL,
+  modlog_msg_id BIGINT,
   auditlog_id BIGINT,
   undo_at BIGINT,
   role_id BIGINT,
@@ -57,13 +57,28 @@ CREATE TABLE Tickets (
     REFERENCES ActiveRoles (role_id)
 );
 
+CREATE INDEX tickets_victim ON Tickets (guild_id, victim_id, guild_ticket_id);
+CREATE INDEX tickets_undo_at ON Tickets (undo_at);
+CREATE FULLTEXT INDEX tickets_reason_search ON Tickets (reason);
+
+CREATE TABLE ModlogOutbox (
+  guild_id BIGINT,
+  guild_ticket_id INT,
+  revision INT NOT NULL DEFAULT 0,
+  attempts INT NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (guild_id, guild_ticket_id),
+  FOREIGN KEY (guild_id, guild_ticket_id)
+    REFERENCES Tickets (guild_id, guild_ticket_id)
+);
+
 CREATE TABLE TicketHistory (
   guild_id BIGINT,
   guild_ticket_id INT,
   action_id TINYINT NOT NULL,
   moderator_id BIGINT NOT NULL,
   victim_id BIGINT NOT NULL,
-  modlog_msg_id BIGINT NOT NULL,
+  modlog_msg_id BIGINT,
   auditlog_id BIGINT,
   undo_at BIGINT,
   role_id BIGINT,
@@ -113,11 +128,10 @@ SELECT
   t3.role_id,
   MAX(t2.guild_ticket_id) AS ticket_count, 
   TO_UTC(t1.created_at) AS utc_created_at, 
-  TO_UTC(MAX(t2.created_at)) AS last_ticket_created,
-  MAX(t2.auditlog_id) AS last_audit_entry
+  TO_UTC(MAX(t2.created_at)) AS last_ticket_created
 FROM Guilds t1 
 LEFT JOIN Tickets t2 USING (guild_id) 
-LEFT JOIN ActiveRoles t3 ON t3.guild_id = t2.guild_id AND t3.active = TRUE 
+LEFT JOIN ActiveRoles t3 ON t3.guild_id = t1.guild_id AND t3.active = TRUE 
 GROUP BY t1.guild_id, t1.staffrole_id, t1.modlog_id, t3.role_id, utc_created_at;
 
 
@@ -126,7 +140,9 @@ CREATE TRIGGER ticket_insert_history
   ON Tickets FOR EACH ROW
     INSERT INTO TicketHistory SELECT * FROM Tickets WHERE guild_id = NEW.guild_id AND guild_ticket_id = NEW.guild_ticket_id;
 
+-- Filling in the modlog message id of a new ticket is not a modification
 CREATE TRIGGER ticket_update_history
   AFTER UPDATE
   ON Tickets FOR EACH ROW
-    INSERT INTO TicketHistory SELECT * FROM Tickets WHERE guild_id = NEW.guild_id AND guild_ticket_id = NEW.guild_ticket_id;
+    INSERT INTO TicketHistory SELECT * FROM Tickets WHERE guild_id = NEW.guild_id AND guild_ticket_id = NEW.guild_ticket_id
+      AND OLD.modlog_msg_id <=> NEW.modlog_msg_id;
@@ -0,0 +1,191 @@
+-- SQLite equivalent of createdb.sql and seeddata.sql.
+-- All timestamps are stored in UTC as 'YYYY-MM-DD HH:MM:SS', so no TO_UTC conversion is required.
+
+CREATE TABLE Guilds (
+  guild_id INTEGER PRIMARY KEY,
+  staffrole_id INTEGER NOT NULL,
+  modlog_id INTEGER NOT NULL,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE ActionTypes (
+  action_id INTEGER PRIMARY KEY,
+  action_name VARCHAR(255)
+);
+
+CREATE TABLE ActiveRoles (
+  role_id INTEGER PRIMARY KEY,
+  guild_id INTEGER NOT NULL,
+  add_action_name VARCHAR(255),
+  rm_action_name VARCHAR(255),
+  default_duration INTEGER,
+  active BOOL NOT NULL DEFAULT TRUE,
+  FOREIGN KEY (guild_id)
+    REFERENCES Guilds (guild_id)
+);
+
+CREATE TABLE Tickets (
+  guild_id INTEGER,
+  guild_ticket_id INTEGER,
+  action_id INTEGER NOT NULL,
+  moderator_id INTEGER NOT NULL,
+  victim_id INTEGER NOT NULL,
+  modlog_msg_id INTEGER,
+  auditlog_id INTEGER,
+  undo_at INTEGER,
+  role_id INTEGER,
+  reason VARCHAR(2047),
+  resolved BOOL NOT NULL,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  modified_by_id INTEGER,
+  modified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  ticket_rowid INTEGER PRIMARY KEY,
+  UNIQUE (guild_id, guild_ticket_id),
+  FOREIGN KEY (guild_id)
+    REFERENCES Guilds (guild_id),
+  FOREIGN KEY (action_id)
+    REFERENCES ActionTypes (action_id),
+  FOREIGN KEY (role_id)
+    REFERENCES ActiveRoles (role_id)
+);
+
+CREATE INDEX tickets_victim ON Tickets (guild_id, victim_id, guild_ticket_id);
+CREATE INDEX tickets_unresolved ON Tickets (resolved, created_at);
+CREATE INDEX tickets_undo_at ON Tickets (undo_at);
+
+-- Full-text index of the ticket reasons, equivalent to the MySQL FULLTEXT index.
+-- It indexes the Tickets rows in place, and is kept up to date by the triggers below.
+-- Rows are referenced by ticket_rowid, an alias of the rowid which, unlike an implicit rowid, VACUUM preserves.
+CREATE VIRTUAL TABLE TicketSearch USING fts5 (
+  reason,
+  content = 'Tickets',
+  content_rowid = 'ticket_rowid',
+  tokenize = 'porter unicode61'
+);
+
+CREATE TABLE ModlogOutbox (
+  guild_id INTEGER,
+  guild_ticket_id INTEGER,
+  revision INTEGER NOT NULL DEFAULT 0,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (guild_id, guild_ticket_id),
+  FOREIGN KEY (guild_id, guild_ticket_id)
+    REFERENCES Tickets (guild_id, guild_ticket_id)
+);
+
+CREATE TABLE TicketHistory (
+  guild_id INTEGER,
+  guild_ticket_id INTEGER,
+  action_id INTEGER NOT NULL,
+  moderator_id INTEGER NOT NULL,
+  victim_id INTEGER NOT NULL,
+  modlog_msg_id INTEGER,
+  auditlog_id INTEGER,
+  undo_at INTEGER,
+  role_id INTEGER,
+  reason VARCHAR(2047),
+  resolved BOOL NOT NULL,
+  created_at TIMESTAMP,
+  modified_by_id INTEGER,
+  modified_at TIMESTAMP,
+  FOREIGN KEY (guild_id, guild_ticket_id)
+    REFERENCES Tickets (guild_id, guild_ticket_id)
+);
+
+CREATE INDEX tickethistory_ticket ON TicketHistory (guild_id, guild_ticket_id);
+
+
+CREATE VIEW TicketView
+AS
+SELECT
+  t1.guild_id,
+  t1.guild_ticket_id,
+  t1.action_id,
+  t1.moderator_id,
+  t1.victim_id,
+  t1.modlog_msg_id,
+  t1.auditlog_id,
+  t1.undo_at,
+  t1.role_id,
+  t1.reason,
+  t1.resolved,
+  t1.created_at,
+  t1.modified_by_id,
+  t1.modified_at,
+  t3.active as role_active,
+  CASE t2.action_name
+    WHEN 'ROLE_ADD' THEN t3.add_action_name
+    WHEN 'ROLE_RM' THEN t3.rm_action_name
+    ELSE t2.action_name
+  END as action
+FROM Tickets t1
+INNER JOIN ActionTypes t2 USING (action_id)
+LEFT JOIN ActiveRoles t3 USING (role_id);
+
+CREATE VIEW GuildView
+AS
+SELECT
+  t1.guild_id,
+  t1.staffrole_id,
+  t1.modlog_id,
+  t3.role_id,
+  MAX(t2.guild_ticket_id) AS ticket_count,
+  t1.created_at AS utc_created_at,
+  MAX(t2.created_at) AS last_ticket_created
+FROM Guilds t1
+LEFT JOIN Tickets t2 USING (guild_id)
+LEFT JOIN ActiveRoles t3 ON t3.guild_id = t1.guild_id AND t3.active = TRUE
+GROUP BY t1.guild_id, t1.staffrole_id, t1.modlog_id, t3.role_id, utc_created_at;
+
+
+-- History mechanism, equivalent to the MySQL triggers.
+-- The update trigger also maintains modified_at, replacing MySQL's ON UPDATE CURRENT_TIMESTAMP.
+-- Its own UPDATE does not fire it again, since recursive triggers are disabled by default.
+-- Filling in the modlog message id of a new ticket is not a modification, so doesn't fire it either.
+-- The history doesn't record ticket_rowid, which is local to this database.
+CREATE TRIGGER ticket_insert_history
+  AFTER INSERT
+  ON Tickets FOR EACH ROW
+BEGIN
+  INSERT INTO TicketHistory SELECT
+    guild_id, guild_ticket_id, action_id, moderator_id, victim_id, modlog_msg_id, auditlog_id, undo_at, role_id, reason, resolved, created_at, modified_by_id, modified_at
+  FROM Tickets WHERE guild_id = NEW.guild_id AND guild_ticket_id = NEW.guild_ticket_id;
+END;
+
+CREATE TRIGGER ticket_update_history
+  AFTER UPDATE OF action_id, moderator_id, victim_id, auditlog_id, undo_at, role_id, reason, resolved, modified_by_id
+  ON Tickets FOR EACH ROW
+BEGIN
+  UPDATE Tickets SET modified_at = CURRENT_TIMESTAMP
+    WHERE guild_id = NEW.guild_id AND guild_ticket_id = NEW.guild_ticket_id;
+  INSERT INTO TicketHistory SELECT
+    guild_id, guild_ticket_id, action_id, moderator_id, victim_id, modlog_msg_id, auditlog_id, undo_at, role_id, reason, resolved, created_at, modified_by_id, modified_at
+  FROM Tickets WHERE guild_id = NEW.guild_id AND guild_ticket_id = NEW.guild_ticket_id;
+END;
+
+-- Full-text index maintenance
+CREATE TRIGGER ticket_insert_search
+  AFTER INSERT
+  ON Tickets FOR EACH ROW
+BEGIN
+  INSERT INTO TicketSearch (rowid, reason) VALUES (NEW.ticket_rowid, NEW.reason);
+END;
+
+CREATE TRIGGER ticket_update_search
+  AFTER UPDATE OF reason
+  ON Tickets FOR EACH ROW
+BEGIN
+  INSERT INTO TicketSearch (TicketSearch, rowid, reason) VALUES ('delete', OLD.ticket_rowid, OLD.reason);
+  INSERT INTO TicketSearch (rowid, reason) VALUES (NEW.ticket_rowid, NEW.reason);
+END;
+
+
+INSERT INTO ActionTypes (action_id, action_name)
+VALUES
+    (0, 'BAN'),
+    (1, 'UNBAN'),
+    (2, 'KICK'),
+    (3, 'NOTE'),
+    (4, 'ROLE_ADD'),
+    (5, 'ROLE_RM');
@@ -0,0 +1,6 @@
+-- Migration for databases created before the undo scheduler.
+-- Apply the migrations in order with `mysql < data/migrations/NNN_name.sql`, each only once.
+
+USE TicketRegistry;
+
+CREATE INDEX tickets_undo_at ON Tickets (undo_at);
@@ -0,0 +1,26 @@
+-- Migration for databases created before the modlog outbox.
+-- Tickets are created before their modlog message is posted, so the message id may be NULL.
+
+USE TicketRegistry;
+
+ALTER TABLE Tickets MODIFY modlog_msg_id BIGINT;
+ALTER TABLE TicketHistory MODIFY modlog_msg_id BIGINT;
+
+CREATE TABLE ModlogOutbox (
+  guild_id BIGINT,
+  guild_ticket_id INT,
+  revision INT NOT NULL DEFAULT 0,
+  attempts INT NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (guild_id, guild_ticket_id),
+  FOREIGN KEY (guild_id, guild_ticket_id)
+    REFERENCES Tickets (guild_id, guild_ticket_id)
+);
+
+-- Filling in the modlog message id of a new ticket is not a modification
+DROP TRIGGER IF EXISTS ticket_update_history;
+CREATE TRIGGER ticket_update_history
+  AFTER UPDATE
+  ON Tickets FOR EACH ROW
+    INSERT INTO TicketHistory SELECT * FROM Tickets WHERE guild_id = NEW.guild_id AND guild_ticket_id = NEW.guild_ticket_id
+      AND OLD.modlog_msg_id <=> NEW.modlog_msg_id;
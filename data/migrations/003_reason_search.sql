@@ -0,0 +1,5 @@
+-- Migration for databases created before the ticket search.
+
+USE TicketRegistry;
+
+CREATE FULLTEXT INDEX tickets_reason_search ON Tickets (reason);
@@ -0,0 +1,19 @@
+-- Migration for databases created before the per-action audit log watermarks.
+-- The last audit entry of each guild is no longer read, so GuildView drops it.
+
+USE TicketRegistry;
+
+CREATE OR REPLACE VIEW GuildView
+AS
+SELECT
+  t1.guild_id,
+  t1.staffrole_id,
+  t1.modlog_id,
+  t3.role_id,
+  MAX(t2.guild_ticket_id) AS ticket_count,
+  TO_UTC(t1.created_at) AS utc_created_at,
+  TO_UTC(MAX(t2.created_at)) AS last_ticket_created
+FROM Guilds t1
+LEFT JOIN Tickets t2 USING (guild_id)
+LEFT JOIN ActiveRoles t3 ON t3.guild_id = t2.guild_id AND t3.active = TRUE
+GROUP BY t1.guild_id, t1.staffrole_id, t1.modlog_id, t3.role_id, utc_created_at;
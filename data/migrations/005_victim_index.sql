@@ -0,0 +1,6 @@
+-- Migration for databases created before superseded timed actions were skipped.
+-- Finds the later tickets against a victim without scanning the rest of the guild.
+
+USE TicketRegistry;
+
+CREATE INDEX tickets_victim ON Tickets (guild_id, victim_id, guild_ticket_id);